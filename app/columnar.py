@@ -0,0 +1,143 @@
+"""Columnar /query results: Arrow IPC stream or Parquet instead of JSON
+
+The simplified patient fields become typed Arrow columns, with gender, age
+group, city and state dictionary-encoded. The summary is computed from the
+columns, and it is stored with the query in the schema metadata under
+"summary" and "query" as JSON, so one payload carries what the JSON response
+does. Clients opt in through the Accept header; JSON stays the default.
+"""
+import json
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from app.utils import PATIENT_FIELDS, iter_bundle_resources, patient_fields
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+PARQUET = "application/vnd.apache.parquet"
+# Accept values that select a columnar format
+MEDIA_TYPES = {
+    ARROW_STREAM: ARROW_STREAM,
+    PARQUET: PARQUET,
+    "application/x-parquet": PARQUET,
+}
+
+_CATEGORY = pa.dictionary(pa.int32(), pa.string())
+PATIENT_SCHEMA = pa.schema([
+    ("name", pa.string()),
+    ("gender", _CATEGORY),
+    ("age", pa.int32()),
+    ("age_group", _CATEGORY),
+    ("birthDate", pa.string()),
+    ("city", _CATEGORY),
+    ("state", _CATEGORY),
+])
+
+
+def _media_ranges(accept: str) -> list:
+    """(media range, q) pairs of an Accept header, in header order; a malformed q counts as 1"""
+    ranges = []
+    for part in accept.split(","):
+        media_range, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    pass
+        ranges.append((media_range.strip().lower(), q))
+    return ranges
+
+
+def _json_quality(ranges: list) -> tuple:
+    """q of JSON from the most specific range naming it, and whether it was named explicitly"""
+    for media_range in ("application/json", "application/*", "*/*"):
+        qualities = [q for name, q in ranges if name == media_range]
+        if qualities:
+            return max(qualities), media_range == "application/json"
+    return 0.0, False
+
+
+def negotiate(accept: str | None) -> str | None:
+    """The columnar media type an Accept header prefers, or None for JSON
+
+    The columnar type with the highest q wins (the first one on a tie) and q=0
+    rules a type out. It is only chosen over JSON when its q is higher, or equal
+    while JSON is merely covered by a wildcard.
+    """
+    if not accept:
+        return None
+    ranges = _media_ranges(accept)
+    best, best_q = None, 0.0
+    for media_range, q in ranges:
+        media_type = MEDIA_TYPES.get(media_range)
+        if media_type and q > best_q:
+            best, best_q = media_type, q
+    if best is None:
+        return None
+    json_q, explicit = _json_quality(ranges)
+    if json_q > best_q or (explicit and json_q == best_q):
+        return None
+    return best
+
+
+def accepts_json(accept: str | None) -> bool:
+    """Whether an Accept header allows a JSON response (no header, JSON or a wildcard, with q > 0)"""
+    if not accept:
+        return True
+    return _json_quality(_media_ranges(accept))[0] > 0
+
+
+def patients_table(fhir_response: dict, params: dict) -> pa.Table:
+    """Columns of simplify_patient_data's patients, with its summary and query as metadata"""
+    columns = [[] for _ in PATIENT_FIELDS]
+    for resource in iter_bundle_resources(fhir_response, "Patient"):
+        for column, value in zip(columns, patient_fields(resource)):
+            column.append(value)
+    arrays = [pa.array(values, type=field.type) for values, field in zip(columns, PATIENT_SCHEMA)]
+    schema = PATIENT_SCHEMA
+    if params.get("_has:Condition:patient:code"):
+        condition = params["_has:Condition:patient:code"]
+        arrays.append(pa.DictionaryArray.from_arrays(pa.array([0] * len(arrays[0]), type=pa.int32()),
+                                                     pa.array([str(condition)])))
+        schema = schema.append(pa.field("condition", _CATEGORY))
+    table = pa.Table.from_arrays(arrays, schema=schema)
+    return table.replace_schema_metadata({
+        "query": json.dumps(params),
+        "summary": json.dumps(summarize_table(table)),
+    })
+
+
+def _distribution(column, skip_empty: bool = False) -> dict:
+    """Counter-like {value: count} in order of first appearance"""
+    counts = pc.value_counts(column)
+    values = counts.field("values").to_pylist()
+    return {value: count for value, count in zip(values, counts.field("counts").to_pylist())
+            if value or not skip_empty}
+
+
+def summarize_table(table: pa.Table) -> dict:
+    """The same summary as PatientSummary.as_dict, computed from the columns"""
+    return {
+        "total_patients": table.num_rows,
+        "gender_distribution": _distribution(table.column("gender")),
+        "age_distribution": _distribution(table.column("age_group")),
+        "locations": {
+            "cities": _distribution(table.column("city"), skip_empty=True),
+            "states": _distribution(table.column("state"), skip_empty=True),
+        }
+    }
+
+
+def serialize(table: pa.Table, media_type: str) -> bytes:
+    """Encode `table` as an Arrow IPC stream or a Parquet file"""
+    sink = pa.BufferOutputStream()
+    if media_type == PARQUET:
+        pq.write_table(table, sink, compression="zstd")
+    else:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -1,4 +1,75 @@
-FHIR_BASE_URL = "https://hapi.fhir.org/baseR4"  # Replace with your FHIR server
+import os
+
+FHIR_BASE_URL = os.environ.get("FHIR_BASE_URL", "https://hapi.fhir.org/baseR4")  # Replace with your FHIR server
 FHIR_HEADERS = {
     "Content-Type": "application/fhir+json"
 }
+
+# Upstream FHIR client (see app/fhir_client.py)
+FHIR_POOL_SIZE = int(os.environ.get("FHIR_POOL_SIZE", 20))               # connections per upstream
+FHIR_CONNECT_TIMEOUT = float(os.environ.get("FHIR_CONNECT_TIMEOUT", 10))  # seconds
+FHIR_READ_TIMEOUT = float(os.environ.get("FHIR_READ_TIMEOUT", 90))        # seconds
+FHIR_MAX_RETRIES = int(os.environ.get("FHIR_MAX_RETRIES", 3))             # retries on 429/5xx
+FHIR_BACKOFF_BASE = float(os.environ.get("FHIR_BACKOFF_BASE", 0.5))      # seconds, doubled per retry
+
+# Bundle simplification (see app/fast_simplify.py): "numpy" (orjson decode, vectorized summary, same
+# output) or "python" (the reference simplify_patient_data)
+SIMPLIFY_ENGINE = os.environ.get("SIMPLIFY_ENGINE", "numpy")
+
+# Where /query searches go: "remote" (FHIR_BASE_URL) or "replica", the local SQLite copy built with
+# `python -m app.replica import ...` (see app/replica.py)
+FHIR_BACKEND = os.environ.get("FHIR_BACKEND", "remote")
+FHIR_REPLICA_PATH = os.environ.get("FHIR_REPLICA_PATH", ".data/fhir_replica.sqlite")
+
+# Upstream response cache (see app/fhir_cache.py): "memory", "sqlite" (shared by all workers) or "none"
+FHIR_CACHE = os.environ.get("FHIR_CACHE", "memory")
+FHIR_CACHE_TTL = float(os.environ.get("FHIR_CACHE_TTL", 300))                     # seconds
+FHIR_CACHE_MAX_ENTRIES = int(os.environ.get("FHIR_CACHE_MAX_ENTRIES", 1024))
+FHIR_CACHE_MAX_BYTES = int(os.environ.get("FHIR_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+FHIR_CACHE_PATH = os.environ.get("FHIR_CACHE_PATH", ".cache/fhir_responses.sqlite")
+
+# Trim Patient search results to the fields the simplifier reads:
+# "elements" (_elements=...), "summary" (_summary=data, for servers without _elements) or "none"
+FHIR_PROJECTION = os.environ.get("FHIR_PROJECTION", "elements")
+
+# Paginated (stream mode) searches
+FHIR_PAGE_SIZE = int(os.environ.get("FHIR_PAGE_SIZE", 100))  # _count per page
+FHIR_MAX_PAGES = int(os.environ.get("FHIR_MAX_PAGES", 100))  # stop following next links after this
+
+# Multi-condition searches (see app/fan_out.py): patient IDs per Patient?_id= fetch, and how many
+# of those fetches may be in flight at once
+FHIR_FAN_OUT_ID_BATCH = int(os.environ.get("FHIR_FAN_OUT_ID_BATCH", 100))
+FHIR_FAN_OUT_CONCURRENCY = int(os.environ.get("FHIR_FAN_OUT_CONCURRENCY", 4))
+
+# Condition vocabulary: a terminology index directory or vocabulary file, DISEASE_CODE when unset
+TERMINOLOGY_PATH = os.environ.get("TERMINOLOGY_PATH") or None
+
+# spaCy pipeline (see nlp_query/spacy_pipeline.py): "slim" drops components that don't produce entities
+SPACY_MODEL = os.environ.get("SPACY_MODEL", "en_core_web_sm")
+SPACY_PROFILE = os.environ.get("SPACY_PROFILE", "slim")
+SPACY_CACHE_DIR = os.environ.get("SPACY_CACHE_DIR", ".cache/spacy")  # serialized pipelines, "" to rebuild
+
+# Prebuilt artifact bundle (see nlp_query/artifacts.py): load models, spaCy pipeline and vocabulary
+# offline from this directory instead of the HF hub cache
+ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR") or None
+
+# Shared model server (see nlp_query/model_server.py): workers send NER/classification to the process
+# listening on this Unix socket instead of loading the models themselves; unset loads them in-process
+MODEL_SERVER_SOCKET = os.environ.get("MODEL_SERVER_SOCKET") or None
+MODEL_SERVER_TIMEOUT = float(os.environ.get("MODEL_SERVER_TIMEOUT", 60))  # seconds per request and for startup
+
+# Models load in the background after startup; /readyz reports ready once they are loaded and, with
+# MODEL_WARM_UP, a few representative queries have gone through every stage
+MODEL_WARM_UP = os.environ.get("MODEL_WARM_UP", "1").lower() in ("1", "true", "yes")
+
+# Micro-batching of /query inference (see app/scheduler.py)
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 16))        # prompts per model batch
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 10))  # how long to wait for a batch to fill
+BATCH_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", 128))     # queries per chunk on /query/batch
+
+# Per-request profiling (see app/profiling.py)
+PROFILE_ENABLED = os.environ.get("PROFILE_ENABLED", "0").lower() in ("1", "true", "yes")  # honour X-Profile
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))  # fraction of /query traffic to profile
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 5))  # stack sampling interval
+PROFILE_DIR = os.environ.get("PROFILE_DIR", ".profiles")  # where profiles are written
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 200))  # newest profiles kept in PROFILE_DIR
@@ -0,0 +1,123 @@
+"""Multi-condition Patient searches as concurrent single-condition searches
+
+Chained `_has:Condition:patient:code` parameters, one per condition, make
+the server evaluate every chain for every candidate patient, and HAPI is slow
+at that. Instead, the `fan_out` plan of a PatientPrompt request is run as:
+
+1. One subjects-only `Condition?code=` search per condition, all issued
+   concurrently, so latency follows the slowest condition.
+2. An intersection (AND) or union (OR) of the subject patient IDs, with sets.
+3. Batched `Patient?_id=` fetches of the matching IDs, carrying the
+   demographic filters and projection of the original search. At most
+   `concurrency` batches are in flight, and fetching stops once one page of
+   patients is filled (the search's `_count`, else DEFAULT_COUNT), so the result
+   is capped like the first page the chained search would return.
+
+The result is one searchset Bundle of Patients, so the usual simplifiers
+apply unchanged. When a Condition search has more pages than `max_pages`, its
+subject list would be incomplete and an intersection would silently lose
+patients, so FanOutTruncated is raised instead and the caller falls back to the
+chained search.
+"""
+import asyncio
+from urllib.parse import parse_qsl
+
+from app.fhir_client import FHIRClient, add_query_params
+from app.utils import iter_bundle_resources, next_page_url
+
+DEFAULT_COUNT = 20  # page size of a search without _count on HAPI, what the chained search returns
+
+
+class FanOutTruncated(Exception):
+    """A per-condition search had more pages than the fan-out may follow"""
+
+
+def patient_id(reference: str) -> str | None:
+    """The id in a "Patient/<id>" reference (relative, absolute or versioned), None for other types"""
+    if not reference:
+        return None
+    parts = reference.split("/_history/")[0].rstrip("/").split("/")
+    if len(parts) >= 2 and parts[-2] == "Patient":
+        return parts[-1]
+    return None
+
+
+async def condition_subjects(client: FHIRClient, url: str, page_size: int, max_pages: int = None) -> list:
+    """Distinct subject patient IDs of a Condition search, in the order they first appear
+
+    Raises FanOutTruncated when the search still has a `next` page after `max_pages`.
+    """
+    subjects = {}
+    pages = client.iter_pages(add_query_params(url, {"_count": page_size}), max_pages=max_pages)
+    fetched, bundle = 0, None
+    try:
+        async for bundle in pages:
+            fetched += 1
+            for resource in iter_bundle_resources(bundle, "Condition"):
+                subject = patient_id((resource.get("subject") or {}).get("reference"))
+                if subject:
+                    subjects[subject] = None
+    finally:
+        await pages.aclose()
+    if max_pages is not None and fetched >= max_pages and next_page_url(bundle):
+        raise FanOutTruncated(f"{url} has more than {max_pages} pages of {page_size} Conditions")
+    return list(subjects)
+
+
+def combine(id_lists: list, operator: str) -> list:
+    """Intersect ("and") or unite ("or") the ID lists, keeping first-seen order"""
+    if not id_lists:
+        return []
+    if operator == "or":
+        return list(dict.fromkeys(i for ids in id_lists for i in ids))
+    common = set(id_lists[0]).intersection(*id_lists[1:])
+    return [i for i in id_lists[0] if i in common]
+
+
+def page_count(url: str) -> int:
+    """The `_count` of a search URL, DEFAULT_COUNT without one"""
+    for name, value in parse_qsl(url.partition("?")[2]):
+        if name == "_count":
+            return int(value)
+    return DEFAULT_COUNT
+
+
+async def fetch_patients(client: FHIRClient, url: str, ids: list, batch_size: int, limit: int,
+                         concurrency: int = 4) -> tuple:
+    """(patients, total): the first `limit` Patients of `ids` that pass the filters in `url`
+
+    `_id=` searches of at most `batch_size` IDs run in order, `concurrency` at a
+    time, until `limit` patients are found. `total` counts every match, or is
+    None when IDs were left unchecked.
+    """
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+    patients = []
+    for start in range(0, len(batches), concurrency):
+        bundles = await asyncio.gather(*(
+            client.get_json(add_query_params(url, {"_id": ",".join(batch), "_count": len(batch)}))
+            for batch in batches[start:start + concurrency]
+        ))
+        patients += [resource for bundle in bundles for resource in iter_bundle_resources(bundle, "Patient")]
+        if len(patients) >= limit and start + concurrency < len(batches):
+            return patients[:limit], None
+    return patients[:limit], len(patients)
+
+
+async def fan_out_search(client: FHIRClient, fan_out: dict, page_size: int, max_pages: int = None,
+                         id_batch_size: int = 100, concurrency: int = 4) -> dict:
+    """Run a `fan_out` plan and return the first page of matching patients as a searchset Bundle
+
+    `total` is only set when every matching ID was checked.
+    """
+    id_lists = await asyncio.gather(*(condition_subjects(client, url, page_size, max_pages)
+                                      for url in fan_out["searches"]))
+    ids = combine(id_lists, fan_out.get("operator", "and"))
+    patients, total = [], 0
+    if ids:
+        patients, total = await fetch_patients(client, fan_out["patients"], ids, id_batch_size,
+                                               limit=page_count(fan_out["patients"]), concurrency=concurrency)
+    bundle = {"resourceType": "Bundle", "type": "searchset"}
+    if total is not None:
+        bundle["total"] = total
+    bundle["entry"] = [{"resource": resource, "search": {"mode": "match"}} for resource in patients]
+    return bundle
@@ -0,0 +1,250 @@
+"""Vectorized simplify_patient_data for large bundles
+
+One pass over the Bundle pulls the raw fields into flat lists. Birth years are
+parsed once per distinct birthDate string, and genders, cities and states
+become integer codes. Ages are then computed as one NumPy subtraction and
+bucketed with `np.digitize` against AGE_GROUPS, and the distributions come
+from `np.unique` over the codes, ordered by first appearance. Years too big
+for int64 are left out of the array and aged one by one. The output,
+including the key order of every distribution, is identical to
+`app.utils.simplify_patient_data`.
+
+`loads` decodes the raw Bundle bytes with orjson when it is installed and
+falls back to the standard library otherwise (or when orjson rejects
+something `json` accepts, such as NaN or integers over 64 bits); `dumps` does
+the same for the response. The one difference from the python engine is in
+encoding: a NaN or Infinity copied from such a Bundle into the response is
+written as null, where Starlette's JSONResponse fails the request. Decoding and simplifying a big bundle allocates
+millions of containers that can't form cycles, so both run with the cyclic
+garbage collector paused; otherwise its full collections take more time than
+the work itself.
+
+    python -m app.fast_simplify --size 100000   # check against simplify_patient_data and time both
+"""
+import argparse
+import gc
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+from app.utils import AGE_GROUPS, PATIENT_FIELDS, categorize_age, iter_bundle_resources
+from app.utils import simplify_patient_data as reference_simplify
+
+try:
+    import orjson
+except ImportError:  # optional, json is only slower
+    orjson = None
+
+# Lower edge of every AGE_GROUPS bucket after the first, for np.digitize
+AGE_BINS = np.array([youngest for _, youngest, _ in AGE_GROUPS[1:]])
+AGE_LABELS = [label for label, _, _ in AGE_GROUPS] + ["unknown"]
+# Smaller bundles go through the reference implementation, NumPy's per-call overhead outweighs the gain
+MIN_VECTORIZED_ENTRIES = 256
+# Birth years outside this range would overflow the int64 age array
+MAX_VECTORIZED_YEAR = 10 ** 12
+_NO_YEAR = object()
+_gc_lock = threading.Lock()
+_gc_pauses = 0
+_gc_was_enabled = False
+
+
+@contextmanager
+def gc_paused():
+    """Pause cyclic garbage collection, re-enabling it when the last concurrent pause ends"""
+    global _gc_pauses, _gc_was_enabled
+    with _gc_lock:
+        if _gc_pauses == 0:
+            _gc_was_enabled = gc.isenabled()
+            gc.disable()
+        _gc_pauses += 1
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_pauses -= 1
+            if _gc_pauses == 0 and _gc_was_enabled:
+                gc.enable()
+
+
+def loads(body: bytes):
+    """Decode a JSON document, with orjson when available"""
+    with gc_paused():
+        if orjson is not None:
+            try:
+                return orjson.loads(body)
+            except orjson.JSONDecodeError:
+                pass
+        return json.loads(body)
+
+
+def dumps(content) -> bytes:
+    """Encode a response body the way Starlette's JSONResponse does, with orjson when available"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _birth_year(birthdate):
+    """The year calculate_age would use, or None"""
+    if not birthdate:
+        return None
+    try:
+        return int(birthdate.split("-")[0])
+    except Exception:
+        return None
+
+
+class _Codes(dict):
+    """Value -> integer code, assigned in order of first appearance
+
+    Codes are keyed on (type, value), so equal values of different types
+    (1, 1.0 and True) keep their own code and every row keeps its own value.
+    """
+    def __init__(self):
+        super().__init__()
+        self.values = []
+
+    def code(self, value) -> int:
+        key = (type(value), value)
+        code = self.get(key)
+        if code is None:
+            code = self[key] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _distribution(codes: np.ndarray, values: list, skip_empty: bool = False) -> dict:
+    """Counter-equivalent {values[code]: count}, keyed in order of first appearance like a Counter
+
+    Values that compare equal (1 and True) are counted together under the first one
+    seen, as a Counter would.
+    """
+    unique, first, counts = np.unique(codes, return_index=True, return_counts=True)
+    order = np.argsort(first, kind="stable")
+    distribution = {}
+    for code, count in zip(unique[order].tolist(), counts[order].tolist()):
+        value = values[code]
+        if value or not skip_empty:
+            distribution[value] = distribution.get(value, 0) + count
+    return distribution
+
+
+def simplify_patient_data(fhir_response: dict, params: dict) -> dict:
+    """Same result as app.utils.simplify_patient_data, computed column-wise"""
+    if len(fhir_response.get("entry") or []) < MIN_VECTORIZED_ENTRIES:
+        return reference_simplify(fhir_response, params)
+    with gc_paused():
+        return _simplify(fhir_response, params)
+
+
+def _simplify(fhir_response: dict, params: dict) -> dict:
+    names, birthdates, genders, cities, states = [], [], [], [], []
+    gender_codes, city_codes, state_codes = _Codes(), _Codes(), _Codes()
+    for resource in iter_bundle_resources(fhir_response, "Patient"):
+        name = ""
+        if "name" in resource and resource["name"]:
+            first = resource["name"][0]
+            given = first.get("given") or [""]
+            name = f"{given[0]} {first.get('family', '')}".strip()
+        names.append(name)
+        birthdates.append(resource.get("birthDate"))
+        genders.append(gender_codes.code(resource.get("gender", "unknown")))
+        address = resource.get("address", [])
+        cities.append(city_codes.code(address[0].get("city") if address else None))
+        states.append(state_codes.code(address[0].get("state") if address else None))
+
+    year_cache = {}
+    years = []
+    huge_years = {}  # row -> birth year outside +-MAX_VECTORIZED_YEAR
+    for birthdate in birthdates:
+        try:
+            year = year_cache.get(birthdate, _NO_YEAR)
+        except TypeError:  # unhashable birthDate, parse it directly
+            year = _birth_year(birthdate)
+        else:
+            if year is _NO_YEAR:
+                year = year_cache[birthdate] = _birth_year(birthdate)
+        if year is not None and not -MAX_VECTORIZED_YEAR < year < MAX_VECTORIZED_YEAR:
+            huge_years[len(years)] = year
+            year = None
+        years.append(year)
+
+    current_year = datetime.now().year
+    known = np.fromiter((year is not None for year in years), dtype=bool, count=len(years))
+    ages = current_year - np.fromiter((year or 0 for year in years), dtype=np.int64, count=len(years))
+    group_codes = np.where(known, np.digitize(ages, AGE_BINS), len(AGE_LABELS) - 1)
+
+    age_values = ages.astype(object)
+    age_values[~known] = None
+    for row, year in huge_years.items():
+        age_values[row] = age = current_year - year
+        group_codes[row] = AGE_LABELS.index(categorize_age(age))
+    gender_values, city_values, state_values = gender_codes.values, city_codes.values, state_codes.values
+    columns = [
+        names,
+        [gender_values[code] for code in genders],
+        age_values.tolist(),
+        [AGE_LABELS[code] for code in group_codes.tolist()],
+        birthdates,
+        [city_values[code] for code in cities],
+        [state_values[code] for code in states],
+    ]
+    patients = [dict(zip(PATIENT_FIELDS, row)) for row in zip(*columns)]
+    condition = params.get("_has:Condition:patient:code")
+    if condition:
+        for patient in patients:
+            patient["condition"] = condition
+
+    return {
+        "query": params,
+        "summary": {
+            "total_patients": len(patients),
+            "gender_distribution": _distribution(np.array(genders, dtype=np.int64), gender_values),
+            "age_distribution": _distribution(group_codes, AGE_LABELS),
+            "locations": {
+                "cities": _distribution(np.array(cities, dtype=np.int64), city_values, skip_empty=True),
+                "states": _distribution(np.array(states, dtype=np.int64), state_values, skip_empty=True),
+            }
+        },
+        "patients": patients,
+    }
+
+
+def main():
+    from benchmarks.corpus import synthetic_bundle
+    parser = argparse.ArgumentParser(description="Check the vectorized simplifier against the reference and time both")
+    parser.add_argument("--size", type=int, nargs="+", default=[1000, 100000], help="patients per bundle")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    params = {"_has:Condition:patient:code": "44054006"}
+    for size in args.size:
+        body = json.dumps(synthetic_bundle(size)).encode("utf-8")
+        timings = {}
+        for label, decode, simplify in (("python", json.loads, reference_simplify),
+                                          ("numpy", loads, simplify_patient_data)):
+            best, output = float("inf"), None
+            for _ in range(args.repeat):
+                gc.collect()
+                start = time.perf_counter()
+                result = simplify(decode(body), params)
+                best = min(best, time.perf_counter() - start)
+                output = json.dumps(result)
+                del result  # freeing it is not part of the next timing
+            timings[label] = (best, output)
+        if timings["python"][1] != timings["numpy"][1]:
+            raise SystemExit(f"Output differs from simplify_patient_data for {size} patients")
+        python_s, numpy_s = timings["python"][0], timings["numpy"][0]
+        print(f"{size:>8} patients  decode+simplify  python {python_s * 1000:8.1f} ms  "
+              f"numpy {numpy_s * 1000:8.1f} ms  x{python_s / numpy_s:.2f}  (identical output)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit, urlunsplit
+
+from app.fhir_client import FHIRResponse
+
+# Response headers worth keeping with a cached body
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control")
+
+
+def get_header(headers: dict, name: str, default=None):
+    """Case-insensitive header lookup on a plain dict"""
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return default
+
+
+def canonical_url(url: str) -> str:
+    """Cache key for a FHIR search URL
+
+    Scheme and host are lower-cased and the search parameters sorted, since
+    FHIR gives repeated/reordered parameters the same meaning. Values are kept
+    exactly as encoded.
+    """
+    parts = urlsplit(url)
+    query = "&".join(sorted(pair for pair in parts.query.split("&") if pair))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"), query, ""))
+
+
+@dataclass
+class CacheEntry:
+    """Cached upstream response plus what is needed to revalidate it"""
+    status: int
+    body: bytes
+    headers: dict = field(default_factory=dict)
+    expires_at: float = 0.0
+
+    @property
+    def etag(self):
+        return self.headers.get("ETag")
+
+    @property
+    def last_modified(self):
+        return self.headers.get("Last-Modified")
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+    def is_fresh(self, now: float = None) -> bool:
+        return (now or time.time()) < self.expires_at
+
+    def to_response(self, url: str) -> FHIRResponse:
+        return FHIRResponse(status=self.status, url=url, body=self.body, headers=dict(self.headers))
+
+
+class MemoryCacheStore:
+    """In-process LRU store bounded by entry count and total body size"""
+    blocking = False
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: CacheEntry):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old.size
+        if entry.size > self.max_bytes:
+            return  # would evict everything else and still not fit
+        self.entries[key] = entry
+        self.total_bytes += entry.size
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+
+class SQLiteCacheStore:
+    """On-disk LRU store that every worker process on the host can share
+
+    Triggers keep the entry count and byte total in `fhir_cache_totals`, so a
+    `set` within both bounds costs one upsert, and eviction walks the
+    `accessed_at` index only as far as it has to.
+    """
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int = 1024, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS fhir_cache (
+                    key TEXT PRIMARY KEY,
+                    status INTEGER NOT NULL,
+                    body BLOB NOT NULL,
+                    headers TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS fhir_cache_accessed ON fhir_cache (accessed_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS fhir_cache_totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    entries INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL
+                )
+            """)
+            # counted once here for caches written before the totals existed
+            conn.execute("""
+                INSERT OR IGNORE INTO fhir_cache_totals
+                SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM fhir_cache
+            """)
+            conn.executescript("""
+                CREATE TRIGGER IF NOT EXISTS fhir_cache_insert AFTER INSERT ON fhir_cache BEGIN
+                    UPDATE fhir_cache_totals SET entries = entries + 1, bytes = bytes + new.size;
+                END;
+                CREATE TRIGGER IF NOT EXISTS fhir_cache_delete AFTER DELETE ON fhir_cache BEGIN
+                    UPDATE fhir_cache_totals SET entries = entries - 1, bytes = bytes - old.size;
+                END;
+                CREATE TRIGGER IF NOT EXISTS fhir_cache_resize AFTER UPDATE OF size ON fhir_cache BEGIN
+                    UPDATE fhir_cache_totals SET bytes = bytes + new.size - old.size;
+                END;
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread, in WAL mode so workers can read while one writes"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT status, body, headers, expires_at FROM fhir_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE fhir_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        status, body, headers, expires_at = row
+        return CacheEntry(status=status, body=body, headers=json.loads(headers), expires_at=expires_at)
+
+    def set(self, key: str, entry: CacheEntry):
+        if entry.size > self.max_bytes:
+            return
+        conn = self._connect()
+        with conn:
+            # an upsert rather than INSERT OR REPLACE, whose implicit delete wouldn't fire the trigger
+            conn.execute(
+                """INSERT INTO fhir_cache VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (key) DO UPDATE SET status = excluded.status, body = excluded.body,
+                       headers = excluded.headers, expires_at = excluded.expires_at,
+                       accessed_at = excluded.accessed_at, size = excluded.size""",
+                (key, entry.status, entry.body, json.dumps(entry.headers), entry.expires_at,
+                 time.time(), entry.size),
+            )
+            count, total = conn.execute("SELECT entries, bytes FROM fhir_cache_totals").fetchone()
+            if count <= self.max_entries and total <= self.max_bytes:
+                return
+            # Evict least recently used rows until both bounds hold
+            evicted = []
+            oldest = conn.execute("SELECT key, size FROM fhir_cache ORDER BY accessed_at")
+            for old_key, size in oldest:
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                evicted.append((old_key,))
+                count -= 1
+                total -= size
+            oldest.close()
+            conn.executemany("DELETE FROM fhir_cache WHERE key = ?", evicted)
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM fhir_cache")
+
+
+class FHIRResponseCache:
+    """TTL + LRU cache of upstream FHIR responses keyed by canonical URL
+
+    Fresh entries are served directly. Expired entries that carry an `ETag` or
+    `Last-Modified` are revalidated with a conditional request and a 304 just
+    extends their lifetime. Concurrent requests for the same URL share a single
+    upstream fetch (within this process). Only 200 responses are stored; the TTL
+    comes from `Cache-Control: max-age` when the server sends one, `no-store`
+    responses are never kept, and `max-age=0` ones only if they can be revalidated.
+    """
+    def __init__(self, store=None, ttl: float = 300):
+        self.store = store or MemoryCacheStore()
+        self.ttl = ttl
+        self.stats = Counter({"hits": 0, "misses": 0, "revalidated": 0, "coalesced": 0})
+        self._inflight = {}
+
+    async def _store_call(self, method, *args):
+        if self.store.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    def _entry_ttl(self, headers: dict):
+        """Seconds to keep a response, or None if it must not be stored"""
+        cache_control = get_header(headers, "Cache-Control", "").lower()
+        if "no-store" in cache_control:
+            return None
+        for directive in cache_control.split(","):
+            name, _, value = directive.strip().partition("=")
+            if name == "max-age" and value.isdigit():
+                return int(value)
+        return self.ttl
+
+    async def fetch(self, url: str, fetcher) -> FHIRResponse:
+        """Return the response for `url`, calling `fetcher(url, headers)` only when needed"""
+        key = canonical_url(url)
+        entry = await self._store_call(self.store.get, key)
+        if entry is not None and entry.is_fresh():
+            self.stats["hits"] += 1
+            return entry.to_response(url)
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(self._refresh(key, url, entry, fetcher))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: one caller going away must not cancel the fetch the others are waiting on
+        return await asyncio.shield(task)
+
+    async def _refresh(self, key: str, url: str, entry, fetcher) -> FHIRResponse:
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        response = await fetcher(url, headers)
+
+        if response.status == 304 and entry is not None:
+            self.stats["revalidated"] += 1
+            ttl = self._entry_ttl(response.headers)
+            entry.expires_at = time.time() + (self.ttl if ttl is None else ttl)
+            await self._store_call(self.store.set, key, entry)
+            return entry.to_response(url)
+
+        self.stats["misses"] += 1
+        if response.status == 200:
+            ttl = self._entry_ttl(response.headers)
+            # max-age=0 is only worth storing when the response can be revalidated
+            validator = get_header(response.headers, "ETag") or get_header(response.headers, "Last-Modified")
+            if ttl or (ttl == 0 and validator):
+                kept = {name: get_header(response.headers, name) for name in KEPT_HEADERS
+                        if get_header(response.headers, name) is not None}
+                new_entry = CacheEntry(status=200, body=response.body, headers=kept,
+                                       expires_at=time.time() + ttl)
+                await self._store_call(self.store.set, key, new_entry)
+        return response
+
+    def stats_dict(self) -> dict:
+        return dict(self.stats)
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit, urlencode
+
+import aiohttp
+from yarl import URL
+
+from app.utils import next_page_url
+
+
+class FHIRResponseError(Exception):
+    """Raised when the FHIR server answers with a non-200 status"""
+    def __init__(self, status: int, detail: str):
+        super().__init__(f"FHIR server returned {status}: {detail}")
+        self.status = status
+        self.detail = detail
+
+
+def add_query_params(url: str, params: dict) -> str:
+    """Append search parameters to an already-encoded URL, replacing any with the same name"""
+    base, _, query = url.partition("?")
+    kept = [pair for pair in query.split("&") if pair and pair.split("=", 1)[0] not in params]
+    kept.append(urlencode(params, safe=":,"))
+    return f"{base}?{'&'.join(kept)}"
+
+
+@dataclass
+class FHIRResponse:
+    """Fully read response from a FHIR server"""
+    status: int
+    url: str
+    body: bytes = b""
+    headers: dict = field(default_factory=dict)
+
+    @property
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class FHIRClient:
+    """Async FHIR client with one pooled keep-alive session per upstream server
+
+    Each upstream (scheme + host + port) gets its own aiohttp session whose
+    connector caps the number of concurrent connections to that server.
+    Requests answered with 429 or a 5xx status, and connection errors or
+    timeouts, are retried with full-jitter exponential backoff; a `Retry-After`
+    header is honoured when the server sends one. An optional response cache
+    (see app/fhir_cache.py) sits in front of plain GETs.
+    """
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, headers: dict = None, pool_size: int = 20, pool_sizes: dict = None,
+                 connect_timeout: float = 10, read_timeout: float = 90,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 10,
+                 cache=None):
+        self.headers = dict(headers or {})
+        self.pool_size = pool_size
+        self.pool_sizes = dict(pool_sizes or {})  # origin ("https://host") -> pool size
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cache = cache
+        self.response_listeners = []
+        self._sessions = {}
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _session(self, url: str) -> aiohttp.ClientSession:
+        """Return the pooled session for the upstream that serves `url`"""
+        origin = self._origin(url)
+        session = self._sessions.get(origin)
+        if session is None or session.closed:
+            size = self.pool_sizes.get(origin, self.pool_size)
+            connector = aiohttp.TCPConnector(limit=size, limit_per_host=size)
+            session = aiohttp.ClientSession(connector=connector, headers=self.headers, timeout=self.timeout)
+            self._sessions[origin] = session
+        return session
+
+    def add_response_listener(self, listener):
+        """Call `listener(status, seconds, error)` after every upstream attempt, retries included"""
+        self.response_listeners.append(listener)
+
+    def _notify(self, status, start: float, error: str = None):
+        elapsed = time.perf_counter() - start
+        for listener in self.response_listeners:
+            listener(status, elapsed, error)
+
+    def _retry_delay(self, attempt: int, retry_after: str = None) -> float:
+        """Seconds to wait before the next attempt"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass  # HTTP-date form, fall back to backoff
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def get(self, url: str, headers: dict = None) -> FHIRResponse:
+        """GET a FHIR URL through the cache, if there is one"""
+        if self.cache is not None and not headers:
+            return await self.cache.fetch(url, self._fetch)
+        return await self._fetch(url, headers)
+
+    async def _fetch(self, url: str, headers: dict = None) -> FHIRResponse:
+        """GET a FHIR URL from upstream, retrying throttled or failed attempts"""
+        session = self._session(url)
+        # The generated URLs are already encoded (e.g. %20, _has:...), don't let yarl requote them
+        target = URL(url, encoded=True)
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            start = time.perf_counter()
+            try:
+                async with session.get(target, headers=headers) as resp:
+                    body = await resp.read()
+                    self._notify(resp.status, start)
+                    if resp.status in self.RETRY_STATUSES and not last_attempt:
+                        await asyncio.sleep(self._retry_delay(attempt, resp.headers.get("Retry-After")))
+                        continue
+                    return FHIRResponse(status=resp.status, url=url, body=body, headers=dict(resp.headers))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                self._notify(None, start, type(e).__name__)
+                if last_attempt:
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt))
+
+    async def get_json(self, url: str) -> dict:
+        """GET a FHIR URL and decode the body, raising FHIRResponseError on a non-200 status"""
+        response = await self.get(url)
+        if response.status != 200:
+            raise FHIRResponseError(response.status, response.text)
+        return response.json()
+
+    async def iter_pages(self, url: str, max_pages: int = None):
+        """Yield search Bundles page by page, following `next` links
+
+        The request for page N+1 is already in flight while the caller works on
+        page N, and only one page is held in memory at a time.
+        """
+        pending = asyncio.ensure_future(self.get_json(url))
+        pages = 0
+        try:
+            while pending is not None:
+                bundle = await pending
+                pending = None
+                pages += 1
+                next_url = next_page_url(bundle)
+                if next_url and (max_pages is None or pages < max_pages):
+                    pending = asyncio.ensure_future(self.get_json(next_url))
+                yield bundle
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
+
+    async def close(self):
+        """Close every pooled session"""
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
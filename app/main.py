@@ -1,15 +1,121 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from functools import partial
+import asyncio
+import codecs
+import random
+import time
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import requests
 import os
+import json
+import tempfile
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
-from app.config import FHIR_BASE_URL, FHIR_HEADERS
+from app.config import (
+    FHIR_BASE_URL, FHIR_HEADERS, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS,
+    FHIR_POOL_SIZE, FHIR_CONNECT_TIMEOUT, FHIR_READ_TIMEOUT, FHIR_MAX_RETRIES, FHIR_BACKOFF_BASE,
+    FHIR_PAGE_SIZE, FHIR_MAX_PAGES, FHIR_PROJECTION, FHIR_FAN_OUT_ID_BATCH,
+    FHIR_FAN_OUT_CONCURRENCY,
+    FHIR_CACHE, FHIR_CACHE_TTL, FHIR_CACHE_MAX_ENTRIES, FHIR_CACHE_MAX_BYTES, FHIR_CACHE_PATH,
+    TERMINOLOGY_PATH, BATCH_CHUNK_SIZE, SPACY_MODEL, SPACY_PROFILE, SPACY_CACHE_DIR,
+    PROFILE_ENABLED, PROFILE_SAMPLE_RATE, PROFILE_INTERVAL_MS, PROFILE_DIR, PROFILE_MAX_FILES,
+    MODEL_SERVER_SOCKET, MODEL_SERVER_TIMEOUT, MODEL_WARM_UP, ARTIFACT_DIR, SIMPLIFY_ENGINE,
+    FHIR_BACKEND, FHIR_REPLICA_PATH,
+)
+from app.fhir_cache import FHIRResponseCache, MemoryCacheStore, SQLiteCacheStore
+from app.fhir_client import FHIRClient, FHIRResponseError
+from app.fan_out import FanOutTruncated, fan_out_search
+from app.replica import FHIRReplica, LocalReplicaClient
+from app.streaming import stream_patient_pages
+from app.summary import count_patient_summary
+from app.scheduler import MicroBatcher
+from app import columnar, fast_simplify, metrics
+from app.profiling import RequestProfile, record_stage as record_profile_stage
 from nlp_query.dispatcher import Dispatcher
-from app.utils import simplify_patient_data
+from nlp_query.model_server import RemoteDispatcher
+from nlp_query.batch import compile_chunk, iter_query_records
+from app.utils import simplify_condition_data, simplify_patient_data, SIMPLIFIED_PATIENT_ELEMENTS
+
+# lazy: the models load in the background once the app is up (see lifespan)
+dispatcher_settings = {"projection": {"mode": FHIR_PROJECTION, "elements": SIMPLIFIED_PATIENT_ELEMENTS},
+                       "terminology_path": TERMINOLOGY_PATH, "artifact_dir": ARTIFACT_DIR, "lazy": True}
+if MODEL_SERVER_SOCKET:
+    # models live in the shared model server process, this worker only runs rules and resource classes
+    dispatcher = RemoteDispatcher(MODEL_SERVER_SOCKET, timeout=MODEL_SERVER_TIMEOUT,
+                                  startup_timeout=MODEL_SERVER_TIMEOUT, **dispatcher_settings)
+else:
+    dispatcher = Dispatcher(spacy_model=SPACY_MODEL, spacy_profile=SPACY_PROFILE,
+                            spacy_cache_dir=SPACY_CACHE_DIR, **dispatcher_settings)
+batcher = MicroBatcher(dispatcher, FHIR_BASE_URL, max_batch_size=BATCH_MAX_SIZE,
+                       max_wait_ms=BATCH_MAX_WAIT_MS)
+if SIMPLIFY_ENGINE == "numpy":
+    decode_bundle, simplify_bundle = fast_simplify.loads, fast_simplify.simplify_patient_data
+else:
+    decode_bundle, simplify_bundle = json.loads, simplify_patient_data
+cache_stores = {
+    "memory": lambda: MemoryCacheStore(FHIR_CACHE_MAX_ENTRIES, FHIR_CACHE_MAX_BYTES),
+    "sqlite": lambda: SQLiteCacheStore(FHIR_CACHE_PATH, FHIR_CACHE_MAX_ENTRIES, FHIR_CACHE_MAX_BYTES),
+}
+if FHIR_BACKEND == "replica":
+    # searches are answered from the local SQLite replica, caching its responses would only cost memory
+    fhir_cache = None
+    fhir_client = LocalReplicaClient(FHIRReplica(FHIR_REPLICA_PATH))
+else:
+    fhir_cache = FHIRResponseCache(cache_stores[FHIR_CACHE](), ttl=FHIR_CACHE_TTL) if FHIR_CACHE in cache_stores else None
+    fhir_client = FHIRClient(headers=FHIR_HEADERS, pool_size=FHIR_POOL_SIZE,
+                             connect_timeout=FHIR_CONNECT_TIMEOUT, read_timeout=FHIR_READ_TIMEOUT,
+                             max_retries=FHIR_MAX_RETRIES, backoff_base=FHIR_BACKOFF_BASE,
+                             cache=fhir_cache)
+dispatcher.add_stage_listener(metrics.record_stage)
+dispatcher.add_stage_listener(record_profile_stage)
+fhir_client.add_response_listener(metrics.record_upstream)
+metrics.registry.add_collector(
+    "fhir_nl_response_cache_events_total", "Upstream response cache lookups by outcome", "counter",
+    "outcome", lambda: fhir_cache.stats_dict() if fhir_cache else None,
+)
+metrics.registry.add_collector(
+    "fhir_nl_plan_cache_events_total", "Compiled-plan cache lookups by outcome", "counter",
+    "outcome", lambda: {name: dispatcher.plan_cache.stats[name] for name in ("hits", "misses")}
+    if dispatcher.plan_cache else None,
+)
+metrics.registry.add_collector(
+    "fhir_nl_classifications_total", "Prompts classified by the rule cascade or the zero-shot model",
+    "counter", "path", lambda: dict(dispatcher.classification_paths),
+)
+
+
+async def load_models():
+    """Load the models off the event loop, then warm them up on the inference thread"""
+    try:
+        await asyncio.to_thread(dispatcher.load_models, True)
+        if MODEL_WARM_UP:
+            await batcher.run(dispatcher.warm_up)
+        else:
+            dispatcher.warm_up_state = "skipped"
+        print(f"Models ready: {dispatcher.model_states}")
+    except Exception as e:
+        print(f"Model loading failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the inference scheduler and FHIR connection pool for the lifetime of the app
+
+    The port is bound right away; models load in the background and /readyz
+    reports when traffic can be routed here.
+    """
+    await batcher.start()
+    loading = asyncio.create_task(load_models())
+    yield
+    loading.cancel()
+    await batcher.stop()
+    await fhir_client.close()
+    if isinstance(dispatcher, RemoteDispatcher):
+        dispatcher.client.close()
 
-app = FastAPI(title="FHIR NL Query API")
-dispatcher = Dispatcher()
+
+app = FastAPI(title="FHIR NL Query API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,22 +128,97 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count requests and time them per route; unknown paths share one label"""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    path = route.path if route is not None else "other"
+    metrics.REQUEST_LATENCY.observe(time.perf_counter() - start, path)
+    metrics.REQUESTS.inc(path, str(response.status_code))
+    return response
+
+
 class QueryRequest(BaseModel):
     """Model for incoming query requests"""
     query: str
+    mode: str = "full"  # "full": first page as one JSON document, "stream": every page as NDJSON,
+                        # "summary": counts only, via _summary=count searches (no patients, empty locations)
+    page_size: int | None = None  # _count per page in stream mode
+    max_pages: int | None = None  # stop following next links after this many pages
+
+def model_status() -> dict:
+    return {"models": dict(dispatcher.model_states), "warm_up": dispatcher.warm_up_state}
+
+
+def serving() -> bool:
+    return dispatcher.ready and dispatcher.warm_up_state in ("done", "skipped")
+
+
+def require_ready():
+    """Refuse queries with 503 until the models are loaded and warmed up"""
+    if not serving():
+        raise HTTPException(status_code=503, detail="Models are still loading.", headers={"Retry-After": "5"})
+
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: 200 while the process is healthy, 503 once a model failed to load"""
+    status = model_status()
+    failed = [state for state in [*status["models"].values(), status["warm_up"]] if state.startswith("failed")]
+    return JSONResponse(status_code=503 if failed else 200, content={"status": "failed" if failed else "ok", **status})
+
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: 200 only once every model is loaded and warmed up"""
+    ready = serving()
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, **model_status()})
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit / miss counts of the upstream response cache and the compiled-plan cache"""
+    return {
+        "fhir": fhir_cache.stats_dict() if fhir_cache else None,
+        "plans": dispatcher.plan_cache.stats_dict() if dispatcher.plan_cache else None,
+    }
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Stage latencies, upstream status codes, bundle sizes and cache counters in Prometheus text format"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+def profile_requested(x_profile: str | None) -> bool:
+    """X-Profile opts a request in when PROFILE_ENABLED; PROFILE_SAMPLE_RATE picks live traffic at random"""
+    if PROFILE_ENABLED and x_profile and x_profile.lower() not in ("0", "false", "no"):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
 
 @app.post("/query")
-def handle_query(request: QueryRequest):
+async def handle_query(request: QueryRequest, response: Response, x_profile: str | None = Header(default=None),
+                       accept: str | None = Header(default=None)):
     if request is None or not request.query:
         raise HTTPException(status_code=400, detail="Query parameter is required.")             
+    require_ready()
     query_string = request.query
+    profile = RequestProfile(PROFILE_INTERVAL_MS / 1000) if profile_requested(x_profile) else None
     
     try:
         print(f"Received query: {query_string}")
         print(f"Dispatch generated: {query_string}")
         
-        # 1. Process the NL query using your dispatch engine
-        fhir_request = dispatcher.dispatch(query_string, FHIR_BASE_URL)
+        # 1. Process the NL query using your dispatch engine (batched with concurrent queries)
+        if profile is None:
+            fhir_request = await batcher.submit(query_string)
+        else:
+            # profiled prompts skip the micro-batch so the samples only contain this request
+            fhir_request = await batcher.run(partial(profile.sample, dispatcher.dispatch, query_string,
+                                                     FHIR_BASE_URL, stage="dispatch"))
 
         # fhir_request should return a dict like:
         # {"method": "GET", "url": "[base]/Patient?birthdate=...", "parameters": {...}}
@@ -48,30 +229,162 @@ def handle_query(request: QueryRequest):
         params = fhir_request.get("parameters", {})
         
         print(f"FHIR request to {url} with params {params}")
+        if fhir_request.get("exception"):
+            raise HTTPException(status_code=500, detail=fhir_request["error"])
         if not url:
             raise HTTPException(status_code=400, detail="Invalid FHIR request generated.")
         
         handlers = {
-            "GET": lambda url, params: requests.get(url, headers=FHIR_HEADERS, timeout=90)
+            "GET": fhir_client.get
         }
         if method not in handlers:
             raise HTTPException(status_code=501, detail=f"Method {method} not implemented.")
+
+        resource_type = url.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1]
+        if resource_type != "Patient" and request.mode != "full":
+            raise HTTPException(status_code=400, detail=f"{request.mode} mode only supports Patient searches.")
+        if resource_type != "Patient" and columnar.negotiate(accept) and not columnar.accepts_json(accept):
+            raise HTTPException(status_code=406, detail=f"{resource_type} searches are only returned as JSON.")
+
+        if request.mode == "stream":
+            stream = await stream_patient_pages(
+                fhir_client, url, params,
+                page_size=request.page_size or FHIR_PAGE_SIZE,
+                max_pages=request.max_pages or FHIR_MAX_PAGES,
+            )
+            headers = await save_profile(profile) if profile else None
+            return StreamingResponse(stream, media_type="application/x-ndjson", headers=headers)
+        if request.mode == "summary":
+            results = await count_patient_summary(fhir_client, fhir_request)
+            if profile:
+                response.headers.update(await save_profile(profile))
+            return {"results": results}
             
-        response = handlers[method](url, params)
+        start = time.perf_counter()
+        fhir_data = None
+        if fhir_request.get("fan_out"):
+            # several conditions: concurrent per-condition searches instead of the chained _has url
+            try:
+                fhir_data = await fan_out_search(fhir_client, fhir_request["fan_out"], page_size=FHIR_PAGE_SIZE,
+                                                 max_pages=FHIR_MAX_PAGES, id_batch_size=FHIR_FAN_OUT_ID_BATCH,
+                                                 concurrency=FHIR_FAN_OUT_CONCURRENCY)
+            except FanOutTruncated as e:
+                print(f"Fan-out incomplete, sending the chained search instead: {e}")
+        if fhir_data is None:
+            fhir_response = await handlers[method](url)
+            if profile:
+                profile.add_stage("upstream", time.perf_counter() - start)
 
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
+            if fhir_response.status != 200:
+                raise HTTPException(status_code=fhir_response.status, detail=fhir_response.text)
 
-        fhir_data = response.json()
-        # 3. Convert to simplified JSON
-        return {"results": simplify_patient_data(fhir_data, params)}
+            fhir_data = decode_bundle(fhir_response.body)
+        elif profile:
+            profile.add_stage("upstream", time.perf_counter() - start)
+        bundle_size = len(fhir_data.get("entry") or [])
+        metrics.BUNDLE_SIZE.observe(bundle_size)
+        media_type = columnar.negotiate(accept)
+        if media_type and resource_type == "Patient":
+            # typed columns as Arrow IPC / Parquet, the summary travels in the schema metadata
+            with metrics.timed_stage("simplify", bundle_size):
+                table = columnar.patients_table(fhir_data, params)
+                body = await asyncio.to_thread(columnar.serialize, table, media_type)
+            headers = {"X-Total-Patients": str(table.num_rows)}
+            if profile:
+                headers.update(await save_profile(profile))
+            return Response(content=body, media_type=media_type, headers=headers)
+        # 3. Convert to simplified JSON (Condition searches join the _include'd patients)
+        simplify = simplify_condition_data if resource_type == "Condition" else simplify_bundle
+        with metrics.timed_stage("simplify", bundle_size):
+            if profile is None:
+                results = simplify(fhir_data, params)
+            else:
+                results = await asyncio.to_thread(profile.sample, simplify, fhir_data, params,
+                                                  stage="simplify")
+        payload, headers = {"results": results}, {}
+        if profile:
+            headers = await save_profile(profile)
+            if x_profile and PROFILE_ENABLED:
+                payload["profile"] = profile.as_dict()
+        if SIMPLIFY_ENGINE == "numpy":
+            # encode directly instead of FastAPI's jsonable_encoder walk over every patient
+            return Response(content=fast_simplify.dumps(payload), media_type="application/json", headers=headers)
+        response.headers.update(headers)
+        return payload
 
+    except FHIRResponseError as e:
+        raise HTTPException(status_code=e.status, detail=e.detail)
+    except HTTPException:
+        raise
     except Exception as e:
         print("I caught an error:")
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
     
 
+async def save_profile(profile: RequestProfile) -> dict:
+    """Store a finished profile under PROFILE_DIR and return the headers that point to it"""
+    await asyncio.to_thread(profile.save, PROFILE_DIR, PROFILE_MAX_FILES)
+    return {"X-Profile-Id": profile.id}
+
+
+async def iter_body_lines(request: Request):
+    """Lines of a UTF-8 request body, decoded as the chunks arrive"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for data in request.stream():
+        pending += decoder.decode(data)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+BATCH_SPOOL_BYTES = 8 * 1024 * 1024  # compiled results beyond this go to a temporary file
+
+
+@app.post("/query/batch")
+async def handle_query_batch(request: Request):
+    """Compile a JSONL body of NL queries into a JSONL stream of FHIR requests
+
+    Queries are only translated, not sent to the FHIR server. The body is read
+    line by line and compiled in chunks of BATCH_CHUNK_SIZE as it arrives, on the
+    scheduler's inference thread (one process, so they don't compete with live
+    /query batches), and the results are spooled and streamed back once the
+    upload is complete. Only `python -m nlp_query.batch --workers N` spreads
+    chunks across processes.
+    """
+    require_ready()
+    output = tempfile.SpooledTemporaryFile(max_size=BATCH_SPOOL_BYTES)
+
+    async def compile_records(chunk):
+        results = await batcher.run(compile_chunk, dispatcher, chunk, FHIR_BASE_URL, BATCH_MAX_SIZE, 1)
+        output.writelines((json.dumps(record) + "\n").encode("utf-8") for record in results)
+
+    try:
+        chunk, line_number = [], 0
+        async for line in iter_body_lines(request):
+            line_number += 1
+            chunk.extend(iter_query_records([line], start=line_number))
+            if len(chunk) >= BATCH_CHUNK_SIZE:
+                await compile_records(chunk)
+                chunk = []
+        if chunk:
+            await compile_records(chunk)
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+
+    def generate():
+        with output:
+            yield from output
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run("app.main:app", host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,196 @@
+"""In-process metrics rendered in the Prometheus text exposition format
+
+Recording a sample is a bisect over the bucket bounds plus a few additions
+under a lock, so instrumentation can stay on under load. Values that other
+components already count (cache stats, plan cache stats) are read at scrape
+time through collector callbacks instead of being mirrored on every request.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Seconds, from a cached plan (~100µs) to a slow upstream search (~minute)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+# Resources per Bundle
+SIZE_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricCounter:
+    """Monotonic counter, optionally split by labels"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self.values.items())
+        for label_values, value in items:
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by labels"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self.series.items())
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                yield f"{self.name}_bucket", _format_labels(self.labels, label_values, le), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labels, label_values), series[-1]
+            yield f"{self.name}_count", _format_labels(self.labels, label_values), cumulative
+
+
+class MetricsRegistry:
+    """Holds metrics and scrape-time collectors and renders them for /metrics"""
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> MetricCounter:
+        metric = MetricCounter(name, documentation, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, name: str, documentation: str, kind: str, label: str, collect):
+        """Expose `collect()` -> {label value: number} as one metric, read at scrape time"""
+        self.collectors.append((name, documentation, kind, label, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        for name, documentation, kind, label, collect in self.collectors:
+            values = collect()
+            if values is None:
+                continue
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(values.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"{name}{_format_labels((label,), (key,))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_LATENCY = registry.histogram(
+    "fhir_nl_stage_duration_seconds",
+    "Time spent in each pipeline stage; model stages are timed once per micro-batch",
+    labels=("stage",),
+)
+STAGE_ITEMS = registry.counter(
+    "fhir_nl_stage_items_total", "Prompts (or resources, for simplify) processed by each stage",
+    labels=("stage",),
+)
+REQUESTS = registry.counter(
+    "fhir_nl_requests_total", "Handled API requests by route and response status",
+    labels=("path", "status"),
+)
+REQUEST_LATENCY = registry.histogram(
+    "fhir_nl_request_duration_seconds", "End-to-end API request latency until the response starts",
+    labels=("path",),
+)
+UPSTREAM_RESPONSES = registry.counter(
+    "fhir_nl_upstream_responses_total", "Responses from the FHIR server by status code, retries included",
+    labels=("status",),
+)
+UPSTREAM_ERRORS = registry.counter(
+    "fhir_nl_upstream_errors_total", "Upstream attempts that failed without a response",
+    labels=("error",),
+)
+BUNDLE_SIZE = registry.histogram(
+    "fhir_nl_bundle_resources", "Resources per simplified search Bundle",
+    buckets=SIZE_BUCKETS,
+)
+
+
+def record_stage(stage: str, seconds: float, items: int = 1):
+    """Stage listener for Dispatcher.add_stage_listener"""
+    STAGE_LATENCY.observe(seconds, stage)
+    STAGE_ITEMS.inc(stage, amount=items)
+
+
+@contextmanager
+def timed_stage(stage: str, items: int = 1):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start, items)
+
+
+def record_upstream(status: int, seconds: float, error: str = None):
+    """Response listener for FHIRClient.add_response_listener"""
+    STAGE_LATENCY.observe(seconds, "upstream")
+    STAGE_ITEMS.inc("upstream")
+    if error is not None:
+        UPSTREAM_ERRORS.inc(error)
+    else:
+        UPSTREAM_RESPONSES.inc(str(status))
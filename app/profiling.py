@@ -0,0 +1,123 @@
+"""Opt-in per-request profiling
+
+A `RequestProfile` samples the stack of the thread that does the work every
+`interval` seconds from a background thread and folds the samples into
+collapsed stacks ("frame;frame;frame count" lines), the input format of
+flamegraph.pl, speedscope and inferno. Alongside the samples it keeps a
+wall-clock breakdown by pipeline stage, fed by the same stage listener hook the
+metrics use, filtered to the profiled thread so concurrent requests don't leak
+into it.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+_active_profiles = {}  # thread id -> RequestProfile sampling it
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class RequestProfile:
+    """Stack samples and per-stage timings collected for one request"""
+    def __init__(self, interval: float = 0.005):
+        self.id = uuid.uuid4().hex[:12]
+        self.interval = interval
+        self.stacks = Counter()
+        self.stages = Counter()
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] += seconds
+
+    def sample(self, target, *args, stage: str = None):
+        """Run `target(*args)` on the current thread while sampling its stack"""
+        thread_id = threading.get_ident()
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample_loop, args=(thread_id, stop),
+                                   name=f"profiler-{self.id}", daemon=True)
+        _active_profiles[thread_id] = self
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            return target(*args)
+        finally:
+            if stage:
+                self.add_stage(stage, time.perf_counter() - start)
+            stop.set()
+            sampler.join()
+            _active_profiles.pop(thread_id, None)
+
+    def _sample_loop(self, thread_id: int, stop: threading.Event):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            with self._lock:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def collapsed(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            stages = {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()}
+            samples = sum(self.stacks.values())
+        return {
+            "id": self.id,
+            "interval_ms": self.interval * 1000,
+            "samples": samples,
+            "stages_ms": stages,
+            "collapsed": self.collapsed(),
+        }
+
+    def save(self, directory: str, max_profiles: int = None) -> str:
+        """Write `<stamp>-<id>.collapsed` (flamegraph input) and `<stamp>-<id>.json` (breakdown)
+
+        `<stamp>` is the start time (YYYYmmddTHHMMSS), so the files sort by age.
+        With `max_profiles`, only that many of the newest profiles in `directory`
+        are kept. Returns the path without the extension.
+        """
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(self.started_at))
+        base = os.path.join(directory, f"{stamp}-{self.id}")
+        with open(f"{base}.collapsed", "w") as f:
+            f.write(self.collapsed())
+        summary = self.as_dict()
+        del summary["collapsed"]
+        with open(f"{base}.json", "w") as f:
+            json.dump(summary, f, indent=2)
+        if max_profiles is not None:
+            prune_profiles(directory, max_profiles)
+        return base
+
+
+def prune_profiles(directory: str, keep: int):
+    """Delete all but the `keep` newest saved profiles in `directory`"""
+    bases = sorted({name.rsplit(".", 1)[0] for name in os.listdir(directory)
+                    if name.endswith((".collapsed", ".json"))})
+    for base in bases[:max(len(bases) - keep, 0)]:
+        for extension in (".collapsed", ".json"):
+            try:
+                os.unlink(os.path.join(directory, base + extension))
+            except FileNotFoundError:  # pruned concurrently
+                pass
+
+
+def record_stage(stage: str, seconds: float, items: int = 1):
+    """Stage listener for Dispatcher.add_stage_listener; only profiled threads are recorded"""
+    profile = _active_profiles.get(threading.get_ident())
+    if profile is not None:
+        profile.add_stage(stage, seconds)
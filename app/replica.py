@@ -0,0 +1,559 @@
+"""Local FHIR replica: answer the generated searches from an embedded SQLite store
+
+Patients and Conditions from FHIR NDJSON files or Bundles (e.g. Synthea
+output) are imported into one SQLite file, with index tables for the search
+parameters PatientPrompt and ConditionPrompt generate:
+
+    patient          gender, birthdate, deceased, deceased-date columns
+    patient_string   name / given / family, address / address-city / -state / -country / -postalcode,
+                     general-practitioner and organization (reference, id and display words)
+    patient_token    identifier, phone, email
+    condition_code   Condition code joined to its patient, for _has:Condition:patient:code and code=
+
+`FHIRReplica.respond(url)` runs a `Patient?...` or `Condition?...` search URL
+against them, with the FHIR search semantics the generated URLs rely on:
+comma-separated values are ORed and repeated parameters ANDed; dates accept
+eq/ne/lt/le/gt/ge/sa/eb prefixes at year, month or day precision; strings match
+case-insensitive prefixes (`:exact`, `:contains`); `:missing` works everywhere.
+Condition searches also support chained `subject:Patient.*` parameters and
+`_include=Condition:subject`. `_count`, `_elements`, `_summary=count|data` and
+paging through `next` links work too. A filter parameter the replica can't
+evaluate is answered with 400 rather than ignored, since ignoring it would
+widen the result to patients it should exclude; only result-shaping
+parameters (`_sort`, `_total`, `_format`, other `_include`s) are ignored, and
+reported in an OperationOutcome entry.
+
+With FHIR_BACKEND=replica, /query sends its searches to `LocalReplicaClient`
+instead of the remote server.
+
+    python -m app.replica import output/fhir/*.json bulk/*.ndjson --db .data/fhir_replica.sqlite
+    python -m app.replica search "[base]/Patient?gender=female&_has:Condition:patient:code=44054006"
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from urllib.parse import parse_qsl, urlsplit
+
+from app.fan_out import patient_id
+from app.fhir_client import FHIRClient, FHIRResponse, add_query_params
+
+DEFAULT_COUNT = 20  # page size when the search has no _count, like HAPI
+MAX_COUNT = 1000
+IMPORT_BATCH = 1000  # resources per import transaction
+DATE_PREFIXES = ("eq", "ne", "lt", "le", "gt", "ge", "sa", "eb")
+RESOURCE_TYPES = ("Patient", "Condition")
+# Elements every _elements projection keeps
+MANDATORY_ELEMENTS = ("resourceType", "id", "meta")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patient (
+    id TEXT PRIMARY KEY,
+    resource TEXT NOT NULL,
+    gender TEXT,
+    birthdate TEXT,
+    deceased INTEGER NOT NULL,
+    deceased_date TEXT
+);
+CREATE INDEX IF NOT EXISTS patient_gender ON patient (gender);
+CREATE INDEX IF NOT EXISTS patient_birthdate ON patient (birthdate);
+CREATE INDEX IF NOT EXISTS patient_deceased_date ON patient (deceased_date);
+CREATE TABLE IF NOT EXISTS patient_string (
+    patient_id TEXT NOT NULL,
+    param TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS patient_string_value ON patient_string (param, value, patient_id);
+CREATE INDEX IF NOT EXISTS patient_string_patient ON patient_string (patient_id);
+CREATE TABLE IF NOT EXISTS patient_token (
+    patient_id TEXT NOT NULL,
+    param TEXT NOT NULL,
+    system TEXT,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS patient_token_value ON patient_token (param, value, patient_id);
+CREATE INDEX IF NOT EXISTS patient_token_patient ON patient_token (patient_id);
+CREATE TABLE IF NOT EXISTS condition (
+    id TEXT PRIMARY KEY,
+    resource TEXT NOT NULL,
+    patient_id TEXT,
+    onset TEXT
+);
+CREATE INDEX IF NOT EXISTS condition_patient ON condition (patient_id);
+CREATE INDEX IF NOT EXISTS condition_onset ON condition (onset);
+CREATE TABLE IF NOT EXISTS condition_code (
+    condition_id TEXT NOT NULL,
+    patient_id TEXT,
+    system TEXT,
+    code TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS condition_code_code ON condition_code (code, patient_id);
+CREATE INDEX IF NOT EXISTS condition_code_condition ON condition_code (condition_id);
+"""
+
+# Patient search parameter -> `param` of its rows in the patient_string / patient_token tables
+PATIENT_STRING_PARAMS = {
+    "name": "name", "given": "given", "family": "family",
+    "address": "address", "address-city": "address-city", "address-state": "address-state",
+    "address-country": "address-country", "address-postalcode": "address-postalcode",
+    "general-practitioner": "general-practitioner", "organization": "organization",
+}
+# Reference search parameters -> Patient element, indexed as strings so a name matches the display
+PATIENT_REFERENCE_ELEMENTS = {"general-practitioner": "generalPractitioner", "organization": "managingOrganization"}
+PATIENT_TOKEN_PARAMS = {"identifier": "identifier", "phone": "phone", "email": "email", "telecom": "telecom"}
+PATIENT_DATE_COLUMNS = {"birthdate": "birthdate", "deceased-date": "deceased_date", "death-date": "deceased_date"}
+
+
+class SearchError(ValueError):
+    """A search the replica can't evaluate, answered with 400"""
+
+
+def _lower(value) -> str:
+    return str(value).strip().lower()
+
+
+def subject_id(reference: str) -> str | None:
+    """Patient id of a Condition subject, including the urn:uuid: references of Synthea bundles"""
+    if reference and reference.startswith("urn:uuid:"):
+        return reference[len("urn:uuid:"):]
+    return patient_id(reference)
+
+
+def _date(value: str | None) -> str | None:
+    """The YYYY[-MM[-DD]] part of a FHIR date or dateTime"""
+    return value[:10] if value else None
+
+
+def date_range(value: str) -> tuple:
+    """(prefix, lower, upper) for a date search value such as lt1966-01-01 or 2019, upper exclusive"""
+    prefix = value[:2] if value[:2] in DATE_PREFIXES else "eq"
+    text = value[2:] if value[:2] in DATE_PREFIXES else value
+    parts = text[:10].split("-")
+    try:
+        numbers = [int(part) for part in parts]
+    except ValueError:
+        raise SearchError(f"Invalid date search value: {value}")
+    if not 1 <= len(numbers) <= 3:
+        raise SearchError(f"Invalid date search value: {value}")
+    try:
+        lower = date(*(numbers + [1, 1])[:3])
+    except ValueError:
+        raise SearchError(f"Invalid date search value: {value}")
+    if len(numbers) == 1:
+        upper = date(lower.year + 1, 1, 1)
+    elif len(numbers) == 2:
+        upper = date(lower.year + (lower.month == 12), lower.month % 12 + 1, 1)
+    else:
+        upper = lower + timedelta(days=1)
+    return prefix, lower.isoformat(), upper.isoformat()
+
+
+def _date_clause(column: str, values: list) -> tuple:
+    """OR of date comparisons on `column`, which holds YYYY-MM-DD strings"""
+    clauses, args = [], []
+    for value in values:
+        prefix, lower, upper = date_range(value)
+        if prefix == "eq":
+            clauses.append(f"({column} >= ? AND {column} < ?)")
+            args += [lower, upper]
+        elif prefix == "ne":
+            clauses.append(f"({column} < ? OR {column} >= ?)")
+            args += [lower, upper]
+        elif prefix in ("lt", "eb"):
+            clauses.append(f"{column} < ?")
+            args.append(lower)
+        elif prefix == "le":
+            clauses.append(f"{column} < ?")
+            args.append(upper)
+        elif prefix in ("gt", "sa"):
+            clauses.append(f"{column} >= ?")
+            args.append(upper)
+        else:  # ge
+            clauses.append(f"{column} >= ?")
+            args.append(lower)
+    return f"({' OR '.join(clauses)})", args
+
+
+def _string_clause(values: list, modifier: str) -> tuple:
+    """OR of matches on patient_string.value (stored lower-cased)"""
+    clauses, args = [], []
+    for value in values:
+        value = _lower(value)
+        if modifier == "exact":
+            clauses.append("value = ?")
+            args.append(value)
+        elif modifier == "contains":
+            clauses.append("value LIKE ? ESCAPE '\\'")
+            args.append("%" + value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        else:  # prefix match, as a range so the (param, value) index is used
+            clauses.append("(value >= ? AND value < ?)")
+            args += [value, value + "\uffff"]
+    return f"({' OR '.join(clauses)})", args
+
+
+def _tokens(values: list, column: str = "code") -> tuple:
+    """(sql, args) matching `system|code` / `code` tokens against the `system` and `column` columns"""
+    clauses, args = [], []
+    for value in values:
+        system, bar, code = value.rpartition("|")
+        if bar and system:
+            clauses.append(f"(system = ? AND {column} = ?)")
+            args += [system, code]
+        else:
+            clauses.append(f"{column} = ?")
+            args.append(code)
+    return f"({' OR '.join(clauses)})", args
+
+
+def _missing(modifier: str, value: str) -> bool | None:
+    """True/False for `:missing=true|false`, None without the modifier"""
+    if modifier != "missing":
+        return None
+    return _lower(value) == "true"
+
+
+def project(resource: dict, elements: list = None, summary: str = None) -> dict:
+    """Apply _elements / _summary=data to one resource"""
+    if elements:
+        keep = set(elements) | set(MANDATORY_ELEMENTS)
+        resource = {key: value for key, value in resource.items() if key in keep}
+    if summary == "data":
+        resource = {key: value for key, value in resource.items() if key != "text"}
+    return resource
+
+
+class FHIRReplica:
+    """SQLite store of Patients and Conditions that answers FHIR search URLs"""
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread, in WAL mode so an import doesn't block searches"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    # Import
+
+    @staticmethod
+    def iter_resources(path: str):
+        """Resources of an NDJSON file, a Bundle, a single resource file or a directory of them"""
+        if os.path.isdir(path):
+            for root, _, names in sorted(os.walk(path)):
+                for name in sorted(names):
+                    if name.endswith((".json", ".ndjson")):
+                        yield from FHIRReplica.iter_resources(os.path.join(root, name))
+            return
+        with open(path, encoding="utf-8") as f:
+            if path.endswith(".ndjson"):
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+                return
+            document = json.load(f)
+        if document.get("resourceType") == "Bundle":
+            for entry in document.get("entry", []):
+                if entry.get("resource"):
+                    yield entry["resource"]
+        else:
+            yield document
+
+    def import_paths(self, paths: list) -> Counter:
+        """Load every Patient and Condition under `paths`, replacing earlier copies; returns counts by type"""
+        counts = Counter()
+        batch = []
+        for path in paths:
+            for resource in self.iter_resources(path):
+                resource_type = resource.get("resourceType")
+                if resource_type not in RESOURCE_TYPES or not resource.get("id"):
+                    counts["skipped"] += 1
+                    continue
+                counts[resource_type] += 1
+                batch.append(resource)
+                if len(batch) >= IMPORT_BATCH:
+                    self._import_batch(batch)
+                    batch = []
+        if batch:
+            self._import_batch(batch)
+        return counts
+
+    def _import_batch(self, resources: list):
+        conn = self._connect()
+        with conn:
+            for resource in resources:
+                if resource["resourceType"] == "Patient":
+                    self._import_patient(conn, resource)
+                else:
+                    self._import_condition(conn, resource)
+
+    @staticmethod
+    def _import_patient(conn: sqlite3.Connection, resource: dict):
+        pid = resource["id"]
+        deceased = bool(resource.get("deceasedBoolean") or resource.get("deceasedDateTime"))
+        conn.execute("INSERT OR REPLACE INTO patient VALUES (?, ?, ?, ?, ?, ?)", (
+            pid, json.dumps(resource, separators=(",", ":")), resource.get("gender"),
+            _date(resource.get("birthDate")), int(deceased), _date(resource.get("deceasedDateTime")),
+        ))
+        conn.execute("DELETE FROM patient_string WHERE patient_id = ?", (pid,))
+        conn.execute("DELETE FROM patient_token WHERE patient_id = ?", (pid,))
+
+        strings = set()
+        for name in resource.get("name", []):
+            family = name.get("family")
+            givens = name.get("given", [])
+            for given in givens:
+                strings.add(("given", given))
+            if family:
+                strings.add(("family", family))
+            full = name.get("text") or " ".join(givens + ([family] if family else []))
+            for part in givens + name.get("prefix", []) + name.get("suffix", []) + [family, full]:
+                if part:
+                    strings.add(("name", part))
+        for address in resource.get("address", []):
+            parts = {"address-city": address.get("city"), "address-state": address.get("state"),
+                     "address-country": address.get("country"), "address-postalcode": address.get("postalCode")}
+            for param, value in parts.items():
+                if value:
+                    strings.add((param, value))
+            for value in [*address.get("line", []), address.get("district"), address.get("text"), *parts.values()]:
+                if value:
+                    strings.add(("address", value))
+        for param, element in PATIENT_REFERENCE_ELEMENTS.items():
+            references = resource.get(element) or []
+            for reference in references if isinstance(references, list) else [references]:
+                target = reference.get("reference")
+                if target:
+                    strings.update([(param, target), (param, target.rsplit("/", 1)[-1])])
+                display = reference.get("display")
+                if display:
+                    # "Dr. John Smith" is found by "Smith", "John Smith" and the full display
+                    words = display.replace(",", " ").split()
+                    strings.update((param, " ".join(words[i:])) for i in range(len(words)))
+        conn.executemany("INSERT INTO patient_string VALUES (?, ?, ?)",
+                         [(pid, param, _lower(value)) for param, value in sorted(strings)])
+
+        tokens = [("identifier", identifier.get("system"), identifier.get("value"))
+                  for identifier in resource.get("identifier", [])]
+        for telecom in resource.get("telecom", []):
+            tokens.append(("telecom", telecom.get("system"), telecom.get("value")))
+            if telecom.get("system") in ("phone", "email"):
+                tokens.append((telecom["system"], None, telecom.get("value")))
+        conn.executemany("INSERT INTO patient_token VALUES (?, ?, ?, ?)",
+                         [(pid, param, system, value) for param, system, value in tokens if value])
+
+    @staticmethod
+    def _import_condition(conn: sqlite3.Connection, resource: dict):
+        cid = resource["id"]
+        pid = subject_id((resource.get("subject") or {}).get("reference"))
+        onset = resource.get("onsetDateTime") or (resource.get("onsetPeriod") or {}).get("start")
+        if pid and (resource.get("subject") or {}).get("reference", "").startswith("urn:uuid:"):
+            resource = {**resource, "subject": {**resource["subject"], "reference": f"Patient/{pid}"}}
+        conn.execute("INSERT OR REPLACE INTO condition VALUES (?, ?, ?, ?)",
+                     (cid, json.dumps(resource, separators=(",", ":")), pid, _date(onset)))
+        conn.execute("DELETE FROM condition_code WHERE condition_id = ?", (cid,))
+        conn.executemany("INSERT INTO condition_code VALUES (?, ?, ?, ?)", [
+            (cid, pid, coding.get("system"), coding["code"])
+            for coding in (resource.get("code") or {}).get("coding", []) if coding.get("code")
+        ])
+
+    # Search
+
+    def _patient_clause(self, name: str, values: list) -> tuple | None:
+        """(sql, args) restricting patient `p` for one search parameter, None if unsupported"""
+        param, _, modifier = name.partition(":")
+        missing = _missing(modifier, values[0])
+        if name.startswith(("_has:Condition:patient:code", "_has:Condition:subject:code")):
+            tokens, args = _tokens(values)
+            return f"p.id IN (SELECT patient_id FROM condition_code WHERE {tokens})", args
+        if param == "_id":
+            return f"p.id IN ({','.join('?' * len(values))})", list(values)
+        if param == "gender":
+            if missing is not None:
+                return f"p.gender IS {'' if missing else 'NOT '}NULL", []
+            return f"p.gender IN ({','.join('?' * len(values))})", [_lower(value) for value in values]
+        if param == "deceased":
+            return "p.deceased = ?", [int(_lower(values[0]) == "true")]
+        if param in PATIENT_DATE_COLUMNS:
+            column = f"p.{PATIENT_DATE_COLUMNS[param]}"
+            if missing is not None:
+                return f"{column} IS {'' if missing else 'NOT '}NULL", []
+            return _date_clause(column, values)
+        if param in PATIENT_STRING_PARAMS:
+            indexed = PATIENT_STRING_PARAMS[param]
+            if missing is not None:
+                return f"p.id {'NOT ' if missing else ''}IN (SELECT patient_id FROM patient_string WHERE param = ?)", [indexed]
+            clause, args = _string_clause(values, modifier)
+            return f"p.id IN (SELECT patient_id FROM patient_string WHERE param = ? AND {clause})", [indexed] + args
+        if param in PATIENT_TOKEN_PARAMS:
+            indexed = PATIENT_TOKEN_PARAMS[param]
+            if missing is not None:
+                return f"p.id {'NOT ' if missing else ''}IN (SELECT patient_id FROM patient_token WHERE param = ?)", [indexed]
+            tokens, args = _tokens(values, column="value")
+            return f"p.id IN (SELECT patient_id FROM patient_token WHERE param = ? AND {tokens})", [indexed] + args
+        return None
+
+    def _condition_clause(self, name: str, values: list) -> tuple | None:
+        """(sql, args) restricting condition `c` for one search parameter, None if unsupported"""
+        param, _, modifier = name.partition(":")
+        if name.startswith(("subject:Patient.", "patient:Patient.")):
+            chained = self._patient_clause(name.split(".", 1)[1], values)
+            if chained is None:
+                return None
+            return f"c.patient_id IN (SELECT p.id FROM patient p WHERE {chained[0]})", chained[1]
+        if param == "_id":
+            return f"c.id IN ({','.join('?' * len(values))})", list(values)
+        if param == "code":
+            tokens, args = _tokens(values)
+            return f"c.id IN (SELECT condition_id FROM condition_code WHERE {tokens})", args
+        if param in ("subject", "patient"):
+            ids = [subject_id(value) or value for value in values]
+            return f"c.patient_id IN ({','.join('?' * len(ids))})", ids
+        if param == "onset-date":
+            if modifier == "missing":
+                return f"c.onset IS {'' if _missing(modifier, values[0]) else 'NOT '}NULL", []
+            return _date_clause("c.onset", values)
+        return None
+
+    def search(self, url: str) -> dict:
+        """Run a Patient or Condition search URL and return the searchset Bundle"""
+        parts = urlsplit(url)
+        resource_type = parts.path.rstrip("/").rsplit("/", 1)[-1]
+        if resource_type not in RESOURCE_TYPES:
+            raise LookupError(f"The replica only holds {' and '.join(RESOURCE_TYPES)} resources, not {resource_type}")
+        base = url.split("?", 1)[0].rsplit("/", 1)[0]
+        clause_for = self._patient_clause if resource_type == "Patient" else self._condition_clause
+        table, alias = ("patient", "p") if resource_type == "Patient" else ("condition", "c")
+
+        where, args, ignored = [], [], []
+        count, offset, elements, summary, includes = DEFAULT_COUNT, 0, None, None, []
+        for name, value in parse_qsl(parts.query, keep_blank_values=True):
+            if name == "_count":
+                count = max(0, min(int(value), MAX_COUNT))
+            elif name == "_offset":
+                offset = max(0, int(value))
+            elif name == "_elements":
+                elements = [element.strip() for element in value.split(",") if element.strip()]
+            elif name == "_summary":
+                summary = value
+            elif name == "_include":
+                includes.append(value)
+            elif name in ("_sort", "_total", "_format"):
+                ignored.append(name)
+            else:
+                clause = clause_for(name, value.split(","))
+                if clause is None:
+                    # ignoring a filter would return patients it excludes
+                    raise SearchError(f"Search parameter not supported by the local replica: {name}")
+                where.append(clause[0])
+                args += clause[1]
+
+        conn = self._connect()
+        condition = f"WHERE {' AND '.join(where)}" if where else ""
+        total = conn.execute(f"SELECT COUNT(*) FROM {table} {alias} {condition}", args).fetchone()[0]
+        bundle = {"resourceType": "Bundle", "type": "searchset", "total": total, "link": [{"relation": "self", "url": url}]}
+        if summary == "count":
+            return bundle
+        rows = conn.execute(f"SELECT {alias}.resource FROM {table} {alias} {condition} "
+                            f"ORDER BY {alias}.rowid LIMIT ? OFFSET ?", args + [count, offset]).fetchall()
+        matches = [json.loads(resource) for resource, in rows]
+        if count and offset + len(matches) < total:
+            bundle["link"].append({"relation": "next", "url": add_query_params(url, {"_offset": offset + count})})
+
+        entries = [{"fullUrl": f"{base}/{resource_type}/{resource['id']}",
+                    "resource": project(resource, elements, summary), "search": {"mode": "match"}}
+                   for resource in matches]
+        if resource_type == "Condition" and "Condition:subject" in includes:
+            entries += self._included_subjects(conn, base, matches)
+        elif includes:
+            ignored.append("_include")
+        if ignored:
+            entries.append({"resource": {
+                "resourceType": "OperationOutcome",
+                "issue": [{"severity": "warning", "code": "not-supported",
+                           "diagnostics": f"Parameter ignored by the local replica: {param}"} for param in ignored],
+            }, "search": {"mode": "outcome"}})
+        bundle["entry"] = entries
+        return bundle
+
+    @staticmethod
+    def _included_subjects(conn: sqlite3.Connection, base: str, conditions: list) -> list:
+        """Entries for the distinct subject Patients of `conditions`, for _include=Condition:subject"""
+        ids = list(dict.fromkeys(filter(None, (subject_id((condition.get("subject") or {}).get("reference"))
+                                               for condition in conditions))))
+        patients = []
+        for i in range(0, len(ids), 500):  # stay under SQLite's bound-parameter limit
+            batch = ids[i:i + 500]
+            rows = conn.execute(f"SELECT id, resource FROM patient WHERE id IN ({','.join('?' * len(batch))})",
+                                batch).fetchall()
+            found = dict(rows)
+            patients += [found[pid] for pid in batch if pid in found]
+        return [{"fullUrl": f"{base}/Patient/{resource['id']}", "resource": resource, "search": {"mode": "include"}}
+                for resource in map(json.loads, patients)]
+
+    def respond(self, url: str) -> tuple:
+        """(status, JSON body) for a search URL, errors as an OperationOutcome"""
+        try:
+            return 200, json.dumps(self.search(url)).encode("utf-8")
+        except (SearchError, ValueError) as e:
+            status, message = 400, str(e)
+        except LookupError as e:
+            status, message = 404, str(e)
+        outcome = {"resourceType": "OperationOutcome",
+                   "issue": [{"severity": "error", "code": "processing", "diagnostics": message}]}
+        return status, json.dumps(outcome).encode("utf-8")
+
+
+class LocalReplicaClient(FHIRClient):
+    """FHIRClient whose searches are answered by a FHIRReplica instead of an upstream server
+
+    Only `_fetch` changes, so paging, the fan-out executor and the summary
+    counts work as they do against a remote server.
+    """
+    def __init__(self, replica: FHIRReplica, **kwargs):
+        super().__init__(**kwargs)
+        self.replica = replica
+
+    async def _fetch(self, url: str, headers: dict = None) -> FHIRResponse:
+        start = time.perf_counter()
+        status, body = await asyncio.to_thread(self.replica.respond, url)
+        self._notify(status, start)
+        return FHIRResponse(status=status, url=url, body=body, headers={"Content-Type": "application/fhir+json"})
+
+
+def main():
+    from app.config import FHIR_REPLICA_PATH
+    parser = argparse.ArgumentParser(description="Import FHIR data into the local replica or search it")
+    parser.add_argument("--db", default=FHIR_REPLICA_PATH, help="SQLite file of the replica")
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("import", help="load NDJSON files, Bundles or directories of them")
+    load.add_argument("paths", nargs="+")
+    search = commands.add_parser("search", help="run a search URL and print the Bundle")
+    search.add_argument("url")
+    args = parser.parse_args()
+
+    replica = FHIRReplica(args.db)
+    if args.command == "import":
+        start = time.perf_counter()
+        counts = replica.import_paths(args.paths)
+        summary = ", ".join(f"{count} {name}" for name, count in counts.most_common())
+        print(f"Imported {summary or 'nothing'} into {args.db} in {time.perf_counter() - start:.1f}s")
+    else:
+        status, body = replica.respond(args.url)
+        print(json.dumps(json.loads(body), indent=2))
+        if status != 200:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
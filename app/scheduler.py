@@ -0,0 +1,94 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MicroBatcher:
+    """Gather concurrent prompts into batches and dispatch each batch once
+
+    A single background task pulls prompts off a queue until either `max_batch_size`
+    prompts are waiting or `max_wait_ms` has passed since the first one arrived, then
+    runs `dispatcher.dispatch_batch` on one dedicated inference thread so the models
+    never compete with each other for CPU. Each caller gets its own payload back;
+    a prompt the resource classes fail on comes back as that caller's error
+    payload, and only a failure of the whole batch (a model stage) reaches every
+    caller in it.
+    """
+    def __init__(self, dispatcher, base_url: str, max_batch_size: int = 16, max_wait_ms: float = 10):
+        self.dispatcher = dispatcher
+        self.base_url = base_url
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.queue = None
+        self._worker = None
+
+    async def start(self):
+        """Start the batching loop on the running event loop"""
+        self.queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the batching loop and fail any prompt still waiting"""
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        while self.queue and not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Inference scheduler stopped"))
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, prompt: str) -> dict:
+        """Queue a prompt and wait for its dispatch payload"""
+        if self._worker is None:
+            raise RuntimeError("Inference scheduler is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((prompt, future))
+        return await future
+
+    async def run(self, fn, *args):
+        """Run `fn(*args)` on the inference thread, e.g. an already-formed batch"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def _collect_batch(self) -> list:
+        """Wait for one prompt, then keep collecting until the batch is full or the window closes"""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        """Batching loop: collect, dispatch on the inference thread, fan results back out"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            prompts = [prompt for prompt, _ in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.dispatcher.dispatch_batch, prompts, self.base_url
+                )
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Inference scheduler stopped"))
+                raise
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done(): # the caller may have gone away
+                    future.set_result(result)
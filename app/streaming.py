@@ -0,0 +1,47 @@
+import json
+
+from app.fhir_client import FHIRClient, add_query_params
+from app.utils import PatientSummary, iter_bundle_resources, simplify_patient
+
+
+def _ndjson(record: dict) -> bytes:
+    return (json.dumps(record) + "\n").encode("utf-8")
+
+
+async def stream_patient_pages(client: FHIRClient, url: str, params: dict,
+                               page_size: int, max_pages: int = None):
+    """Stream a paginated Patient search as NDJSON
+
+    Emits one `query` record, then a `patient` record per patient and a running
+    `summary` record after every page, and a final `summary` record marked
+    `"final": true`. Only the current page is kept in memory. The first page is
+    fetched before anything is yielded, so upstream errors on it still surface as
+    a normal HTTP error instead of a half-written stream.
+    """
+    pages = client.iter_pages(add_query_params(url, {"_count": page_size}), max_pages=max_pages)
+    first_page = await pages.__anext__()
+
+    async def generate():
+        summary = PatientSummary()
+        page_number = 0
+        yield _ndjson({"type": "query", "data": params})
+        try:
+            bundle = first_page
+            while bundle is not None:
+                page_number += 1
+                for resource in iter_bundle_resources(bundle, "Patient"):
+                    patient = simplify_patient(resource, params)
+                    summary.add(patient)
+                    yield _ndjson({"type": "patient", "data": patient})
+                yield _ndjson({"type": "summary", "page": page_number, "data": summary.as_dict()})
+                bundle = await pages.__anext__()
+        except StopAsyncIteration:
+            pass
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            yield _ndjson({"type": "error", "page": page_number + 1, "detail": str(e)})
+        finally:
+            await pages.aclose()
+        yield _ndjson({"type": "summary", "final": True, "pages": page_number, "data": summary.as_dict()})
+
+    return generate()
@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode
+
+from app.fhir_client import FHIRClient
+from app.utils import AGE_GROUPS
+
+GENDER_VALUES = ["male", "female", "other", "unknown"]
+
+# Parameters that shape the response rather than filter it
+RESPONSE_PARAMS = {"_elements", "_summary", "_count", "_sort", "_include", "_revinclude"}
+
+
+def age_group_filters(year: int = None) -> dict:
+    """Birthdate search parameters matching each `categorize_age` bucket
+
+    `calculate_age` only looks at the birth year, so a bucket of ages
+    [lo, hi] is the birth years [year - hi, year - lo].
+    """
+    year = year or datetime.now().year
+    filters = {}
+    for label, youngest, oldest in AGE_GROUPS:
+        params = []
+        if oldest is not None:
+            params.append(("birthdate", f"ge{year - oldest}-01-01"))
+        if youngest is not None:
+            params.append(("birthdate", f"le{year - youngest}-12-31"))
+        filters[label] = params
+    filters["unknown"] = [("birthdate:missing", "true")]
+    return filters
+
+
+def _count_url(base: str, filters: list, extra: list) -> str:
+    return f"{base}?{urlencode(filters + extra + [('_summary', 'count')], safe=':,')}"
+
+
+async def _count(client: FHIRClient, url: str) -> int:
+    bundle = await client.get_json(url)
+    return bundle.get("total", 0)
+
+
+async def count_patient_summary(client: FHIRClient, fhir_request: dict) -> dict:
+    """Build the `simplify_patient_data` summary from `_summary=count` searches only
+
+    Runs one count for the whole cohort, one per gender value and one per age
+    bucket, all concurrently and each combined with the generated search filter.
+    No Patient resources are downloaded, so `patients` is always empty and so is
+    `locations`: there is no per-city/state count in this mode.
+    """
+    base, _, query = fhir_request["url"].partition("?")
+    filters = [(key, value) for key, value in parse_qsl(query, keep_blank_values=True)
+               if key not in RESPONSE_PARAMS]
+
+    gender_searches = {gender: [("gender", gender)] for gender in GENDER_VALUES}
+    gender_searches["missing"] = [("gender:missing", "true")]  # simplify_patient reports these as "unknown"
+    age_searches = age_group_filters()
+
+    urls = [_count_url(base, filters, [])]
+    urls += [_count_url(base, filters, extra) for extra in gender_searches.values()]
+    urls += [_count_url(base, filters, extra) for extra in age_searches.values()]
+    counts = await asyncio.gather(*(_count(client, url) for url in urls))
+
+    total = counts[0]
+    gender_counts = dict(zip(gender_searches, counts[1:1 + len(gender_searches)]))
+    gender_counts["unknown"] += gender_counts.pop("missing")
+    age_counts = dict(zip(age_searches, counts[1 + len(gender_searches):]))
+
+    summary = {
+        "total_patients": total,
+        "gender_distribution": {key: count for key, count in gender_counts.items() if count},
+        "age_distribution": {key: count for key, count in age_counts.items() if count},
+        "locations": {
+            "cities": {},
+            "states": {},
+        }
+    }
+    return {
+        "query": fhir_request.get("parameters", {}),
+        "summary": summary,
+        "patients": [],
+    }
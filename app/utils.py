@@ -13,6 +13,16 @@ def calculate_age(birthdate: str) -> int | None:
         return None
 
 
+# (label, youngest age, oldest age) for each bucket of categorize_age
+AGE_GROUPS = [
+    ("0-18", None, 18),
+    ("19-35", 19, 35),
+    ("36-50", 36, 50),
+    ("51-65", 51, 65),
+    ("66+", 66, None),
+]
+
+
 def categorize_age(age: int) -> str:
     if age is None:
         return "unknown"
@@ -27,70 +37,172 @@ def categorize_age(age: int) -> str:
     return "66+"
 
 
-def simplify_patient_data(fhir_response: dict, params: dict) -> dict:
-    patients = []
-    gender_counter = Counter()
-    age_counter = Counter()
-    city_counter = Counter()
-    state_counter = Counter()
+# Patient elements read by simplify_patient, used for the search's _elements projection
+SIMPLIFIED_PATIENT_ELEMENTS = ["name", "birthDate", "gender", "address"]
+
+
+# Fields of a simplified patient, in the order patient_fields returns them
+PATIENT_FIELDS = ("name", "gender", "age", "age_group", "birthDate", "city", "state")
+
+
+def patient_fields(resource: dict) -> tuple:
+    """The PATIENT_FIELDS values of a single Patient resource
+
+    Works on projected resources too (`_elements` / `_summary=data`), where any
+    of the elements may be missing or empty.
+    """
+    name = ""
+    if "name" in resource and resource["name"]:
+        names = resource["name"][0]
+        given = names.get("given") or [""]
+        family = names.get("family", "")
+        name = f"{given[0]} {family}".strip()
+
+    birthdate = resource.get("birthDate")
+    age = calculate_age(birthdate)
+    age_group = categorize_age(age)
+    gender = resource.get("gender", "unknown")
+
+    address = resource.get("address", [])
+    city = address[0].get("city") if address else None
+    state = address[0].get("state") if address else None
+    return name, gender, age, age_group, birthdate, city, state
+
+
+def simplify_patient(resource: dict, params: dict) -> dict:
+    """Flatten a single Patient resource into the fields the front end displays"""
+    patient = dict(zip(PATIENT_FIELDS, patient_fields(resource)))
+    if params.get("_has:Condition:patient:code"):
+        patient["condition"] = params["_has:Condition:patient:code"]
+    return patient
+
+
+class PatientSummary:
+    """Running totals and distributions over simplified patients"""
+    def __init__(self):
+        self.total = 0
+        self.gender_counter = Counter()
+        self.age_counter = Counter()
+        self.city_counter = Counter()
+        self.state_counter = Counter()
+
+    def add(self, patient: dict):
+        self.total += 1
+        self.gender_counter[patient["gender"]] += 1
+        self.age_counter[patient["age_group"]] += 1
+        if patient["city"]:
+            self.city_counter[patient["city"]] += 1
+        if patient["state"]:
+            self.state_counter[patient["state"]] += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "total_patients": self.total,
+            "gender_distribution": dict(self.gender_counter),
+            "age_distribution": dict(self.age_counter),
+            "locations": {
+                "cities": dict(self.city_counter),
+                "states": dict(self.state_counter),
+            }
+        }
+
 
+def iter_bundle_resources(fhir_response: dict, resource_type: str = None):
+    """Yield the non-empty resources of a search Bundle, optionally of one type only"""
     for entry in fhir_response.get("entry", []):
         resource = entry.get("resource", {})
         if not resource:
             continue
+        if resource_type and resource.get("resourceType", resource_type) != resource_type:
+            continue  # e.g. an OperationOutcome warning entry
+        yield resource
 
-        # --- Extract data ---
-        name = ""
-        if "name" in resource and resource["name"]:
-            names = resource["name"][0]
-            given = names.get("given", [""])
-            family = names.get("family", "")
-            name = f"{given[0]} {family}".strip()
-
-        birthdate = resource.get("birthDate")
-        age = calculate_age(birthdate)
-        age_group = categorize_age(age)
-        gender = resource.get("gender", "unknown")
-
-        address = resource.get("address", [])
-        city = address[0].get("city") if address else None
-        state = address[0].get("state") if address else None
-
-        patient = {
-            "name": name,
-            "gender": gender,
-            "age": age,
-            "age_group": age_group,
-            "birthDate": birthdate,
-            "city": city,
-            "state": state,
-        }
 
-        if params.get("_has:Condition:patient:code"):
-            patient["condition"] = params["_has:Condition:patient:code"]
+def next_page_url(fhir_response: dict) -> str | None:
+    """Return the Bundle's `next` link, if there is another page"""
+    for link in fhir_response.get("link", []):
+        if link.get("relation") == "next":
+            return link.get("url")
+    return None
 
+
+def simplify_patient_data(fhir_response: dict, params: dict) -> dict:
+    patients = []
+    summary = PatientSummary()
+
+    for resource in iter_bundle_resources(fhir_response, "Patient"):
+        patient = simplify_patient(resource, params)
         patients.append(patient)
+        summary.add(patient)
 
-        # --- Update counters in the same loop ---
-        gender_counter[gender] += 1
-        age_counter[age_group] += 1
-        if city:
-            city_counter[city] += 1
-        if state:
-            state_counter[state] += 1
-
-    summary = {
-        "total_patients": len(patients),
-        "gender_distribution": dict(gender_counter),
-        "age_distribution": dict(age_counter),
-        "locations": {
-            "cities": dict(city_counter),
-            "states": dict(state_counter),
-        }
+    return {
+        "query": params,
+        "summary": summary.as_dict(),
+        "patients": patients,
+    }
+
+
+def _first_coding(concept: dict) -> dict:
+    codings = (concept or {}).get("coding") or [{}]
+    return codings[0]
+
+
+def simplify_condition(resource: dict) -> dict:
+    """Flatten a single Condition resource, keeping the subject reference for the join"""
+    coding = _first_coding(resource.get("code"))
+    onset = resource.get("onsetDateTime") or (resource.get("onsetPeriod") or {}).get("start")
+    return {
+        "code": coding.get("code"),
+        "display": coding.get("display") or (resource.get("code") or {}).get("text"),
+        "onset": onset or resource.get("onsetString"),
+        "clinical_status": _first_coding(resource.get("clinicalStatus")).get("code"),
+        "subject": (resource.get("subject") or {}).get("reference"),
     }
 
+
+def simplify_condition_data(fhir_response: dict, params: dict) -> dict:
+    """Join the Conditions of an `_include=Condition:subject` Bundle to their Patients
+
+    One pass over the entries simplifies every resource and indexes the included
+    Patients by reference ("Patient/<id>" and their fullUrl); each Condition then
+    finds its subject with a dict lookup, so the join is linear in the Bundle size.
+    `patients` lists every matched patient once, in the same shape as
+    simplify_patient_data, and `summary` is computed over them. A patient's
+    `condition` lists the distinct codes of all their matched Conditions,
+    comma-separated like the `_has:Condition:patient:code` value it mirrors.
+    """
+    by_reference = {}
+    conditions = []
+    for entry in fhir_response.get("entry", []):
+        resource = entry.get("resource") or {}
+        resource_type = resource.get("resourceType")
+        if resource_type == "Condition":
+            conditions.append(simplify_condition(resource))
+        elif resource_type == "Patient":
+            patient = simplify_patient(resource, {})
+            by_reference[f"Patient/{resource.get('id')}"] = patient
+            if entry.get("fullUrl"):
+                by_reference[entry["fullUrl"]] = patient
+
+    patients = []
+    summary = PatientSummary()
+    codes = {}
+    for condition in conditions:
+        patient = by_reference.get(condition["subject"])
+        condition["patient"] = patient
+        if patient is None:
+            continue
+        if id(patient) not in codes:
+            codes[id(patient)] = []
+            patients.append(patient)
+            summary.add(patient)
+        if condition["code"] and condition["code"] not in codes[id(patient)]:
+            codes[id(patient)].append(condition["code"])
+        patient["condition"] = ",".join(codes[id(patient)]) or None
+
     return {
         "query": params,
-        "summary": summary,
+        "summary": {**summary.as_dict(), "total_conditions": len(conditions)},
         "patients": patients,
+        "conditions": conditions,
     }
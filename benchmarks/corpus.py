@@ -0,0 +1,82 @@
+"""Fixed query corpus and synthetic FHIR bundles for the benchmarks"""
+import random
+from datetime import date
+
+# One or more queries per pattern family in nlp_query/patterns/patients_patterns.py
+QUERY_CORPUS = {
+    "phone": ["Find the patient with phone number +44 7700 900123",
+              "Find the patient with phone 5551234567"],
+    "email": ["Find the patient with email jane.doe@example.com"],
+    "identifier": ["Find the patient with ID 123456789",
+                   "Show the patient record MRN4821X"],
+    "given_name": ["Find patients with first name Maria"],
+    "family_name": ["Show patients with last name Garcia",
+                    "List patients with surname Smith"],
+    "general_name": ["Find patients named John Smith",
+                     "Find the patient known as Robert Brown"],
+    "death": ["Find patients who died in 2019",
+              "Show deceased patients with lung cancer"],
+    "birth": ["Find patients born in 1985",
+              "Find the patient with dob 1990-05-12"],
+    "year_range": ["Find patients born 1980 to 1990"],
+    "year_after": ["Find all female patients born after 1990."],
+    "year_before": ["Show patients born before 1960"],
+    "age_over": ["Show me patients over 50 with diabetes",
+                 "Find patients older than 65 with hypertension"],
+    "age_under": ["Show me patients less than 40 who are hypertensive",
+                  "Find patients under 18 with asthma"],
+    "age_exact": ["Find patients aged 30 with asthma"],
+    "age": ["Find a 45-year-old male patient",
+            "Show patients 60 years old with chronic obstructive pulmonary disease"],
+    "gender": ["Find male patients with epilepsy",
+               "List all women with migraine",
+               "Show non-binary patients"],
+    "gp": ["Find patients of Dr. Smith",
+           "Show patients managed by Dr Jones with diabetes",
+           "Find patients whose primary care provider is Dr. Patel"],
+    "condition": ["Find diabetes cases diagnosed before 2015.",
+                  "Show patients with rheumatoid arthritis",
+                  "Which patients have breast cancer"],
+}
+
+ALL_QUERIES = [query for queries in QUERY_CORPUS.values() for query in queries]
+
+FIRST_NAMES = ["James", "Mary", "Ahmed", "Li", "Sofia", "Kwame", "Olga", "Raj", "Emma", "Lucas"]
+LAST_NAMES = ["Smith", "Garcia", "Okafor", "Chen", "Ivanova", "Patel", "Müller", "Rossi", "Kim", "Silva"]
+CITIES = [("Boston", "MA"), ("Springfield", "MA"), ("Austin", "TX"), ("Houston", "TX"),
+          ("Denver", "CO"), ("Seattle", "WA"), ("Portland", "OR"), ("Miami", "FL")]
+
+
+def synthetic_patient(rng: random.Random, index: int) -> dict:
+    """A Synthea-like Patient resource, including fields the simplifier never reads"""
+    city, state = rng.choice(CITIES)
+    birth = date(rng.randint(1920, 2023), rng.randint(1, 12), rng.randint(1, 28))
+    resource = {
+        "resourceType": "Patient",
+        "id": str(100000 + index),
+        "meta": {"versionId": "1", "lastUpdated": "2024-01-01T00:00:00Z"},
+        "text": {"status": "generated", "div": "<div xmlns=\"http://www.w3.org/1999/xhtml\">Generated</div>"},
+        "identifier": [{"system": "urn:oid:1.2.36.146.595.217.0.1", "value": f"MRN{index:08d}"}],
+        "name": [{"use": "official", "family": rng.choice(LAST_NAMES), "given": [rng.choice(FIRST_NAMES)]}],
+        "telecom": [{"system": "phone", "value": f"555-{index % 10000:04d}", "use": "home"}],
+        "gender": rng.choice(["male", "female", "female", "male", "other", "unknown"]),
+        "birthDate": birth.isoformat(),
+        "address": [{"line": [f"{index} Main St"], "city": city, "state": state, "postalCode": "01234"}],
+    }
+    if rng.random() < 0.05:
+        del resource["birthDate"]
+    if rng.random() < 0.05:
+        del resource["address"]
+    return resource
+
+
+def synthetic_bundle(size: int, seed: int = 0) -> dict:
+    """A searchset Bundle of `size` synthetic patients"""
+    rng = random.Random(seed)
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": size,
+        "entry": [{"fullUrl": f"Patient/{100000 + i}", "resource": synthetic_patient(rng, i),
+                   "search": {"mode": "match"}} for i in range(size)],
+    }
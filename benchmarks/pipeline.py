@@ -0,0 +1,189 @@
+"""Stage-level benchmarks for the Dispatcher pipeline
+
+Times each stage on its own, over the fixed corpus in benchmarks/corpus.py:
+
+    classify          Dispatcher.classify, with the entities already extracted
+    apply_ner         Dispatcher.apply_ner (spaCy + EntityRuler + medical NER)
+    process           PatientPrompt.process on pre-extracted entities
+    simplify[N]       simplify_patient_data on a synthetic bundle of N patients
+    simplify_numpy[N] the vectorized engine in app/fast_simplify.py on the same bundle
+
+    python -m benchmarks.pipeline -o results.json
+    python -m benchmarks.pipeline -o new.json --compare baseline.json --tolerance 0.1
+
+`--models stand-in` (the default) swaps the HF pipelines and the spaCy model for
+the local stand-ins in benchmarks/stand_ins.py, so no network access is needed;
+`--models real` loads the production models. With `--compare`, a stage whose
+p95 grew or whose throughput dropped by more than the tolerance is reported as a
+regression and the exit code is 1. The plan cache is disabled throughout so
+every iteration does the full work.
+
+`peak_alloc_mb` is the peak memory one extra, untimed pass of the stage allocates
+on top of what was already live, traced with tracemalloc. It covers Python
+objects and numpy arrays but not native buffers inside the model runtimes.
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.corpus import ALL_QUERIES, QUERY_CORPUS, synthetic_bundle
+from app.utils import SIMPLIFIED_PATIENT_ELEMENTS, simplify_patient_data
+from app import fast_simplify
+from nlp_query.dispatcher import Dispatcher
+from nlp_query.patient_prompt import PatientPrompt
+
+BUNDLE_SIZES = (10, 1000, 100000)
+
+
+def stage_peak_mb(fn, inputs: list) -> float:
+    """Peak memory allocated by one pass of `fn` over `inputs`, above what was live before it
+
+    The process-wide RSS high-water mark only ever grows, so it would charge every
+    stage with the largest one run before it. Tracing is done in its own pass
+    because it slows down every allocation.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        for item in inputs:
+            fn(item)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (peak - start) / (1024 * 1024)
+
+
+def time_stage(fn, inputs: list, repeat: int, items_per_call: int = 1, warmup: int = 1) -> dict:
+    """Call `fn` on every input `repeat` times and summarize the per-call latencies"""
+    for item in inputs[:warmup]:
+        fn(item)
+    gc.collect()
+    latencies = []
+    for _ in range(repeat):
+        for item in inputs:
+            start = time.perf_counter()
+            fn(item)
+            latencies.append(time.perf_counter() - start)
+    samples = np.array(latencies) * 1000
+    total = samples.sum() / 1000
+    return {
+        "calls": len(latencies),
+        "mean_ms": round(float(samples.mean()), 4),
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p95_ms": round(float(np.percentile(samples, 95)), 4),
+        "p99_ms": round(float(np.percentile(samples, 99)), 4),
+        "throughput_per_s": round(len(latencies) * items_per_call / total, 2) if total else None,
+        "peak_alloc_mb": round(stage_peak_mb(fn, inputs), 2),
+    }
+
+
+def build_dispatcher(models: str) -> Dispatcher:
+    kwargs = {"plan_cache_size": 0}
+    if models == "stand-in":
+        from benchmarks.stand_ins import stand_in_components
+        kwargs.update(stand_in_components())
+    return Dispatcher(**kwargs)
+
+
+def run(models: str = "stand-in", repeat: int = 5, bundle_sizes=BUNDLE_SIZES) -> dict:
+    stages = {}
+    dispatcher = build_dispatcher(models)
+    entities = {query: dispatcher.apply_ner(query) for query in ALL_QUERIES}
+
+    stages["classify"] = time_stage(lambda q: dispatcher.classify(q, entities[q]), ALL_QUERIES, repeat)
+    stages["apply_ner"] = time_stage(dispatcher.apply_ner, ALL_QUERIES, repeat)
+    stages["process"] = time_stage(
+        lambda q: PatientPrompt("search", projection=dispatcher.projection).process(entities[q]),
+        ALL_QUERIES, repeat,
+    )
+
+    params = {"gender": "female", "birthdate": "gt1990-01-01"}
+    for size in bundle_sizes:
+        bundle = synthetic_bundle(size)
+        # keep total work roughly constant across sizes
+        bundle_repeat = max(1, min(repeat * 20, 200000 // size))
+        stages[f"simplify[{size}]"] = time_stage(
+            lambda b: simplify_patient_data(b, params), [bundle], bundle_repeat,
+            items_per_call=size, warmup=1,
+        )
+        stages[f"simplify_numpy[{size}]"] = time_stage(
+            lambda b: fast_simplify.simplify_patient_data(b, params), [bundle], bundle_repeat,
+            items_per_call=size, warmup=1,
+        )
+        del bundle
+        gc.collect()
+
+    return {
+        "meta": {
+            "models": models,
+            "repeat": repeat,
+            "queries": len(ALL_QUERIES),
+            "pattern_families": sorted(QUERY_CORPUS),
+            "simplified_elements": SIMPLIFIED_PATIENT_ELEMENTS,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "stages": stages,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return a description of every stage that regressed beyond `tolerance` (e.g. 0.1 = 10%)"""
+    regressions = []
+    for stage, current in results["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if previous is None:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{stage}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if (previous.get("throughput_per_s") and current.get("throughput_per_s") is not None
+                and current["throughput_per_s"] < previous["throughput_per_s"] * (1 - tolerance)):
+            regressions.append(f"{stage}: throughput {previous['throughput_per_s']}/s -> "
+                               f"{current['throughput_per_s']}/s")
+    return regressions
+
+
+def print_table(results: dict):
+    print(f"{'stage':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'items/s':>14}{'alloc MB':>10}")
+    for stage, stats in results["stages"].items():
+        print(f"{stage:<24}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}"
+              f"{stats['throughput_per_s']:>14.1f}{stats['peak_alloc_mb']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the Dispatcher pipeline")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="JSON results file")
+    parser.add_argument("--models", choices=("stand-in", "real"), default="stand-in")
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the query corpus")
+    parser.add_argument("--bundle-sizes", type=int, nargs="+", default=list(BUNDLE_SIZES))
+    parser.add_argument("--compare", metavar="BASELINE", help="results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    results = run(args.models, args.repeat, args.bundle_sizes)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print_table(results)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Before/after benchmark of the spaCy pipeline profiles
+
+Compares the original setup (the full model plus a plain EntityRuler, profile
+"full") with the slim profile and its pre-filtered GatedEntityRuler on the query
+corpus: entity agreement against the full pipeline, per-query latency, and
+startup time when building the pipeline versus loading the serialized copy.
+
+    python -m benchmarks.spacy_profiles -o spacy_profiles.json
+    python -m benchmarks.spacy_profiles --model blank:en   # no model download needed
+
+With `blank:en` only the EntityRuler differs between the profiles.
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.corpus import ALL_QUERIES
+from nlp_query.patterns.patients_patterns import PATIENT_PATTERNS
+from nlp_query.spacy_pipeline import PROFILES, build_pipeline, load_pipeline
+
+
+def entity_set(doc) -> set:
+    return {(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents}
+
+
+def latency(nlp, queries: list, repeat: int) -> dict:
+    for query in queries:
+        nlp(query)
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            nlp(query)
+            samples.append(time.perf_counter() - start)
+    samples = np.array(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p95_ms": round(float(np.percentile(samples, 95)), 4),
+        "p99_ms": round(float(np.percentile(samples, 99)), 4),
+        "throughput_per_s": round(len(samples) / (samples.sum() / 1000), 1),
+    }
+
+
+def agreement(reference: list, candidate: list) -> dict:
+    """Entity precision/recall of `candidate` docs against the `reference` docs"""
+    true_positives = predicted = expected = exact_docs = 0
+    for ref, cand in zip(reference, candidate):
+        ref_ents, cand_ents = entity_set(ref), entity_set(cand)
+        true_positives += len(ref_ents & cand_ents)
+        predicted += len(cand_ents)
+        expected += len(ref_ents)
+        exact_docs += ref_ents == cand_ents
+    return {
+        "precision": round(true_positives / predicted, 4) if predicted else 1.0,
+        "recall": round(true_positives / expected, 4) if expected else 1.0,
+        "identical_docs": f"{exact_docs}/{len(reference)}",
+    }
+
+
+def run(model: str, repeat: int) -> dict:
+    results = {"model": model, "queries": len(ALL_QUERIES), "profiles": {}}
+    pipelines = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for profile in PROFILES:
+            start = time.perf_counter()
+            nlp = build_pipeline(model, profile, PATIENT_PATTERNS)
+            build_s = time.perf_counter() - start
+            load_pipeline(model, profile, PATIENT_PATTERNS, cache_dir)  # writes the serialized copy
+            start = time.perf_counter()
+            load_pipeline(model, profile, PATIENT_PATTERNS, cache_dir)
+            load_s = time.perf_counter() - start
+            pipelines[profile] = nlp
+            results["profiles"][profile] = {
+                "components": nlp.pipe_names,
+                "startup_build_s": round(build_s, 3),
+                "startup_cached_s": round(load_s, 3),
+                **latency(nlp, ALL_QUERIES, repeat),
+            }
+
+    reference = [pipelines["full"](query) for query in ALL_QUERIES]
+    for profile, nlp in pipelines.items():
+        results["profiles"][profile]["entities"] = agreement(reference, [nlp(query) for query in ALL_QUERIES])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the full and slim spaCy pipeline profiles")
+    parser.add_argument("--model", default="en_core_web_sm", help="spaCy model, or blank:en")
+    parser.add_argument("--repeat", type=int, default=20, help="passes over the query corpus")
+    parser.add_argument("-o", "--output", default="spacy_profiles.json")
+    args = parser.parse_args()
+
+    results = run(args.model, args.repeat)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"{'profile':<8}{'p50 ms':>10}{'p95 ms':>10}{'docs/s':>10}{'build s':>10}{'cached s':>10}  entities")
+    for profile, stats in results["profiles"].items():
+        entities = stats["entities"]
+        print(f"{profile:<8}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['throughput_per_s']:>10.0f}"
+              f"{stats['startup_build_s']:>10.3f}{stats['startup_cached_s']:>10.3f}"
+              f"  P={entities['precision']} R={entities['recall']} identical={entities['identical_docs']}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Small local stand-ins for the HF pipelines and spaCy model
+
+They return the same output shapes as the real models, so every stage of the
+Dispatcher can be benchmarked without downloading weights or network access.
+Timings taken with them measure the pipeline around the models, not the models.
+"""
+import math
+import re
+
+import spacy
+
+from nlp_query.patterns.disease_codes import DISEASE_CODE
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+def _stems(text: str) -> set:
+    """Lower-cased words with a trailing plural "s" dropped, so "patient" overlaps "patients" labels"""
+    return {word[:-1] if len(word) > 3 and word.endswith("s") else word for word in _WORD.findall(text.lower())}
+
+
+class StandInZeroShotClassifier:
+    """Mimics the zero-shot-classification pipeline with word-overlap scores"""
+    def _classify(self, sequence: str, candidate_labels: list) -> dict:
+        words = _stems(sequence)
+        logits = [len(words & _stems(label)) + 1e-3 * i
+                  for i, label in enumerate(reversed(candidate_labels))][::-1]
+        total = sum(math.exp(logit) for logit in logits)
+        ranked = sorted(zip(candidate_labels, (math.exp(logit) / total for logit in logits)),
+                        key=lambda pair: -pair[1])
+        return {"sequence": sequence, "labels": [label for label, _ in ranked],
+                "scores": [score for _, score in ranked]}
+
+    def __call__(self, sequences, candidate_labels, **kwargs):
+        if isinstance(sequences, str):
+            return self._classify(sequences, candidate_labels)
+        return [self._classify(sequence, candidate_labels) for sequence in sequences]
+
+
+class StandInDiseaseNER:
+    """Mimics the aggregated NCBI-disease NER pipeline with a DISEASE_CODE gazetteer"""
+    def __init__(self):
+        words = {word for term in DISEASE_CODE for word in term.split()}
+        words |= {"hypertensive", "diabetic", "cancer"}
+        self.pattern = re.compile(r"\b(" + "|".join(sorted(map(re.escape, words), key=len, reverse=True)) + r")\b")
+
+    def _tag(self, text: str) -> list:
+        entities = []
+        previous_end = None
+        for match in self.pattern.finditer(text.lower()):
+            inside = previous_end is not None and match.start() == previous_end + 1
+            entities.append({"entity_group": "LABEL_2" if inside else "LABEL_1", "score": 0.99,
+                             "word": match.group(0), "start": match.start(), "end": match.end()})
+            previous_end = match.end()
+        return entities
+
+    def __call__(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self._tag(texts)
+        return [self._tag(text) for text in texts]
+
+
+def stand_in_nlp():
+    """Blank English pipeline; the Dispatcher adds the EntityRuler to it"""
+    return spacy.blank("en")
+
+
+def stand_in_components() -> dict:
+    """Keyword arguments for Dispatcher(...) that swap in every stand-in"""
+    return {"classifier": StandInZeroShotClassifier(), "nlp": stand_in_nlp(),
+            "medical_ner": StandInDiseaseNER()}
@@ -0,0 +1,141 @@
+"""Prebuilt model artifact bundles for offline startup
+
+A bundle is one local directory holding everything the Dispatcher loads:
+
+    manifest.json   format, version, components, per-file sha256 and content_hash
+    classifier/     zero-shot pipeline: tokenizer + safetensors weights
+    medical_ner/    disease NER pipeline: tokenizer + safetensors weights
+    spacy/          serialized spaCy pipeline with the PATIENT_PATTERNS EntityRuler
+    terminology/    condition vocabulary as a memory-mappable TerminologyIndex
+
+    python -m nlp_query.artifacts build bundles/2024-06-01 --profile slim
+    python -m nlp_query.artifacts verify bundles/2024-06-01
+
+`Dispatcher(artifact_dir=...)` then loads from the bundle with
+`local_files_only`, so startup never touches the HF hub and never rebuilds the
+EntityRuler. safetensors weights and the terminology arrays are read through
+mmap, so the OS page cache for the bundle files is shared by every process on
+the host. The manifest's `content_hash` is part of the plan-cache fingerprint.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+BUNDLE_FORMAT = 1
+MANIFEST = "manifest.json"
+COMPONENTS = ("classifier", "medical_ner", "spacy", "terminology")
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_files(directory: str) -> dict:
+    """sha256 of every file under `directory` except the manifest, keyed by relative path"""
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, directory).replace(os.sep, "/")
+            if relative != MANIFEST:
+                files[relative] = _file_digest(path)
+    return dict(sorted(files.items()))
+
+
+def content_hash(files: dict) -> str:
+    return hashlib.sha256(json.dumps(files, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_manifest(directory: str) -> dict:
+    """Read and check a bundle's manifest (the files themselves are checked by `verify_bundle`)"""
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"Unsupported artifact bundle format in {directory}")
+    missing = [name for name in COMPONENTS if not os.path.isdir(os.path.join(directory, name))]
+    if missing:
+        raise ValueError(f"Artifact bundle {directory} is missing {', '.join(missing)}")
+    return manifest
+
+
+def verify_bundle(directory: str) -> list:
+    """Files whose content no longer matches the manifest (empty when the bundle is intact)"""
+    manifest = load_manifest(directory)
+    actual = hash_files(directory)
+    expected = manifest["files"]
+    return sorted(path for path in set(expected) | set(actual) if expected.get(path) != actual.get(path))
+
+
+def build_bundle(output_dir: str, spacy_model: str = "en_core_web_sm", spacy_profile: str = "slim",
+                 terminology_path: str = None, version: str = None) -> dict:
+    """Load every model once and export it into `output_dir`; returns the manifest"""
+    from nlp_query.dispatcher import Dispatcher
+    from nlp_query.terminology import get_default_index
+
+    if os.path.exists(output_dir):
+        raise FileExistsError(f"{output_dir} already exists, bundles are never overwritten")
+    dispatcher = Dispatcher(plan_cache_size=0, spacy_model=spacy_model, spacy_profile=spacy_profile,
+                            terminology_path=terminology_path, gazetteer=False)
+    tmp_dir = f"{output_dir.rstrip(os.sep)}.tmp-{os.getpid()}"
+    try:
+        os.makedirs(tmp_dir)
+        dispatcher.classifier.save_pretrained(os.path.join(tmp_dir, "classifier"), safe_serialization=True)
+        dispatcher.medical_ner.save_pretrained(os.path.join(tmp_dir, "medical_ner"), safe_serialization=True)
+        dispatcher.nlp.to_disk(os.path.join(tmp_dir, "spacy"))
+        get_default_index().save(os.path.join(tmp_dir, "terminology"))
+        files = hash_files(tmp_dir)
+        manifest = {
+            "format": BUNDLE_FORMAT,
+            "version": version or time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()),
+            "components": {
+                "classifier": {"source": Dispatcher.CLASSIFIER_MODEL},
+                "medical_ner": {"source": Dispatcher.MEDICAL_NER_MODEL},
+                "spacy": {"source": spacy_model, "profile": spacy_profile, "pipes": dispatcher.nlp.pipe_names},
+                "terminology": {"source": terminology_path or "DISEASE_CODE"},
+            },
+            "files": files,
+            "content_hash": content_hash(files),
+        }
+        with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_dir, output_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or verify a prebuilt model artifact bundle")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="export every model into a new bundle directory")
+    build.add_argument("output_dir")
+    build.add_argument("--spacy-model", default="en_core_web_sm")
+    build.add_argument("--profile", choices=("full", "slim"), default="slim")
+    build.add_argument("--terminology", default=None, help="vocabulary file or index dir, DISEASE_CODE if unset")
+    build.add_argument("--version", default=None, help="version label, a UTC timestamp if unset")
+    verify = commands.add_parser("verify", help="re-hash a bundle against its manifest")
+    verify.add_argument("bundle_dir")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        manifest = build_bundle(args.output_dir, args.spacy_model, args.profile, args.terminology, args.version)
+        print(f"Bundle {manifest['version']} ({manifest['content_hash'][:12]}) written to {args.output_dir}")
+    else:
+        mismatched = verify_bundle(args.bundle_dir)
+        for path in mismatched:
+            print(f"changed: {path}")
+        if mismatched:
+            raise SystemExit(1)
+        print(f"{args.bundle_dir} matches its manifest")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 from typing import Dict, Any
 
 class FHIRBasePrompt:
-    def __init__(self, request_type: str):
+    def __init__(self, request_type: str, projection: Dict[str, Any] = None):
         # Each class can have its own NER model or rules
         self.request_type = request_type
+        # How much of each resource the server should send back, e.g.
+        # {"mode": "elements", "elements": ["name", "gender"]} or {"mode": "summary"}
+        self.projection = projection or {}
 
     def process(self, entities: Dict[str, Any]) -> Dict[str, Any]:
         """Further process entity to build final FHIR API payload"""
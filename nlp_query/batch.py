@@ -0,0 +1,131 @@
+"""Offline batch compiler: JSONL natural-language queries in, JSONL FHIR requests out
+
+    python -m nlp_query.batch queries.jsonl -o requests.out.jsonl --workers 4
+
+Each input line is either a JSON string or an object with a `query` (or `text`
+/ `prompt`) field and an optional `id`. Each output line carries the `id` (or
+the input line number), the query and the generated `request`, in input order.
+Queries are compiled in chunks with `Dispatcher.dispatch_batch`, which runs
+spaCy through `nlp.pipe` and the HF pipelines with `batch_size`. With
+`--workers N` the chunks are spread across N processes, each of which loads the
+models once.
+"""
+import argparse
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+QUERY_FIELDS = ("query", "text", "prompt")
+
+_worker_dispatcher = None
+
+
+def parse_query_line(line: str, line_number: int):
+    """Return (id, query) for one JSONL line, or raise ValueError"""
+    record = json.loads(line)
+    if isinstance(record, str):
+        return line_number, record
+    if isinstance(record, dict):
+        for name in QUERY_FIELDS:
+            if isinstance(record.get(name), str) and record[name].strip():
+                return record.get("id", line_number), record[name]
+    raise ValueError(f"line {line_number}: expected a string or an object with one of {QUERY_FIELDS}")
+
+
+def iter_query_records(lines, start: int = 1):
+    """Yield (id, query, error) for every non-blank JSONL line, numbering lines from `start`"""
+    for line_number, line in enumerate(lines, start):
+        if not line.strip():
+            continue
+        try:
+            record_id, query = parse_query_line(line, line_number)
+            yield record_id, query, None
+        except ValueError as e:  # json.JSONDecodeError is a ValueError too
+            yield line_number, None, str(e)
+
+
+def compile_chunk(dispatcher, records: list, base_url: str, batch_size: int, n_process: int) -> list:
+    """Compile one chunk of (id, query, error) records into output records"""
+    valid = [(record_id, query) for record_id, query, error in records if error is None]
+    payloads = iter(dispatcher.dispatch_batch([query for _, query in valid], base_url,
+                                              batch_size=batch_size, n_process=n_process)
+                    if valid else [])
+    results = []
+    for record_id, query, error in records:
+        if error is not None:
+            results.append({"id": record_id, "error": error})
+        else:
+            results.append({"id": record_id, "query": query, "request": next(payloads)})
+    return results
+
+
+def _init_worker(dispatcher_kwargs: dict):
+    """Load the models once per worker process"""
+    global _worker_dispatcher
+    from nlp_query.dispatcher import Dispatcher
+    _worker_dispatcher = Dispatcher(**dispatcher_kwargs)
+
+
+def _compile_in_worker(records: list, base_url: str, batch_size: int, n_process: int) -> list:
+    return compile_chunk(_worker_dispatcher, records, base_url, batch_size, n_process)
+
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def compile_queries(lines, base_url: str = "[base]", workers: int = 1, chunk_size: int = 256,
+                    batch_size: int = 32, n_process: int = 1, dispatcher_kwargs: dict = None):
+    """Yield output records for JSONL input lines, in input order
+
+    Only `2 * workers` chunks are in flight at a time, so arbitrarily large
+    inputs stream through in bounded memory.
+    """
+    chunks = chunked(iter_query_records(lines), chunk_size)
+    if workers <= 1:
+        _init_worker(dispatcher_kwargs or {})
+        for chunk in chunks:
+            yield from compile_chunk(_worker_dispatcher, chunk, base_url, batch_size, n_process)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(dispatcher_kwargs or {},)) as pool:
+        pending = []
+        for chunk in chunks:
+            pending.append(pool.submit(_compile_in_worker, chunk, base_url, batch_size, n_process))
+            if len(pending) >= 2 * workers:
+                yield from pending.pop(0).result()
+        for future in pending:
+            yield from future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a JSONL file of NL queries into FHIR requests")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL input file, '-' for stdin")
+    parser.add_argument("-o", "--output", default="-", help="JSONL output file, '-' for stdout")
+    parser.add_argument("--base-url", default="[base]")
+    parser.add_argument("--workers", type=int, default=1, help="processes, each with its own models")
+    parser.add_argument("--chunk-size", type=int, default=256, help="queries per dispatch_batch call")
+    parser.add_argument("--batch-size", type=int, default=32, help="batch_size for nlp.pipe and the HF pipelines")
+    parser.add_argument("--n-process", type=int, default=1, help="nlp.pipe processes per worker")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for record in compile_queries(source, args.base_url, workers=args.workers,
+                                      chunk_size=args.chunk_size, batch_size=args.batch_size,
+                                      n_process=args.n_process):
+            sink.write(json.dumps(record) + "\n")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,83 @@
-from nlp_query.base_prompt import FHIRBasePrompt 
+from nlp_query.base_prompt import FHIRBasePrompt
+from nlp_query.patient_prompt import PatientPrompt
 
 
 class ConditionPrompt(FHIRBasePrompt):
-    pass
\ No newline at end of file
+    """
+    ### Conditions
+
+    - **Code** (the condition, mapped to a SNOMED code)
+    - **Onset** (dates that aren't a birth or death date: "diagnosed before 2015")
+    - **Subject** (patient demographics, as chained `subject:Patient.*` parameters)
+
+    Searches add `_include=Condition:subject`, so every matching Condition and
+    its Patient come back in one Bundle (see `simplify_condition_data`).
+    """
+    INCLUDE = "Condition:subject"
+
+    def __init__(self, request_type, projection=None):
+        super().__init__(request_type, projection)
+        # patient fields and the condition itself are extracted exactly like PatientPrompt does
+        self.patient = PatientPrompt(request_type, projection)
+        self.data = {}
+
+    def fill_from_entities(self, entities):
+        """Extract the condition code, onset date and patient constraints"""
+        patient = self.patient
+        patient.fill_from_entities(entities)
+        patient.data.pop("condition", None)
+        codes = patient.condition_codes()
+        if codes: # a comma is OR, each Condition has a single code
+            self.data["code"] = ",".join(map(str, codes))
+        onset = self._onset_entity(entities)
+        if onset:
+            self.data["onset-date"] = self._normalize_onset(onset)
+        for field, value in patient.data.items():
+            if value is not None:
+                self.data[f"subject:Patient.{field}"] = value
+
+    def _onset_entity(self, entities):
+        """First date entity that the birth/death keywords didn't claim"""
+        index = self.patient.entity_index
+        claimed = set()
+        for keyword in entities:
+            if keyword.get("label") in ("BIRTH_KEYWORD", "DEATH_KEYWORD"):
+                ent = index.next_after(PatientPrompt.DATE_LABELS + PatientPrompt.AGE_LABELS, keyword['end'])
+                if ent:
+                    claimed.add(id(ent))
+        ent = index.first(PatientPrompt.DATE_LABELS)
+        while ent is not None and id(ent) in claimed:
+            ent = index.next_after(PatientPrompt.DATE_LABELS, ent['start'])
+        return ent
+
+    def _normalize_onset(self, entity):
+        """onset-date value(s); a year range becomes two parameters since "," would mean OR"""
+        value = self.patient._normalize_date(entity)
+        if value and "," in value:
+            return value.split(",")
+        return value
+
+    def process(self, entities: list, base_url: str = "[base]") -> dict:
+        """Generate FHIR API request based on request_type"""
+        if self.request_type != "search":
+            raise NotImplementedError(f"Condition {self.request_type} requests are not supported yet")
+        self.fill_from_entities(entities)
+        return self._generate_get_request(base_url)
+
+    def _generate_get_request(self, base_url: str = "[base]") -> dict:
+        """Generate GET request for a FHIR Condition search that includes the subjects"""
+        query_params = []
+        for field, value in self.data.items():
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, bool):
+                    query_params.append(f"{field}={str(item).lower()}")
+                else:
+                    query_params.append(f"{field}={str(item).replace(' ', '%20')}")
+        query_params.append(f"_include={self.INCLUDE}")
+        query_string = "&".join(query_params)
+        return {
+            "method": "GET",
+            "url": f"{base_url}/Condition?{query_string}",
+            "parameters": dict(self.data),
+            "query_string": query_string
+        }
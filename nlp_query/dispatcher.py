@@ -1,19 +1,94 @@
 from transformers import pipeline
 from transformers import pipeline
 import spacy
-import pandas as pd
+import copy
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from nlp_query.base_prompt import FHIRBasePrompt
 from nlp_query.patient_prompt import PatientPrompt
 from nlp_query.condition_prompt import ConditionPrompt
 from nlp_query.patterns.patients_patterns import PATIENT_PATTERNS
+from nlp_query.intent_rules import RuleIntentScorer
+from nlp_query.plan_cache import PlanCache, vocabulary_fingerprint
+from nlp_query.terminology import TerminologyIndex, set_default_index
+from nlp_query.spacy_pipeline import load_pipeline
+from nlp_query.gazetteer import ConditionGazetteer
+from nlp_query.artifacts import load_manifest
+from nlp_query.patterns.condition_synonyms import CONDITION_SYNONYMS
+import os
 
 """Dispatcher to classify prompts and route to appropriate FHIR resource handlers"""
 class Dispatcher:
     """Main dispatcher class to classify and route prompts"""
     CONF_THRESHOLD = 0.5
-    def __init__(self):
-        """Initialize the dispatcher with resource templates and classifiers"""
-        self.resource_templates = {"medical conditions": PatientPrompt, # Currently we're expecting only specific format. since I'm using reverse condition, I'll modify this for now to patient prompt
+    MODELS = ("classifier", "spacy", "medical_ner")
+    CLASSIFIER_MODEL = "facebook/bart-large-mnli"
+    MEDICAL_NER_MODEL = "sarahmiller137/distilbert-base-uncased-ft-ncbi-disease"
+    # tokens shared by consecutive 512-token windows when a note is longer than the disease NER's input
+    MEDICAL_NER_STRIDE = 64
+    # one query per intent family, so a warm-up pass reaches every pattern group and the condition path
+    WARM_UP_QUERIES = (
+        "Show me patients over 50 with diabetes",
+        "Find female patients born after 1990",
+        "Patients with last name Smith whose GP is Dr. John Brown",
+        "Find the patient with email jane.doe@example.com or phone 555-123-4567",
+        "List patients who died in 2020",
+    )
+    def __init__(self, joint_classification: bool = True, cascade: bool = True,
+                 conf_threshold: float = None, projection: dict = None, plan_cache_size: int = 1024,
+                 terminology_path: str = None, classifier=None, nlp=None, medical_ner=None,
+                 spacy_model: str = "en_core_web_sm", spacy_profile: str = "full", spacy_cache_dir: str = None,
+                 gazetteer: bool = True, condition_synonyms: dict = None, lazy: bool = False,
+                 artifact_dir: str = None):
+        """Initialize the dispatcher with resource templates and classifiers
+
+        Args:
+            joint_classification: score resource and request labels in one
+                zero-shot call instead of two (see `classify`).
+            cascade: try the rule scorer first and only run the zero-shot model
+                when its confidence is below `conf_threshold`.
+            conf_threshold: rule confidence needed to skip the model, defaults to CONF_THRESHOLD.
+            projection: passed to the resource classes to trim search results
+                (see PatientPrompt._projection_params).
+            plan_cache_size: how many compiled plans to keep per normalized prompt, 0 disables the cache.
+            terminology_path: condition vocabulary to match against instead of DISEASE_CODE,
+                either an index directory or a vocabulary file (see nlp_query/terminology.py).
+            classifier, nlp, medical_ner: use these instead of loading the default
+                zero-shot pipeline, spaCy model and disease NER pipeline (e.g. small
+                stand-ins for benchmarks).
+            spacy_model, spacy_profile, spacy_cache_dir: which spaCy pipeline to load when `nlp`
+                isn't given; "slim" keeps only what produces `doc.ents`, and a cache dir keeps the
+                built pipeline on disk between startups (see nlp_query/spacy_pipeline.py).
+            gazetteer: look conditions up in DISEASE_CODE and `condition_synonyms` (defaults to
+                CONDITION_SYNONYMS) first, and only run the medical NER on prompts without a hit.
+            lazy: don't load the models yet; call `load_models` (e.g. from a background task)
+                and check `ready` before dispatching.
+            artifact_dir: load the models, the spaCy pipeline and (unless `terminology_path` is
+                given) the condition vocabulary from a prebuilt bundle, offline (see nlp_query/artifacts.py).
+        """
+        self.joint_classification = joint_classification
+        self.cascade = cascade
+        self.conf_threshold = self.CONF_THRESHOLD if conf_threshold is None else conf_threshold
+        self.rule_scorer = RuleIntentScorer()
+        self.classification_paths = Counter({"rules": 0, "model": 0})
+        self.stage_listeners = []
+        self.projection = projection
+        self.ruler_patterns = []
+        self.plan_cache = PlanCache(plan_cache_size) if plan_cache_size else None
+        self.terminology_path = terminology_path
+        self.condition_synonyms = CONDITION_SYNONYMS if condition_synonyms is None else condition_synonyms
+        self.gazetteer = None
+        self.artifact_dir = artifact_dir
+        self.artifact_hash = None
+        if artifact_dir:
+            self.artifact_hash = load_manifest(artifact_dir)["content_hash"]
+            terminology_path = terminology_path or os.path.join(artifact_dir, "terminology")
+        if terminology_path:
+            self.load_terminology(terminology_path)
+        self.resource_templates = {"medical conditions": ConditionPrompt, # Condition search with the patients pulled in through _include
                                    "patients information": PatientPrompt, 
                                    "others": FHIRBasePrompt}
         self.requests = {
@@ -24,36 +99,229 @@ class Dispatcher:
             "query patient database": "search",
             "delete patient record": "delete",
         }
-        self.classifier = pipeline(
+        self.classifier = self.nlp = self.medical_ner = None
+        self.model_options = {
+            "classifier": classifier, "nlp": nlp, "medical_ner": medical_ner, "spacy_model": spacy_model,
+            "spacy_profile": spacy_profile, "spacy_cache_dir": spacy_cache_dir, "gazetteer": gazetteer,
+        }
+        self.model_states = {name: "pending" for name in self.MODELS}
+        self.warm_up_state = "pending"
+        if not lazy:
+            self.load_models()
+
+    @property
+    def ready(self) -> bool:
+        """Every model is loaded (warm-up is tracked separately in `warm_up_state`)"""
+        return all(state == "ready" for state in self.model_states.values())
+
+    def load_models(self, parallel: bool = False):
+        """Load the zero-shot classifier, the spaCy pipeline and the disease NER (see __init__)
+
+        With `parallel` the three load on their own threads and the first failure
+        is re-raised once all of them finished. Progress is kept in `model_states`
+        ("pending", "loading", "ready" or "failed: <error>").
+        """
+        loaders = {"classifier": self._load_classifier, "spacy": self._load_spacy,
+                   "medical_ner": self._load_medical_ner}
+        if not parallel:
+            for name, load in loaders.items():
+                self._track_load(name, load)
+            return
+        with ThreadPoolExecutor(max_workers=len(loaders), thread_name_prefix="model-load") as pool:
+            futures = [pool.submit(self._track_load, name, load) for name, load in loaders.items()]
+        for future in futures:
+            future.result()
+
+    def warm_up(self, queries: list = None, base_url: str = "[base]"):
+        """Run representative queries through every model stage once
+
+        Pays for lazy initialization (torch kernels, tokenizer caches, matcher
+        compilation) before real traffic arrives. Bypasses the plan cache, and
+        stage listeners and classification counters don't see the warm-up.
+        """
+        queries = list(queries or self.WARM_UP_QUERIES)
+        self.warm_up_state = "running"
+        listeners, paths = self.stage_listeners, self.classification_paths.copy()
+        self.stage_listeners = []
+        try:
+            self._dispatch_uncached(queries, base_url, batch_size=len(queries), n_process=1)
+            self._classify_joint(queries) # the rule cascade usually answers these without the model
+        except Exception as e:
+            self.warm_up_state = f"failed: {type(e).__name__}: {e}"
+            raise
+        finally:
+            self.stage_listeners = listeners
+            self.classification_paths = paths
+        self.warm_up_state = "done"
+
+    def _track_load(self, name: str, load):
+        self.model_states[name] = "loading"
+        try:
+            load()
+        except Exception as e:
+            self.model_states[name] = f"failed: {type(e).__name__}: {e}"
+            raise
+        self.model_states[name] = "ready"
+
+    def _load_classifier(self):
+        classifier = self.model_options["classifier"]
+        if classifier is None:
+            classifier = pipeline(
                 "zero-shot-classification",
-                model="facebook/bart-large-mnli"
+                **self._model_source("classifier", self.CLASSIFIER_MODEL)
             )
+        self.classifier = classifier
+
+    def _load_spacy(self):
+        options = self.model_options
+        nlp, gazetteer = options["nlp"], options["gazetteer"]
         #self.nlp = spacy.load("en_core_web_trf")
-        self.nlp = spacy.load("en_core_web_sm")
-        self.add_entity_ruler_patterns(PATIENT_PATTERNS) # add condition patterns as well later here
-        self.medical_ner = pipeline(
-            "ner",
-            model="sarahmiller137/distilbert-base-uncased-ft-ncbi-disease",
-            tokenizer="sarahmiller137/distilbert-base-uncased-ft-ncbi-disease",
-            aggregation_strategy="simple"
-        )
-    def classify(self, prompt: str):
-        """Classify the prompt into a FHIR resource and request type"""
-        classify_resource = self.classifier(prompt, list(self.resource_templates.keys()))
-        classify_request = self.classifier(prompt, list(self.requests.keys()))
-        
-        resource_idx_max = pd.Series(classify_resource['scores']).idxmax()
-        resource = classify_resource['labels'][resource_idx_max]
-        
-        request_idx_max = pd.Series(classify_request['scores']).idxmax()
-        request = classify_request['labels'][request_idx_max]
-        
-        return self.resource_templates[resource], self.requests[request]
+        if nlp is None and self.artifact_dir:
+            self.nlp = spacy.load(os.path.join(self.artifact_dir, "spacy"))
+            self.ruler_patterns.extend(self.nlp.get_pipe("entity_ruler").patterns) # baked into the bundle
+            self.refresh_plan_cache()
+        elif nlp is None:
+            self.nlp = load_pipeline(options["spacy_model"], options["spacy_profile"], PATIENT_PATTERNS,
+                                     options["spacy_cache_dir"])
+            self.ruler_patterns.extend(PATIENT_PATTERNS) # already in the loaded EntityRuler
+            self.refresh_plan_cache()
+        else:
+            self.nlp = nlp
+            self.add_entity_ruler_patterns(PATIENT_PATTERNS) # add condition patterns as well later here
+        if gazetteer:
+            self.gazetteer = ConditionGazetteer(self.nlp, synonyms=self.condition_synonyms)
+            self.refresh_plan_cache()
+
+    def _load_medical_ner(self):
+        medical_ner = self.model_options["medical_ner"]
+        if medical_ner is None:
+            medical_ner = pipeline(
+                "ner",
+                **self._model_source("medical_ner", self.MEDICAL_NER_MODEL),
+                aggregation_strategy="simple",
+                stride=self.MEDICAL_NER_STRIDE  # long notes run in overlapping windows instead of being truncated
+            )
+        self.medical_ner = medical_ner
+
+    def _model_source(self, component: str, hub_model: str) -> dict:
+        """pipeline() arguments for a model from the artifact bundle, or from the HF hub without one"""
+        if not self.artifact_dir:
+            return {"model": hub_model, "tokenizer": hub_model}
+        path = os.path.join(self.artifact_dir, component)
+        return {"model": path, "tokenizer": path, "model_kwargs": {"local_files_only": True}}
+
+    def add_stage_listener(self, listener):
+        """Call `listener(stage, seconds, items)` after every timed pipeline stage
+
+        Stages are "intent_rules", "classify" (zero-shot model), "spacy_ner",
+        "medical_ner" and "process". Model stages run once per batch, so `items`
+        is the number of prompts the timing covers.
+        """
+        self.stage_listeners.append(listener)
+
+    @contextmanager
+    def _stage(self, name: str, items: int = 1):
+        if not self.stage_listeners:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            for listener in self.stage_listeners:
+                listener(name, elapsed, items)
+
+    def classify(self, prompt: str, entities: list = None, joint: bool = None):
+        """Classify the prompt into a FHIR resource and request type
+
+        When the cascade is on, the rule scorer runs first (using `entities` from
+        `apply_ner` if given) and the zero-shot model is only called when the rules
+        are unsure. `joint` overrides the `joint_classification` switch for this call.
+        """
+        return self.classify_batch([prompt], [entities], joint=joint)[0]
+
+    def classify_batch(self, prompts: list, entities_batch: list = None, joint: bool = None):
+        """Classify several prompts, sending only the ones the rules are unsure about to the model"""
+        if entities_batch is None:
+            entities_batch = [None] * len(prompts)
+        results = [None] * len(prompts)
+        model_indices = []
+        with self._stage("intent_rules", len(prompts)):
+            for i, (prompt, entities) in enumerate(zip(prompts, entities_batch)):
+                if self.cascade:
+                    resource, request, confidence = self.rule_scorer.score(prompt, entities)
+                    if resource and request and confidence >= self.conf_threshold:
+                        self.classification_paths["rules"] += 1
+                        results[i] = (self.resource_templates[resource], request)
+                        continue
+                model_indices.append(i)
+
+        if model_indices:
+            self.classification_paths["model"] += len(model_indices)
+            if joint is None:
+                joint = self.joint_classification
+            model_prompts = [prompts[i] for i in model_indices]
+            with self._stage("classify", len(model_prompts)):
+                if joint:
+                    predicted = self._classify_joint(model_prompts)
+                else:
+                    predicted = self._classify_separate(model_prompts)
+            for i, (resource, request) in zip(model_indices, predicted):
+                results[i] = (self.resource_templates[resource], self.requests[request])
+        return results
+
+    def _classify_joint(self, prompts: list):
+        """Score all resource and request hypotheses of each prompt in a single padded batch"""
+        labels = list(self.resource_templates.keys()) + list(self.requests.keys())
+        labeled = []
+        for result in self.classifier(prompts, labels, batch_size=len(labels)):
+            # The entailment logit of each hypothesis doesn't depend on the other candidates,
+            # so the best label of each group in the joint ranking is also that group's argmax.
+            resource = next(label for label in result['labels'] if label in self.resource_templates)
+            request = next(label for label in result['labels'] if label in self.requests)
+            labeled.append((resource, request))
+        return labeled
+
+    def _classify_separate(self, prompts: list):
+        """Score resource and request labels with one zero-shot call each"""
+        classify_resource = self.classifier(prompts, list(self.resource_templates.keys()))
+        classify_request = self.classifier(prompts, list(self.requests.keys()))
+        return [(self._argmax_label(resource), self._argmax_label(request))
+                for resource, request in zip(classify_resource, classify_request)]
+
+    @staticmethod
+    def _argmax_label(result: dict) -> str:
+        """Return the label with the highest score from a zero-shot result"""
+        scores = result['scores']
+        return result['labels'][max(range(len(scores)), key=scores.__getitem__)]
+
+    def compare_classification(self, prompt: str) -> dict:
+        """Run joint and separate classification side by side on the same prompt"""
+        joint = self._classify_joint([prompt])[0]
+        separate = self._classify_separate([prompt])[0]
+        return {
+            "joint": {"resource": joint[0], "request": joint[1]},
+            "separate": {"resource": separate[0], "request": separate[1]},
+            "match": joint == separate,
+        }
     
+    def cascade_stats(self) -> dict:
+        """Report how often each classification path was taken"""
+        total = sum(self.classification_paths.values())
+        return {
+            "rules": self.classification_paths["rules"],
+            "model": self.classification_paths["model"],
+            "total": total,
+            "skipped_ratio": self.classification_paths["rules"] / total if total else 0.0,
+        }
+
     def create_ruler(self):
         """Add resource-specific rules"""
         if "entity_ruler" not in self.nlp.pipe_names:
-            ruler = self.nlp.add_pipe("entity_ruler", before="ner")
+            # before "ner" so the statistical model respects the rule matches
+            placement = {"before": "ner"} if "ner" in self.nlp.pipe_names else {}
+            ruler = self.nlp.add_pipe("entity_ruler", **placement)
         else:
             ruler = self.nlp.get_pipe("entity_ruler")
         return ruler
@@ -62,13 +330,58 @@ class Dispatcher:
         """Add patterns to the EntityRuler"""
         ruler = self.create_ruler()
         ruler.add_patterns(patterns)
+        self.ruler_patterns.extend(patterns)
+        self.refresh_plan_cache()
+
+    def load_terminology(self, path: str):
+        """Use a terminology index directory or vocabulary file for condition codes"""
+        if os.path.isdir(path):
+            index = TerminologyIndex.load(path)
+        else:
+            index = TerminologyIndex.from_vocabulary_file(path)
+        set_default_index(index)
+        self.terminology_path = path
+        self.refresh_plan_cache()
+
+    def refresh_plan_cache(self):
+        """Invalidate cached plans if the patterns, disease codes, vocabulary or projection changed"""
+        if self.plan_cache is not None:
+            self.plan_cache.set_fingerprint(vocabulary_fingerprint(
+                self.ruler_patterns,
+                extra=json.dumps([self.projection, self.terminology_path, self.artifact_hash,
+                                  self.condition_synonyms if self.gazetteer else None], sort_keys=True),
+            ))
     
     def apply_ner(self, prompt: str):
         """Extract entities using NER + EntityRuler"""
-        doc = self.nlp(prompt)
+        return self.apply_ner_batch([prompt])[0]
+
+    def apply_ner_batch(self, prompts: list, batch_size: int = 32, n_process: int = 1):
+        """Extract entities for several prompts with `nlp.pipe` and one batched medical NER call
+
+        With the gazetteer on, only prompts in which it found no condition go to the medical NER.
+        """
+        with self._stage("spacy_ner", len(prompts)):
+            docs = list(self.nlp.pipe(prompts, batch_size=batch_size, n_process=n_process))
+        if self.gazetteer is not None:
+            with self._stage("gazetteer", len(prompts)):
+                medical_batch = [self.gazetteer(doc) for doc in docs]
+        else:
+            medical_batch = [[] for _ in prompts]
+        ner_indices = [i for i, found in enumerate(medical_batch) if not found]
+        if ner_indices:
+            with self._stage("medical_ner", len(ner_indices)):
+                found = self.medical_ner([prompts[i] for i in ner_indices], batch_size=batch_size)
+            for i, medical_entities in zip(ner_indices, found):
+                medical_batch[i] = medical_entities
+        return [self._collect_entities(doc, medical_entities)
+                for doc, medical_entities in zip(docs, medical_batch)]
+
+    @staticmethod
+    def _collect_entities(doc, medical_entities: list) -> list:
+        """Merge spaCy/EntityRuler entities with the medical NER output"""
         entities = [{"text": ent.text, "label": ent.label_, "start": ent.start_char, "end": ent.end_char} 
                     for ent in doc.ents]
-        medical_entities = self.medical_ner(prompt)
         for ent in medical_entities:
             if ent['entity_group'] != 'LABEL_0':
                 entities.append({"text": ent['word'], "label": ent['entity_group'], 
@@ -77,13 +390,65 @@ class Dispatcher:
     
     def dispatch(self, prompt: str, base_url: str = "[base]"):
         """Main dispatch function to classify, extract entities, and generate payload"""
-        fhir_resource, request = self.classify(prompt)
-        entities = self.apply_ner(prompt)
+        return self.dispatch_batch([prompt], base_url)[0]
+
+    def dispatch_batch(self, prompts: list, base_url: str = "[base]", batch_size: int = 32,
+                       n_process: int = 1):
+        """Dispatch several prompts, running each model stage once for the whole batch
+
+        Prompts with a cached plan skip the models entirely, and prompts that
+        normalize to the same key within the batch are only compiled once.
+        """
+        if self.plan_cache is None:
+            return self._dispatch_uncached(prompts, base_url, batch_size, n_process)
+
+        results = [None] * len(prompts)
+        misses = {}  # cache key -> indices of the prompts that share it
+        for i, prompt in enumerate(prompts):
+            key = self.plan_cache.key(prompt, base_url)
+            cached = self.plan_cache.get(key)
+            if cached is not None:
+                results[i] = cached
+            else:
+                misses.setdefault(key, []).append(i)
+        if misses:
+            miss_prompts = [prompts[indices[0]] for indices in misses.values()]
+            payloads = self._dispatch_uncached(miss_prompts, base_url, batch_size, n_process)
+            for (key, indices), payload in zip(misses.items(), payloads):
+                results[indices[0]] = payload
+                if "exception" in payload:  # failures aren't cached, they may not be the prompt's fault
+                    for i in indices[1:]:
+                        results[i] = copy.deepcopy(payload)
+                    continue
+                self.plan_cache.put(key, payload)
+                for i in indices[1:]:
+                    results[i] = self.plan_cache.get(key)
+        return results
+
+    def _dispatch_uncached(self, prompts: list, base_url: str, batch_size: int, n_process: int):
+        """Run every model stage and the resource classes on a batch of prompts"""
+        entities_batch = self.apply_ner_batch(prompts, batch_size=batch_size, n_process=n_process) # NER first so the rule cascade can use the ruler labels
+        classified = self.classify_batch(prompts, entities_batch)
+        return [self._build_payload(entities, fhir_resource, request, base_url)
+                for entities, (fhir_resource, request) in zip(entities_batch, classified)]
+
+    def _build_payload(self, entities: list, fhir_resource, request: str, base_url: str):
+        """Hand the extracted entities to the resource class to generate the payload
+
+        A prompt the resource class fails on gets an error payload with the
+        exception name under "exception", so the rest of its batch still
+        compiles and only that caller sees the failure.
+        """
         if not entities:
             return {"error": "No entities found", "resource": str(fhir_resource.__name__)}
-        fhir_prompt = fhir_resource(request) # Instantionation happend here
         try: 
-            payload = fhir_prompt.process(entities, base_url) # a base url can be passed here
+            fhir_prompt = fhir_resource(request, projection=self.projection) # Instantionation happend here
+            with self._stage("process"):
+                payload = fhir_prompt.process(entities, base_url) # a base url can be passed here
         except NotImplementedError as e:
             return {"error": str(e), "resource": str(fhir_resource.__name__)}
+        except Exception as e:
+            print(f"{fhir_resource.__name__} failed on {entities}: {type(e).__name__}: {e}")
+            return {"error": f"{type(e).__name__}: {e}", "resource": str(fhir_resource.__name__),
+                    "exception": type(e).__name__}
         return payload
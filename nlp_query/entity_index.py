@@ -0,0 +1,53 @@
+"""Offset index over extracted entities for the resource-class normalizers"""
+from bisect import bisect_left, bisect_right
+
+
+class EntityIndex:
+    """Entities grouped per label, each group sorted by start offset
+
+    Replaces the "scan every entity for the next PERSON after this trigger"
+    loops. Building is linear for offset-ordered input and each lookup is a
+    bisect, so n entities with t triggers cost O(n + t log n) instead of O(n * t).
+    Ties keep list order, matching the old first-match scans.
+    """
+    def __init__(self, entities: list):
+        self.entities = entities
+        self.by_label = {}
+        for position, ent in enumerate(entities):
+            self.by_label.setdefault(ent.get("label"), []).append((ent.get("start", 0), position, ent))
+        self.starts = {}
+        for label, group in self.by_label.items():
+            group.sort(key=lambda item: item[:2])
+            self.starts[label] = [start for start, _, _ in group]
+        # (label, start) / (label, end) -> first entity in list order, for adjacency checks
+        self._at_start = {}
+        self._at_end = {}
+        for ent in entities:
+            self._at_start.setdefault((ent.get("label"), ent.get("start")), ent)
+            self._at_end.setdefault((ent.get("label"), ent.get("end")), ent)
+
+    def first(self, labels):
+        """Earliest entity with one of `labels`, or None"""
+        return self.next_after(labels, float("-inf"), inclusive=True)
+
+    def next_after(self, labels, offset: int, inclusive: bool = False):
+        """Earliest entity with one of `labels` starting after `offset` (at or after if `inclusive`)"""
+        if isinstance(labels, str):
+            labels = (labels,)
+        best = None
+        for label in labels:
+            starts = self.starts.get(label)
+            if not starts:
+                continue
+            i = bisect_left(starts, offset) if inclusive else bisect_right(starts, offset)
+            if i < len(starts):
+                candidate = self.by_label[label][i]
+                if best is None or candidate[:2] < best[:2]:
+                    best = candidate
+        return best[2] if best is not None else None
+
+    def starting_at(self, label: str, offset: int):
+        return self._at_start.get((label, offset))
+
+    def ending_at(self, label: str, offset: int):
+        return self._at_end.get((label, offset))
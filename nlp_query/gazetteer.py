@@ -0,0 +1,60 @@
+"""Exact-phrase condition gazetteer that runs ahead of the disease NER model
+
+A spaCy PhraseMatcher over the DISEASE_CODE terms and their synonyms, matched
+case-insensitively on docs the spaCy pipeline already produced. Hits are
+returned in the same shape as the HF NER pipeline output, labelled LABEL_1 with
+the canonical DISEASE_CODE term as the text, so `PatientPrompt._normalize_condition`
+and `_get_disease_code` handle them unchanged.
+
+Any hit skips the disease NER for that prompt, so a match used figuratively
+("a stroke of luck", "the flu-like illness") is dropped and the NER decides instead.
+"""
+import json
+
+from spacy.matcher import PhraseMatcher
+from spacy.tokens import Span
+from spacy.util import filter_spans
+
+from nlp_query.patterns.condition_synonyms import CONDITION_SYNONYMS
+from nlp_query.patterns.disease_codes import DISEASE_CODE
+
+# a term directly followed by one of these is not naming the condition
+FIGURATIVE_FOLLOWERS = {"of", "like", "-like"}
+
+
+def load_synonyms(path: str) -> dict:
+    """Read a JSON {synonym: canonical term} file"""
+    with open(path, encoding="utf-8") as f:
+        return {str(k): str(v) for k, v in json.load(f).items()}
+
+
+class ConditionGazetteer:
+    """Find known condition phrases in a Doc"""
+    def __init__(self, nlp, terms: dict = None, synonyms: dict = None):
+        self.terms = {term.lower(): term for term in (DISEASE_CODE if terms is None else terms)}
+        for synonym, canonical in (CONDITION_SYNONYMS if synonyms is None else synonyms).items():
+            self.terms.setdefault(synonym.lower(), canonical)
+        self.matcher = PhraseMatcher(nlp.vocab, attr="LOWER")
+        # canonical terms are the match keys; make_doc only tokenizes, the patterns don't need the pipeline
+        phrases = {}
+        for phrase, canonical in self.terms.items():
+            phrases.setdefault(canonical, []).append(nlp.make_doc(phrase))
+        for canonical, docs in phrases.items():
+            self.matcher.add(canonical, docs)
+
+    def __call__(self, doc) -> list:
+        """Longest non-overlapping matches as NER-pipeline-style dicts"""
+        spans = filter_spans([Span(doc, start, end, label=match_id) for match_id, start, end in self.matcher(doc)])
+        spans = [span for span in spans if not self._figurative(doc, span)]
+        return [{"entity_group": "LABEL_1", "score": 1.0, "word": span.label_,
+                 "start": span.start_char, "end": span.end_char} for span in spans]
+
+    @staticmethod
+    def _figurative(doc, span) -> bool:
+        """Match followed by "of"/"like" ("stroke of luck", "flu-like")"""
+        if span.end >= len(doc):
+            return False
+        following = doc[span.end].lower_
+        if following == "-" and span.end + 1 < len(doc):
+            following = "-" + doc[span.end + 1].lower_
+        return following in FIGURATIVE_FOLLOWERS
@@ -0,0 +1,75 @@
+"""Cheap rule/lexicon intent scorer used ahead of the zero-shot classifier"""
+import re
+from collections import Counter
+
+# Keyword lexicon per request type (values of Dispatcher.requests)
+REQUEST_KEYWORDS = {
+    "search": ["show", "find", "list", "search", "get", "display", "retrieve", "fetch",
+               "which", "who", "how many", "look up", "give me", "query"],
+    "create": ["create", "add", "register", "enroll", "admit", "new patient", "new record"],
+    "update": ["update", "change", "modify", "edit", "correct", "rename"],
+    "delete": ["delete", "remove", "erase", "discard"],
+}
+
+# Keyword lexicon per resource label (keys of Dispatcher.resource_templates)
+RESOURCE_KEYWORDS = {
+    "patients information": ["patient", "patients", "people", "person", "persons",
+                             "men", "women", "children", "adults", "record", "records"],
+    "medical conditions": ["case", "cases", "condition", "conditions", "diagnosis",
+                           "diagnosed", "diagnoses"],
+}
+
+# EntityRuler / spaCy labels that only make sense when talking about patients
+PATIENT_ENTITY_LABELS = {
+    "GENDER_MALE", "GENDER_FEMALE", "GENDER_OTHER",
+    "AGE_OVER", "AGE_UNDER", "AGE_EXACT", "AGE",
+    "BIRTH_KEYWORD", "DEATH_KEYWORD",
+    "GIVEN_NAME_TRIGGER", "FAMILY_NAME_TRIGGER", "NAME_GENERAL",
+    "GP_TRIGGER", "PHONE", "EMAIL", "IDENTIFIER", "PERSON",
+}
+
+
+def _compile_lexicon(lexicon: dict) -> dict:
+    """Compile each keyword list into a single word-boundary regex"""
+    return {
+        key: re.compile(r"\b(?:" + "|".join(re.escape(word) for word in words) + r")\b")
+        for key, words in lexicon.items()
+    }
+
+
+class RuleIntentScorer:
+    """Score resource and request intent from keywords and EntityRuler labels
+
+    Confidence is the margin between the best and the runner-up category divided
+    by the total number of hits, so a lone category scores 1.0, a tie scores 0.0
+    and no evidence at all scores 0.0.
+    """
+    def __init__(self, request_keywords: dict = None, resource_keywords: dict = None):
+        self.request_patterns = _compile_lexicon(request_keywords or REQUEST_KEYWORDS)
+        self.resource_patterns = _compile_lexicon(resource_keywords or RESOURCE_KEYWORDS)
+
+    def score(self, prompt: str, entities: list = None):
+        """Return (resource_label, request_type, confidence) for the prompt"""
+        text = prompt.lower()
+        request_hits = Counter({key: len(pattern.findall(text))
+                                for key, pattern in self.request_patterns.items()})
+        resource_hits = Counter({key: len(pattern.findall(text))
+                                 for key, pattern in self.resource_patterns.items()})
+        for ent in entities or []:
+            if ent.get("label") in PATIENT_ENTITY_LABELS:
+                resource_hits["patients information"] += 1
+
+        request, request_conf = self._margin(request_hits)
+        resource, resource_conf = self._margin(resource_hits)
+        return resource, request, min(request_conf, resource_conf)
+
+    @staticmethod
+    def _margin(hits: Counter):
+        """Return the top category and its margin-based confidence"""
+        ranked = hits.most_common(2)
+        total = sum(hits.values())
+        if not ranked or total == 0:
+            return None, 0.0
+        top_key, top = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0
+        return top_key, (top - runner_up) / total
@@ -0,0 +1,380 @@
+"""Out-of-process model server shared by several API workers
+
+One process loads the zero-shot classifier, the spaCy pipeline and the disease
+NER and answers NER / classification requests over a Unix domain socket:
+
+    python -m nlp_query.model_server --socket /tmp/fhir-nl-models.sock
+
+API workers started with MODEL_SERVER_SOCKET use a `RemoteDispatcher`, which
+keeps the rule cascade, the plan cache and the resource classes in-process and
+only sends the model stages to the server, so each worker stays small and
+HTTP workers can be scaled without multiplying model memory.
+
+Wire format: every message is a 5-byte header (one op / status byte and a
+big-endian uint32 payload length) followed by the payload, a compact tagged
+binary encoding of None, bools, ints, floats, strings, lists and string-keyed
+dicts (see `encode` / `decode`). Entities travel as [text, label, start, end].
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from nlp_query.dispatcher import Dispatcher
+from nlp_query.plan_cache import vocabulary_fingerprint
+
+OP_INFO = 0
+OP_NER = 1
+OP_CLASSIFY = 2
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+HEADER = struct.Struct("!BI")
+_INT = struct.Struct("!q")
+_FLOAT = struct.Struct("!d")
+_LEN = struct.Struct("!I")
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+
+class ModelServerError(RuntimeError):
+    """The model server could not be reached or failed to handle a request"""
+
+
+def _encode(value, out: bytearray):
+    if value is None:
+        out += b"N"
+    elif value is True:
+        out += b"T"
+    elif value is False:
+        out += b"F"
+    elif isinstance(value, int):
+        out += b"i" + _INT.pack(value)
+    elif isinstance(value, float):
+        out += b"d" + _FLOAT.pack(value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out += b"s" + _LEN.pack(len(data)) + data
+    elif isinstance(value, (list, tuple)):
+        out += b"l" + _LEN.pack(len(value))
+        for item in value:
+            _encode(item, out)
+    elif isinstance(value, dict):
+        out += b"m" + _LEN.pack(len(value))
+        for key, item in value.items():
+            _encode(str(key), out)
+            _encode(item, out)
+    else:
+        raise TypeError(f"Cannot encode {type(value).__name__} for the model server")
+
+
+def encode(value) -> bytes:
+    out = bytearray()
+    _encode(value, out)
+    return bytes(out)
+
+
+def _decode(data: memoryview, offset: int):
+    tag = data[offset]
+    offset += 1
+    if tag == 0x4E:  # N
+        return None, offset
+    if tag == 0x54:  # T
+        return True, offset
+    if tag == 0x46:  # F
+        return False, offset
+    if tag == 0x69:  # i
+        return _INT.unpack_from(data, offset)[0], offset + _INT.size
+    if tag == 0x64:  # d
+        return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+    length = _LEN.unpack_from(data, offset)[0]
+    offset += _LEN.size
+    if tag == 0x73:  # s
+        return str(data[offset:offset + length], "utf-8"), offset + length
+    if tag == 0x6C:  # l
+        items = []
+        for _ in range(length):
+            item, offset = _decode(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == 0x6D:  # m
+        mapping = {}
+        for _ in range(length):
+            key, offset = _decode(data, offset)
+            mapping[key], offset = _decode(data, offset)
+        return mapping, offset
+    raise ValueError(f"Unknown tag {tag:#x} in model server message")
+
+
+def decode(data: bytes):
+    try:
+        value, offset = _decode(memoryview(data), 0)
+    except (struct.error, IndexError) as e:
+        raise ValueError(f"Truncated model server message: {e}") from e
+    if offset != len(data):
+        raise ValueError("Trailing bytes in model server message")
+    return value
+
+
+def _recv_exactly(sock, size: int) -> bytes:
+    chunks = bytearray()
+    while len(chunks) < size:
+        chunk = sock.recv(size - len(chunks))
+        if not chunk:
+            raise ConnectionError("Model server connection closed")
+        chunks += chunk
+    return bytes(chunks)
+
+
+def send_message(sock, code: int, value):
+    payload = encode(value)
+    sock.sendall(HEADER.pack(code, len(payload)) + payload)
+
+
+def recv_message(sock):
+    """(op or status, decoded payload) of the next message on `sock`"""
+    code, length = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    if length > MAX_MESSAGE_BYTES:
+        raise ValueError(f"Model server message of {length} bytes is over the limit")
+    return code, decode(_recv_exactly(sock, length))
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve a Dispatcher's model stages on a Unix domain socket
+
+    Connections are handled on their own threads, but model calls are
+    serialized so the models never compete with each other for CPU; each API
+    worker already micro-batches its prompts before sending them.
+    """
+    daemon_threads = True
+
+    def __init__(self, dispatcher: Dispatcher, path: str):
+        self.dispatcher = dispatcher
+        self.path = path
+        self._model_lock = threading.Lock()
+        self._stages = []
+        dispatcher.add_stage_listener(lambda stage, seconds, items: self._stages.append([stage, seconds, items]))
+        if os.path.exists(path):
+            os.unlink(path)  # stale socket from a previous run
+        super().__init__(path, _ModelRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def info(self) -> dict:
+        """What the workers' plan caches depend on besides their own settings"""
+        dispatcher = self.dispatcher
+        synonyms = dispatcher.condition_synonyms if dispatcher.gazetteer else None
+        return {
+            "pid": os.getpid(),
+            "fingerprint": vocabulary_fingerprint(dispatcher.ruler_patterns,
+                                                  extra=json.dumps([synonyms, dispatcher.artifact_hash],
+                                                                   sort_keys=True)),
+        }
+
+    def handle_op(self, op: int, request: dict):
+        """Run one request; returns {"result": ..., "stages": [[stage, seconds, items], ...]}"""
+        if op == OP_INFO:
+            return {"result": self.info(), "stages": []}
+        with self._model_lock:
+            self._stages = []
+            if op == OP_NER:
+                batch = self.dispatcher.apply_ner_batch(request["prompts"], batch_size=request.get("batch_size", 32))
+                result = [[[ent["text"], ent["label"], ent["start"], ent["end"]] for ent in entities]
+                          for entities in batch]
+            elif op == OP_CLASSIFY:
+                if request.get("joint", True):
+                    result = self.dispatcher._classify_joint(request["prompts"])
+                else:
+                    result = self.dispatcher._classify_separate(request["prompts"])
+            else:
+                raise ValueError(f"Unknown model server op {op}")
+            return {"result": result, "stages": self._stages}
+
+
+class _ModelRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                op, request = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            except ValueError as e:  # malformed or oversized frame, the stream can't be resynchronized
+                try:
+                    send_message(self.request, STATUS_ERROR, str(e))
+                except OSError:
+                    pass
+                return
+            try:
+                status, reply = STATUS_OK, self.server.handle_op(op, request)
+            except Exception as e:
+                status, reply = STATUS_ERROR, f"{type(e).__name__}: {e}"
+            try:
+                send_message(self.request, status, reply)
+            except OSError:  # the client timed out and closed the connection
+                return
+
+
+class ModelServerClient:
+    """Blocking client with one persistent connection, reconnecting once per call if it drops
+
+    `on_connect(info)` runs after every (re)connection, e.g. to pick up a
+    restarted server's pattern fingerprint.
+    """
+    def __init__(self, path: str, timeout: float = 60.0, startup_timeout: float = 60.0, on_connect=None):
+        self.path = path
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.on_connect = on_connect
+        self.info = None
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """Connect (waiting up to `startup_timeout` for the server to come up) and fetch its info"""
+        with self._lock:
+            self._connect(wait=self.startup_timeout)
+
+    def _connect(self, wait: float = 0):
+        deadline = time.monotonic() + wait
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+                break
+            except OSError as e:
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise ModelServerError(f"Model server at {self.path} is not reachable: {e}") from e
+                time.sleep(0.2)
+        self._sock = sock
+        self.info = self._roundtrip(OP_INFO, None)["result"]
+        if self.on_connect is not None:
+            self.on_connect(self.info)
+
+    def _roundtrip(self, op: int, request):
+        send_message(self._sock, op, request)
+        return self._receive()
+
+    def _receive(self):
+        status, reply = recv_message(self._sock)
+        if status != STATUS_OK:
+            raise ModelServerError(reply)
+        return reply
+
+    def call(self, op: int, request: dict) -> dict:
+        """Send one request, retrying once on a fresh connection if the socket broke before it was sent
+
+        Once the request is out, failures (including timeouts) are not retried:
+        the server may still be running it, and a retry would double the work.
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    send_message(self._sock, op, request)
+                    break
+                except (ConnectionError, OSError) as e:
+                    self.close_socket()
+                    if attempt:
+                        raise ModelServerError(f"Model server at {self.path} failed: {e}") from e
+            try:
+                return self._receive()
+            except (ConnectionError, OSError, ValueError) as e:
+                self.close_socket()
+                raise ModelServerError(f"Model server at {self.path} failed: {e}") from e
+
+    def close_socket(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def close(self):
+        with self._lock:
+            self.close_socket()
+
+
+class RemoteDispatcher(Dispatcher):
+    """Dispatcher whose NER and zero-shot classification run in a ModelServer
+
+    Accepts the Dispatcher options that don't concern the models (projection,
+    plan cache, terminology, cascade); stage timings reported by the server
+    are passed on to this dispatcher's stage listeners.
+    """
+    MODELS = ("model_server",)
+
+    def __init__(self, socket_path: str, timeout: float = 60.0, startup_timeout: float = 60.0, **kwargs):
+        self.model_fingerprint = None
+        self.client = ModelServerClient(socket_path, timeout, startup_timeout, on_connect=self._on_connect)
+        super().__init__(**kwargs)
+
+    def load_models(self, parallel: bool = False):
+        """Connect to the model server instead of loading the models"""
+        self._track_load("model_server", self.client.connect)
+
+    def _on_connect(self, info: dict):
+        self.model_fingerprint = info["fingerprint"]
+        self.refresh_plan_cache()
+
+    def refresh_plan_cache(self):
+        """Invalidate cached plans if the server's patterns or this worker's settings changed"""
+        if self.plan_cache is not None:
+            self.plan_cache.set_fingerprint(vocabulary_fingerprint(
+                self.ruler_patterns,
+                extra=json.dumps([self.projection, self.terminology_path, self.model_fingerprint], sort_keys=True),
+            ))
+
+    def add_entity_ruler_patterns(self, patterns: list):
+        raise NotImplementedError("Entity ruler patterns are loaded by the model server")
+
+    def _call(self, op: int, request: dict):
+        reply = self.client.call(op, request)
+        for stage, seconds, items in reply["stages"]:
+            for listener in self.stage_listeners:
+                listener(stage, seconds, items)
+        return reply["result"]
+
+    def apply_ner_batch(self, prompts: list, batch_size: int = 32, n_process: int = 1):
+        """Extract entities on the model server (`n_process` is up to the server)"""
+        batch = self._call(OP_NER, {"prompts": list(prompts), "batch_size": batch_size})
+        return [[{"text": text, "label": label, "start": start, "end": end} for text, label, start, end in entities]
+                for entities in batch]
+
+    def _classify_joint(self, prompts: list):
+        return [tuple(labels) for labels in self._call(OP_CLASSIFY, {"prompts": list(prompts), "joint": True})]
+
+    def _classify_separate(self, prompts: list):
+        return [tuple(labels) for labels in self._call(OP_CLASSIFY, {"prompts": list(prompts), "joint": False})]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the NLP models to API workers over a Unix socket")
+    parser.add_argument("--socket", default="/tmp/fhir-nl-models.sock", help="Unix socket path to listen on")
+    parser.add_argument("--spacy-model", default="en_core_web_sm")
+    parser.add_argument("--spacy-profile", choices=("full", "slim"), default="slim")
+    parser.add_argument("--spacy-cache-dir", default=".cache/spacy")
+    parser.add_argument("--artifact-dir", default=None, help="load everything from a prebuilt artifact bundle")
+    args = parser.parse_args()
+
+    dispatcher = Dispatcher(plan_cache_size=0, spacy_model=args.spacy_model, spacy_profile=args.spacy_profile,
+                            spacy_cache_dir=args.spacy_cache_dir, artifact_dir=args.artifact_dir)
+    dispatcher.warm_up()
+    server = ModelServer(dispatcher, args.socket)
+    print(f"Model server listening on {args.socket} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
 from nlp_query.base_prompt import FHIRBasePrompt
 import re
 from datetime import datetime
-from nlp_query.patterns.disease_codes import DISEASE_CODE
-from difflib import get_close_matches
+from nlp_query.terminology import get_default_index
+from nlp_query.entity_index import EntityIndex
 
 class PatientPrompt(FHIRBasePrompt):
     CUTOFF=0.6
+    DATE_LABELS = ("DATE", "ON_YEAR", "YEAR_RANGE", "YEAR_AFTER", "YEAR_BEFORE")
+    AGE_LABELS = ("AGE_OVER", "AGE_UNDER", "AGE_EXACT", "AGE")
     """
     ### Patients
 
@@ -14,11 +16,20 @@ class PatientPrompt(FHIRBasePrompt):
     - **Contact** (phone, email, address parts)
     - **Relations** (organization, GP, linked patient)
 
+    Context lookups ("the next PERSON after this trigger") go through an
+    EntityIndex instead of a full entity scan per trigger, so multi-kilobyte
+    notes with hundreds of entities stay in the low milliseconds.
+
+    Several conditions ("with diabetes and hypertension") are all kept. They
+    are intersected unless an "or" sits between them. The search then carries a
+    `fan_out` plan, one subjects-only Condition search per condition plus the
+    Patient search for the matches (see app/fan_out.py).
+
         Returns:
             _type_: _description_
     """
-    def __init__(self, request_type):
-        super().__init__(request_type)
+    def __init__(self, request_type, projection=None):
+        super().__init__(request_type, projection)
         # This is for documentation purposes only
         self.field_map = {
             "identifier": "PID-3",
@@ -56,6 +67,9 @@ class PatientPrompt(FHIRBasePrompt):
         self.data = {}
         self.filled_fields = set()
         self.skipped_fields = set(self.field_map.keys())
+        self.conditions = [] # every condition in the prompt, data["condition"] keeps the first
+        self.condition_entities = []
+        self.entity_index = None
         
     def fill_from_entities(self, entities):
         """Extract and map entities to FHIR fields
@@ -66,6 +80,7 @@ class PatientPrompt(FHIRBasePrompt):
         - Contact (phone, email, address parts)
         - Relations (organization, GP, linked patient)
         """
+        self.entity_index = EntityIndex(entities)
         for entity in entities:
             entity_label = entity.get("label", "").upper()
             entity_text = entity.get("text", "").strip()
@@ -86,6 +101,9 @@ class PatientPrompt(FHIRBasePrompt):
                 normalized_value, normalized_field = self._normalize_field_value(
                     entity_label, entity, entities # pass full entities for context because context is needed
                 )
+                if normalized_field == "condition":
+                    self.conditions.append(normalized_value)
+                    self.condition_entities.append(entity)
                 if normalized_field and normalized_field not in self.filled_fields:
                     self._set_field(normalized_field, normalized_value)
         self._check_name_in_context(entities) # check if a PERSON entity is in context after the trigger
@@ -100,27 +118,25 @@ class PatientPrompt(FHIRBasePrompt):
     def _check_name_in_context(self, entities):
         """Check if a PERSON entity is in context after the trigger"""
         if not any(data for data in self.data if data in ["given", "family", "general-practitioner"]):
-            for ent in entities:
-                if ent['label'] == 'PERSON':
-                    self._set_field('name', ent['text'])
-                    break
+            ent = self._index(entities).first('PERSON')
+            if ent:
+                self._set_field('name', ent['text'])
 
     def _check_age_in_context(self, entities):
         """Check if an AGE entity is in context after the trigger"""
         if not any(data for data in self.data if data in ["birthdate", "deceased-date"]):
-            for ent in entities:
-                if ent['label'] in {"AGE_OVER", "AGE_UNDER", "AGE_EXACT", "AGE"}:
-                    age_value = self._normalize_age(ent)
-                    if age_value:
-                        self._set_field('birthdate', age_value)
-                    break
+            ent = self._index(entities).first(self.AGE_LABELS)
+            if ent:
+                age_value = self._normalize_age(ent)
+                if age_value:
+                    self._set_field('birthdate', age_value)
 
     def _normalize_field_value(self, entity_label, entity, full_entities):
         """Normalize values according to FHIR specifications"""
         normalizers = {
             "GP_TRIGGER": self._normalize_gp,
             "GIVEN_NAME_TRIGGER": self._normalize_name, 
-            "FAMILY_TRIGGER": self._normalize_name,
+            "FAMILY_NAME_TRIGGER": self._normalize_name,
             "NAME_GENERAL": self._normalize_name,
             "DEATH_KEYWORD": self._normalize_death_birth,
             "BIRTH_KEYWORD": self._normalize_death_birth,
@@ -131,33 +147,33 @@ class PatientPrompt(FHIRBasePrompt):
             "LABEL_2": self._normalize_condition
         }
         normalizer = normalizers.get(entity_label, lambda x, e=None: x)
-        return normalizer(field_name=entity_label, entity=entity, full_entities=full_entities) # Normalizers should return (value, field) tuple
+        return normalizer(field_name=entity_label, entity=entity, full_entities=full_entities,
+                          index=self._index(full_entities)) # Normalizers should return (value, field) tuple
+
+    def _index(self, entities):
+        """EntityIndex over `entities`, reusing the one built by fill_from_entities"""
+        if self.entity_index is None or self.entity_index.entities is not entities:
+            self.entity_index = EntityIndex(entities)
+        return self.entity_index
+
     def _normalize_gp(self, **kwargs):
         """Extract GP name from context"""
         value = kwargs['entity']
-        entities= kwargs['full_entities']
-        gp_name = None
-        for ent in entities:
-            if ent['label'] == 'PERSON' and ent['start'] > value['end']:
-                gp_name = ent['text']
-                break
+        ent = kwargs['index'].next_after('PERSON', value['end'])
+        gp_name = ent['text'] if ent else None
         return gp_name, "general-practitioner" if gp_name else (None, None)
     
     def _normalize_name(self, **kwargs):
         """Extract full name from context"""
         field_name = kwargs['field_name']
         value = kwargs['entity']
-        entities= kwargs['full_entities']
-        full_name = None
+        ent = kwargs['index'].next_after('PERSON', value['end'], inclusive=True)
+        full_name = ent['text'] if ent else None
         value_label = {
             "GIVEN_NAME_TRIGGER": "given",
             "FAMILY_NAME_TRIGGER": "family",
             "NAME_GENERAL": "name",
         }
-        for ent in entities:
-            if ent['label'] == 'PERSON' and ent['start'] >= value['end']:
-                full_name = ent['text']
-                break
         return full_name, value_label[field_name] if full_name else (None, None)
     
     def _normalize_gender(self, **kwargs):
@@ -176,21 +192,16 @@ class PatientPrompt(FHIRBasePrompt):
         # Look for DATE or ON_YEAR entities after the death keyword
         field_name = kwargs['field_name']
         value = kwargs['entity']
-        entities= kwargs['full_entities']
         field = {
             "BIRTH_KEYWORD": "birthdate",
             "DEATH_KEYWORD": "deceased-date",
         }
-        date_labels = {"DATE", "ON_YEAR", "YEAR_RANGE", "YEAR_AFTER", "YEAR_BEFORE"}
-        age_labels = {"AGE_OVER", "AGE_UNDER", "AGE_EXACT", "AGE"}
         date = None
-        for ent in entities:
-            if ent['label'] in date_labels and ent['start'] > value['end']:
-                date = self._normalize_date(ent)
-                break
-            if ent['label'] in age_labels and ent['start'] > value['end']:
-                date = self._normalize_age(ent)
-                break
+        ent = kwargs['index'].next_after(self.DATE_LABELS + self.AGE_LABELS, value['end'])
+        if ent and ent['label'] in self.DATE_LABELS:
+            date = self._normalize_date(ent)
+        elif ent:
+            date = self._normalize_age(ent)
         return date, field[field_name] if date else (None, None)
     
     def _normalize_date(self, entity=None):
@@ -258,18 +269,16 @@ class PatientPrompt(FHIRBasePrompt):
     def _normalize_condition(self, **kwargs):
         """Extract condition name from entity"""
         entity = kwargs['entity']
-        entities = kwargs['full_entities']
+        index = kwargs['index']
         disease = entity.get("text", None)
         entity_label = entity.get('label', None) # This could be either LABEL_1 or LABEL_2
         if entity_label == "LABEL_1": # if "LABEL_2" was checked first, it won't be followed by another "LABEL_2"
-            for ent in entities:
-                if ent['label'] == 'LABEL_2' and ent['start'] == entity['end'] + 1:
-                    disease += " " + ent['text']
-                    break
+            ent = index.starting_at('LABEL_2', entity['end'] + 1)
+            if ent:
+                disease += " " + ent['text']
         elif entity_label == "LABEL_2":
-            for ent in entities:
-                if ent['label'] == 'LABEL_1' and ent['end'] == entity['start'] - 1:
-                    return None, None # skip this one because it was already handled
+            if index.ending_at('LABEL_1', entity['start'] - 1):
+                return None, None # skip this one because it was already handled
         return disease, "condition" if disease else (None, None)
 
             
@@ -298,9 +307,20 @@ class PatientPrompt(FHIRBasePrompt):
         return birth_date
     def _get_disease_code(self, disease):
         """Classify disease text and return SNOMED code"""
-        disease_names = list(DISEASE_CODE.keys())
-        matches = get_close_matches(disease.lower(), disease_names, n=1, cutoff=self.CUTOFF)
-        return DISEASE_CODE[matches[0]] if matches else 0
+        matches = get_default_index().lookup(disease, k=1, cutoff=self.CUTOFF)
+        return matches[0][1] if matches else 0
+
+    def condition_codes(self) -> list:
+        """Codes of every condition in the prompt, without duplicates"""
+        return list(dict.fromkeys(self._get_disease_code(condition) for condition in self.conditions))
+
+    def condition_operator(self) -> str:
+        """'or' when a CONDITION_OR entity sits between the first and the last condition, else 'and'"""
+        if len(self.condition_entities) < 2:
+            return "and"
+        starts = [entity['start'] for entity in self.condition_entities]
+        ent = self.entity_index.next_after("CONDITION_OR", min(starts))
+        return "or" if ent and ent['start'] < max(starts) else "and"
 
     def process(self, entities: list, base_url: str = "[base]") -> dict:
         """Generate FHIR API request based on request_type"""
@@ -318,20 +338,35 @@ class PatientPrompt(FHIRBasePrompt):
         else:
             return {"error": f"Unsupported request type: {self.request_type}"}
 
+    def _projection_params(self) -> list:
+        """Search parameters that trim the returned resources to what is actually read
+
+        `projection["elements"]` lists the Patient elements the consumer reads.
+        Servers without `_elements` support can use `_summary=data` instead.
+        """
+        mode = self.projection.get("mode")
+        if mode == "elements":
+            elements = self.projection.get("elements", [])
+            return [f"_elements={','.join(elements)}"] if elements else []
+        if mode == "summary":
+            return ["_summary=data"]
+        return []
+
     def _generate_get_request(self, base_url: str = "[base]") -> dict:
         """Generate GET request for FHIR Patient search"""
         
         if not self.data:
+            query_string = "&".join(self._projection_params())
             return {
                 "method": "GET",
-                "url": f"{base_url}/Patient",
+                "url": f"{base_url}/Patient?{query_string}" if query_string else f"{base_url}/Patient",
                 "parameters": {},
-                "query_string": ""
+                "query_string": query_string
             }
         
         # Build query parameters from processed data
         query_params = []
-        condition = self.data.pop("condition", None) # extract condition if exists
+        self.data.pop("condition", None) # conditions are added separately from self.conditions
         for field, value in self.data.items():
             if value is not None:
                 # Handle boolean values (like deceased)
@@ -341,21 +376,51 @@ class PatientPrompt(FHIRBasePrompt):
                     # URL encode the value if needed (basic implementation)
                     encoded_value = str(value).replace(" ", "%20")
                     query_params.append(f"{field}={encoded_value}")
-        if condition: # conditions needs to be extracted separately also they're assumed to be only one condition for now
+        # Projection only shapes the response, so it stays out of "parameters"
+        patient_params = query_params + self._projection_params()
+        codes = self.condition_codes()
+        operator = self.condition_operator()
+        if len(codes) == 1:
             # Add reverse include for Condition resource
-            code = self._get_disease_code(condition)
-            query_params.append(f'_has:Condition:patient:code={code}')
-            self.data['_has:Condition:patient:code'] = code # add it back to data for reference
+            query_params.append(f'_has:Condition:patient:code={codes[0]}')
+            self.data['_has:Condition:patient:code'] = codes[0] # add it back to data for reference
+        elif codes and operator == "or": # a comma is OR within one parameter
+            query_params.append(f'_has:Condition:patient:code={",".join(map(str, codes))}')
+            self.data['_has:Condition:patient:code'] = ",".join(map(str, codes))
+        elif codes: # repeated parameters are ANDed
+            query_params.extend(f'_has:Condition:patient:code={code}' for code in codes)
+            # parameters stay a string (every patient's "condition" is copied from it), fan_out has the operator
+            self.data['_has:Condition:patient:code'] = ",".join(map(str, codes))
+        query_params.extend(self._projection_params())
 
         # Join parameters with &
         query_string = "&".join(query_params)
         full_url = f"{base_url}/Patient?{query_string}" if query_string else f"{base_url}/Patient"
-        return {
+        request = {
             "method": "GET",
             "url": full_url,
             "parameters": dict(self.data),
             "query_string": query_string
         }
+        if len(codes) > 1:
+            # the chained search above is correct but slow on HAPI, app/fan_out.py runs this plan instead
+            subject_params = self._condition_projection_params()
+            patient_query = "&".join(patient_params)
+            request["fan_out"] = {
+                "operator": operator,
+                "searches": [f"{base_url}/Condition?{'&'.join([f'code={code}'] + subject_params)}" for code in codes],
+                "patients": f"{base_url}/Patient?{patient_query}" if patient_query else f"{base_url}/Patient",
+            }
+        return request
+
+    def _condition_projection_params(self) -> list:
+        """Trim the per-condition searches of a fan-out plan to the subject reference"""
+        mode = self.projection.get("mode")
+        if mode == "elements":
+            return ["_elements=subject"]
+        if mode == "summary":
+            return ["_summary=data"]
+        return []
 
     def _generate_post_request(self, base_url: str = "[base]") -> dict:
         """Generate POST request for creating Patient"""
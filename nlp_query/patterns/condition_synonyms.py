@@ -0,0 +1,53 @@
+"""
+Everyday phrasings of the conditions in DISEASE_CODE, mapped to the DISEASE_CODE term they mean.
+Used by the condition gazetteer (nlp_query/gazetteer.py) next to the DISEASE_CODE terms themselves.
+A gazetteer hit skips the disease NER for the whole prompt, so bare words with an everyday
+meaning ("flu", "tb", "depressed") only appear inside phrases that pin down the condition.
+"""
+CONDITION_SYNONYMS = {
+    # diabetes
+    "diabetes": "diabetes mellitus",
+    "diabetic": "diabetes mellitus",
+    "diabetics": "diabetes mellitus",
+    "type 2 diabetes": "diabetes mellitus",
+    "type 1 diabetes": "diabetes mellitus",
+    # cardiovascular
+    "hypertensive": "hypertension",
+    "high blood pressure": "hypertension",
+    "heart attack": "myocardial infarction",
+    "coronary heart disease": "coronary artery disease",
+    "ischemic stroke": "stroke ischemic",
+    "hemorrhagic stroke": "stroke hemorrhagic",
+    # respiratory
+    "asthmatic": "asthma",
+    "copd": "chronic obstructive pulmonary disease",
+    "pulmonary tb": "tuberculosis",
+    "tb infection": "tuberculosis",
+    "the flu": "influenza",
+    "seasonal flu": "influenza",
+    "flu infection": "influenza",
+    "covid": "covid-19",
+    "hay fever": "allergic rhinitis",
+    "ear infection": "otitis media",
+    # neurological and mental health
+    "epileptic": "epilepsy",
+    "parkinson's": "parkinson's disease",
+    "parkinsons": "parkinson's disease",
+    "alzheimer's": "alzheimer's disease",
+    "alzheimers": "alzheimer's disease",
+    "clinically depressed": "depression",
+    "major depression": "depression",
+    "anxiety": "anxiety disorder",
+    "bipolar": "bipolar disorder",
+    "schizophrenic": "schizophrenia",
+    # other
+    "hiv": "hiv infection",
+    "ckd": "chronic kidney disease",
+    "kidney failure": "renal failure",
+    "gerd": "gastroesophageal reflux disease",
+    "acid reflux": "gastroesophageal reflux disease",
+    "stomach ulcer": "peptic ulcer",
+    "lupus": "lupus erythematosus",
+    "anemic": "anemia",
+    "obese": "obesity",
+}
@@ -204,4 +204,8 @@ PATIENT_PATTERNS.extend([
  ])
 
 # Organizations already idenified by built-in spacy ORG entity
-# Linked patients are not handled in this version.
\ No newline at end of file
+# Linked patients are not handled in this version.
+# Conjunctions between conditions: "with asthma or copd" is a union, conditions are intersected otherwise
+PATIENT_PATTERNS.extend([
+    {"label": "CONDITION_OR", "pattern": [{"LOWER": "or"}]},
+])
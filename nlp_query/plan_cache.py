@@ -0,0 +1,100 @@
+"""LRU cache from normalized NL prompts to compiled FHIR request plans"""
+import copy
+import hashlib
+import json
+import re
+import threading
+from collections import Counter, OrderedDict
+from datetime import date
+
+from nlp_query.patterns.disease_codes import DISEASE_CODE
+
+_WHITESPACE = re.compile(r"\s+")
+_SPACE_BEFORE_PUNCT = re.compile(r"\s+([,;:.!?])")
+_TRAILING_PUNCT = re.compile(r"[\s.!?,;:]+$")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize a prompt so trivially different phrasings share a cache key
+
+    Collapses whitespace, drops trailing sentence punctuation and spaces before
+    punctuation, and lower-cases the first word. Capitalization elsewhere is
+    kept on purpose: spaCy's PERSON/ORG detection and the IDENTIFIER pattern
+    depend on it, so "john smith" and "John Smith" may compile differently.
+    """
+    text = _WHITESPACE.sub(" ", prompt).strip()
+    text = _SPACE_BEFORE_PUNCT.sub(r"\1", text)
+    text = _TRAILING_PUNCT.sub("", text)
+    first, _, rest = text.partition(" ")
+    return f"{first.lower()} {rest}" if rest else first.lower()
+
+
+def vocabulary_fingerprint(patterns: list, disease_codes: dict = None, extra: str = "") -> str:
+    """Hash of everything a compiled plan depends on besides the prompt and the models"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(patterns, sort_keys=True, default=str).encode("utf-8"))
+    digest.update(json.dumps(DISEASE_CODE if disease_codes is None else disease_codes,
+                             sort_keys=True).encode("utf-8"))
+    digest.update(extra.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class PlanCache:
+    """Bounded, thread-safe LRU of dispatch payloads
+
+    Keys join the year, the base URL and the normalized prompt, NUL-separated.
+    The vocabulary fingerprint is not part of the key: `set_fingerprint` with a
+    new value (new ruler patterns, new disease codes) drops every entry instead.
+    Ages compile to birthdate bounds relative to the current year, so the year is
+    in the key and the first lookup of a new year drops every entry as well.
+    Payloads are deep-copied in and out so callers can't mutate the cache.
+    """
+    def __init__(self, max_size: int = 1024, fingerprint: str = ""):
+        self.max_size = max_size
+        self.fingerprint = fingerprint
+        self.entries = OrderedDict()
+        self.stats = Counter({"hits": 0, "misses": 0})
+        self.year = date.today().year
+        self._lock = threading.Lock()
+
+    def key(self, prompt: str, base_url: str) -> str:
+        year = date.today().year
+        if year != self.year:
+            with self._lock:
+                if year != self.year:
+                    self.year = year
+                    self.entries.clear()
+        return f"{year}\x00{base_url}\x00{normalize_prompt(prompt)}"
+
+    def get(self, key: str):
+        with self._lock:
+            payload = self.entries.get(key)
+            if payload is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+        return copy.deepcopy(payload)
+
+    def put(self, key: str, payload: dict):
+        payload = copy.deepcopy(payload)
+        with self._lock:
+            self.entries[key] = payload
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def set_fingerprint(self, fingerprint: str):
+        """Switch to a new vocabulary fingerprint, invalidating stale plans"""
+        with self._lock:
+            if fingerprint != self.fingerprint:
+                self.fingerprint = fingerprint
+                self.entries.clear()
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats_dict(self) -> dict:
+        with self._lock:
+            return {**self.stats, "size": len(self.entries), "fingerprint": self.fingerprint}
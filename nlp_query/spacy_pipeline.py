@@ -0,0 +1,225 @@
+"""spaCy pipeline profiles and a precompiled, pre-filtered EntityRuler
+
+The Dispatcher only reads `doc.ents`, so the "slim" profile keeps `ner`, the
+components it listens to and the EntityRuler, and drops the tagger, parser,
+attribute_ruler, lemmatizer and the shared tok2vec that feeds them.
+
+`GatedEntityRuler` is a drop-in EntityRuler for patterns built around token
+regexes (phone, email, identifier, year, age and GP patterns). spaCy evaluates
+every REGEX predicate against every token, so each such pattern gets a cheap
+document-level pre-filter: its regex searched once over the whole text (or a
+digit check for IS_DIGIT tokens). Docs are matched with a Matcher holding only
+the plain patterns and those whose pre-filter passed, cached per combination.
+Matches are filtered exactly like EntityRuler does, so the entities are identical.
+
+Built pipelines are saved with `nlp.to_disk` under a directory named after the
+model, the profile and a hash of the patterns, so later startups only load it:
+
+    python -m nlp_query.spacy_pipeline build --profile slim --cache-dir .cache/spacy
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import warnings
+
+import spacy
+from spacy.language import Language
+from spacy.matcher import Matcher
+from spacy.pipeline import EntityRuler
+
+from nlp_query.patterns.patients_patterns import PATIENT_PATTERNS
+
+PROFILES = ("full", "slim")
+# components apply_ner needs; anything they listen to (e.g. a shared tok2vec) is kept too
+SLIM_KEEP = ("ner", "entity_ruler")
+# zero-width assertions that could make a token regex match the token but not the whole text
+_CONTEXT_ASSERTIONS = re.compile(r"\\[bBAZ]|\(\?[=!<]|(?<!\\)[\^$]")
+_ASCII_DIGIT = re.compile(r"[0-9]")
+
+
+def _document_regex(regex: str):
+    """Regex that must match somewhere in the doc text when `regex` matches a token, or None"""
+    if regex.startswith("^"):
+        regex = regex[1:]
+    if regex.endswith("$") and not regex.endswith("\\$"):
+        regex = regex[:-1]
+    if _CONTEXT_ASSERTIONS.search(regex):
+        return None
+    return regex
+
+
+def _has_digit(text: str) -> bool:
+    """Same test as spaCy's IS_DIGIT (str.isdigit) applied to any character of `text`"""
+    if text.isascii():
+        return _ASCII_DIGIT.search(text) is not None
+    return any(ch.isdigit() for ch in text)
+
+
+def pattern_gate(pattern: list):
+    """("text" | "lower" | "digit", regex) a doc must satisfy for the token pattern to match, or None"""
+    for token in pattern:
+        if not isinstance(token, dict) or token.get("OP", "1") in ("?", "*", "!", "{0}"):
+            continue
+        for attr, case in (("TEXT", "text"), ("ORTH", "text"), ("LOWER", "lower")):
+            spec = token.get(attr)
+            if isinstance(spec, dict) and isinstance(spec.get("REGEX"), str):
+                regex = _document_regex(spec["REGEX"])
+                if regex is not None:
+                    return case, regex
+        if token.get("IS_DIGIT") is True:
+            return "digit", None
+    return None
+
+
+@Language.factory(
+    "gated_entity_ruler",
+    assigns=["doc.ents", "token.ent_type", "token.ent_iob"],
+    default_config={"overwrite_ents": False, "validate": False},
+)
+def make_gated_entity_ruler(nlp: Language, name: str, overwrite_ents: bool, validate: bool):
+    return GatedEntityRuler(nlp, name, overwrite_ents=overwrite_ents, validate=validate)
+
+
+class GatedEntityRuler(EntityRuler):
+    """EntityRuler that leaves out regex-heavy patterns on docs that can't match them"""
+    MAX_MATCHERS = 64
+
+    def __init__(self, nlp: Language, name: str = "entity_ruler", **kwargs):
+        self._pattern_gates = []  # (key, pattern, gate or None) for every token pattern
+        self._gate_regexes = {}
+        self._gates = set()
+        self._matchers = {}  # frozenset of open gates -> Matcher with the plain + open-gate patterns
+        super().__init__(nlp, name, **kwargs)
+
+    def _refresh_gates(self):
+        self._matchers = {}
+        self._pattern_gates = [(key, pattern, pattern_gate(pattern))
+                               for key, patterns in self.token_patterns.items() for pattern in patterns]
+        self._gate_regexes = {gate: re.compile(gate[1]) for _, _, gate in self._pattern_gates
+                              if gate is not None and gate[1] is not None}
+        self._gates = {gate for _, _, gate in self._pattern_gates if gate is not None}
+
+    def add_patterns(self, patterns: list):
+        super().add_patterns(patterns)
+        self._refresh_gates()
+
+    def remove(self, ent_id: str):
+        super().remove(ent_id)
+        self._refresh_gates()
+
+    def clear(self):
+        super().clear()
+        self._refresh_gates()
+
+    def gate_open(self, gate: tuple, text: str, lower: str) -> bool:
+        """Whether the patterns behind `gate` could match a doc with this text"""
+        case, _ = gate
+        if case == "digit":
+            return _has_digit(text)
+        return self._gate_regexes[gate].search(lower if case == "lower" else text) is not None
+
+    def _matcher_for(self, open_gates: frozenset) -> Matcher:
+        matcher = self._matchers.get(open_gates)
+        if matcher is None:
+            if len(self._matchers) >= self.MAX_MATCHERS:
+                self._matchers.clear()
+            matcher = Matcher(self.nlp.vocab, validate=self._validate,
+                              fuzzy_compare=self.matcher_fuzzy_compare)
+            for key, pattern, gate in self._pattern_gates:
+                if gate is None or gate in open_gates:
+                    matcher.add(key, [pattern])
+            self._matchers[open_gates] = matcher
+        return matcher
+
+    def match(self, doc):
+        self._require_patterns()
+        text = doc.text
+        lower = text.lower()
+        matcher = self._matcher_for(frozenset(gate for gate in self._gates if self.gate_open(gate, text, lower)))
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="\\[W036")
+            matches = list(matcher(doc)) + list(self.phrase_matcher(doc))
+        # same de-duplication and ordering as EntityRuler.match
+        final_matches = set((m_id, start, end) for m_id, start, end in matches if start != end)
+        return sorted(final_matches, key=lambda m: (m[2] - m[1], -m[1]), reverse=True)
+
+
+def add_ruler(nlp: Language, patterns: list, gated: bool = True):
+    """Add (or extend) the "entity_ruler" component, before "ner" when there is one"""
+    if "entity_ruler" in nlp.pipe_names:
+        ruler = nlp.get_pipe("entity_ruler")
+    else:
+        placement = {"before": "ner"} if "ner" in nlp.pipe_names else {}
+        factory = "gated_entity_ruler" if gated else "entity_ruler"
+        ruler = nlp.add_pipe(factory, name="entity_ruler", **placement)
+    ruler.add_patterns(patterns)
+    return ruler
+
+
+def slim(nlp: Language, keep=SLIM_KEEP) -> Language:
+    """Remove every component that neither sets entities nor feeds one that does"""
+    needed = set(keep)
+    for name, component in nlp.pipeline:
+        if set(getattr(component, "listening_components", [])) & set(keep):
+            needed.add(name)
+    for name in list(nlp.component_names):
+        if name not in needed:
+            nlp.remove_pipe(name)
+    return nlp
+
+
+def build_pipeline(model: str = "en_core_web_sm", profile: str = "slim", patterns: list = None) -> Language:
+    """Load `model`, apply the profile and add the patient EntityRuler"""
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown spaCy profile {profile!r}, expected one of {PROFILES}")
+    nlp = spacy.load(model)
+    if profile == "slim":
+        slim(nlp)
+    add_ruler(nlp, PATIENT_PATTERNS if patterns is None else patterns, gated=profile == "slim")
+    return nlp
+
+
+def pipeline_fingerprint(model: str, profile: str, patterns: list) -> str:
+    digest = hashlib.sha256()
+    digest.update(json.dumps([model, profile, spacy.__version__], sort_keys=True).encode("utf-8"))
+    digest.update(json.dumps(patterns, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def load_pipeline(model: str = "en_core_web_sm", profile: str = "slim", patterns: list = None,
+                  cache_dir: str = None) -> Language:
+    """Load the serialized pipeline for these settings, building and saving it on first use"""
+    patterns = PATIENT_PATTERNS if patterns is None else patterns
+    if not cache_dir:
+        return build_pipeline(model, profile, patterns)
+    path = os.path.join(cache_dir, f"{model}-{profile}-{pipeline_fingerprint(model, profile, patterns)}")
+    if os.path.isdir(path):
+        return spacy.load(path)
+    nlp = build_pipeline(model, profile, patterns)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    nlp.to_disk(tmp_path)
+    try:
+        os.replace(tmp_path, path)  # atomic, so concurrent workers never load a half-written pipeline
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)  # another worker got there first
+    return nlp
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompile the spaCy pipeline with the patient EntityRuler")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build and serialize the pipeline")
+    build.add_argument("--model", default="en_core_web_sm")
+    build.add_argument("--profile", choices=PROFILES, default="slim")
+    build.add_argument("--cache-dir", default=".cache/spacy")
+    args = parser.parse_args()
+
+    nlp = load_pipeline(args.model, args.profile, cache_dir=args.cache_dir)
+    print(f"Pipeline {nlp.pipe_names} ready in {args.cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Fuzzy terminology lookup over a character trigram inverted index
+
+Vocabularies (e.g. SNOMED CT or ICD-10 descriptions and their synonyms) are
+loaded from a local file, indexed once, and saved as flat NumPy arrays that
+`TerminologyIndex.load` memory-maps, so every process shares the same pages.
+
+Lookup gathers candidates that share trigrams with the query, ranks them by
+Dice overlap, and rescores the best few with the same `SequenceMatcher` ratio
+that `difflib.get_close_matches` uses, so cutoffs keep their meaning. Ties
+are broken the way difflib breaks them, and when no candidate is close
+enough, small vocabularies (such as the built-in DISEASE_CODE) are scanned
+in full, so for them the result is the one `get_close_matches` returns. On
+large vocabularies a term ranked outside the candidate pool, or a miss that
+would need a scan over more than `max_scan` terms, can still differ from it.
+
+    python -m nlp_query.terminology build vocabulary.tsv index_dir/
+    python -m nlp_query.terminology lookup index_dir/ "diabetic"
+"""
+import argparse
+import csv
+import json
+import os
+import threading
+import zlib
+from difflib import SequenceMatcher
+
+import numpy as np
+
+from nlp_query.patterns.disease_codes import DISEASE_CODE
+
+INDEX_FORMAT_VERSION = 1
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _gram_key(gram: str) -> int:
+    return zlib.crc32(gram.encode("utf-8"))
+
+
+def _pack_strings(strings: list):
+    """Concatenate strings into one UTF-8 blob plus an offsets array"""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def load_vocabulary(path: str) -> list:
+    """Read (term, code) pairs from a local vocabulary file
+
+    Supported formats: `.json` (a {term: code} object or a list of
+    {"term", "code"} objects), `.csv` and `.tsv`/`.txt` with `code, term`
+    columns. Several terms (synonyms) may share one code.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, encoding="utf-8") as f:
+        if ext == ".json":
+            data = json.load(f)
+            if isinstance(data, dict):
+                return [(term, str(code)) for term, code in data.items()]
+            return [(row["term"], str(row["code"])) for row in data]
+        reader = csv.reader(f, delimiter="," if ext == ".csv" else "\t")
+        return [(row[1], row[0]) for row in reader if len(row) >= 2 and not row[0].startswith("#")]
+
+
+class TerminologyIndex:
+    """Trigram inverted index over vocabulary terms, stored as flat arrays"""
+    def __init__(self, arrays: dict):
+        self.gram_keys = arrays["gram_keys"]        # sorted uint32 trigram hashes
+        self.gram_offsets = arrays["gram_offsets"]  # postings slice of each key
+        self.postings = arrays["postings"]          # term ids, grouped by trigram
+        self.gram_counts = arrays["gram_counts"]    # distinct trigrams per term
+        self.term_blob = arrays["term_blob"]
+        self.term_offsets = arrays["term_offsets"]
+        self.code_blob = arrays["code_blob"]
+        self.code_offsets = arrays["code_offsets"]
+        self._term_lengths = None  # computed on the first full scan
+
+    def __len__(self):
+        return len(self.gram_counts)
+
+    @classmethod
+    def build(cls, vocabulary: list) -> "TerminologyIndex":
+        """Index (term, code) pairs; terms are matched case-insensitively"""
+        terms = [term.lower().strip() for term, _ in vocabulary]
+        codes = [str(code) for _, code in vocabulary]
+        grams_per_term = [_trigrams(term) for term in terms]
+
+        postings_by_key = {}
+        for term_id, grams in enumerate(grams_per_term):
+            for gram in grams:
+                postings_by_key.setdefault(_gram_key(gram), []).append(term_id)
+        keys = sorted(postings_by_key)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum([len(postings_by_key[key]) for key in keys], out=offsets[1:])
+        postings = np.fromiter((term_id for key in keys for term_id in postings_by_key[key]),
+                               dtype=np.int32, count=int(offsets[-1]))
+
+        term_blob, term_offsets = _pack_strings(terms)
+        code_blob, code_offsets = _pack_strings(codes)
+        return cls({
+            "gram_keys": np.array(keys, dtype=np.uint32),
+            "gram_offsets": offsets,
+            "postings": postings,
+            "gram_counts": np.array([len(g) for g in grams_per_term], dtype=np.int32),
+            "term_blob": term_blob,
+            "term_offsets": term_offsets,
+            "code_blob": code_blob,
+            "code_offsets": code_offsets,
+        })
+
+    @classmethod
+    def from_vocabulary_file(cls, path: str) -> "TerminologyIndex":
+        return cls.build(load_vocabulary(path))
+
+    def save(self, directory: str):
+        """Write every array as a .npy file that `load` can memory-map"""
+        os.makedirs(directory, exist_ok=True)
+        for name in ("gram_keys", "gram_offsets", "postings", "gram_counts",
+                     "term_blob", "term_offsets", "code_blob", "code_offsets"):
+            np.save(os.path.join(directory, f"{name}.npy"), np.asarray(getattr(self, name)))
+        with open(os.path.join(directory, "index.json"), "w") as f:
+            json.dump({"format": INDEX_FORMAT_VERSION, "terms": len(self)}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "TerminologyIndex":
+        with open(os.path.join(directory, "index.json")) as f:
+            meta = json.load(f)
+        if meta.get("format") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported terminology index format in {directory}")
+        mode = "r" if mmap else None
+        arrays = {}
+        for name in ("gram_keys", "gram_offsets", "postings", "gram_counts",
+                     "term_blob", "term_offsets", "code_blob", "code_offsets"):
+            array = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode)
+            # plain ndarray view over the same mapping, skips np.memmap's per-slice overhead
+            arrays[name] = array.view(np.ndarray) if mmap else array
+        return cls(arrays)
+
+    def term(self, term_id: int) -> str:
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        return bytes(self.term_blob[start:end]).decode("utf-8")
+
+    def code(self, term_id: int) -> str:
+        start, end = self.code_offsets[term_id], self.code_offsets[term_id + 1]
+        return bytes(self.code_blob[start:end]).decode("utf-8")
+
+    def lookup(self, text: str, k: int = 5, cutoff: float = 0.6, pool: int = 32,
+               max_scan: int = 5000) -> list:
+        """Return up to `k` (term, code, score) matches with score >= cutoff, best first
+
+        Like `get_close_matches`, equal scores are ordered by descending term.
+        When none of the `pool` best trigram candidates reaches the cutoff (short
+        queries can share no trigram with a term that is still close by ratio),
+        every term of a compatible length is scored, as difflib would, unless
+        there are more than `max_scan` of them.
+        """
+        query = text.lower().strip()
+        grams = _trigrams(query)
+        keys = np.array(sorted({_gram_key(g) for g in grams}), dtype=np.uint32)
+        positions = np.searchsorted(self.gram_keys, keys)
+        slices = [
+            self.postings[self.gram_offsets[pos]:self.gram_offsets[pos + 1]]
+            for pos, key in zip(positions, keys)
+            if pos < len(self.gram_keys) and self.gram_keys[pos] == key
+        ]
+        candidates = np.zeros(0, dtype=np.int32)
+        if slices:
+            candidates, shared = np.unique(np.concatenate(slices), return_counts=True)
+            dice = 2.0 * shared / (len(grams) + self.gram_counts[candidates])
+            if len(candidates) > pool:
+                best = np.argpartition(-dice, pool)[:pool]
+                candidates = np.sort(candidates[best])
+        scored = self._score(query, candidates.tolist(), cutoff)
+        if not scored:
+            term_ids = self._length_matches(len(query), cutoff)
+            if len(term_ids) <= max_scan:
+                scored = self._score(query, term_ids.tolist(), cutoff)
+        # (score, term) descending, the order of heapq.nlargest in get_close_matches
+        scored.sort(key=lambda match: (match[2], match[0]), reverse=True)
+        return scored[:k]
+
+    def _length_matches(self, length: int, cutoff: float) -> np.ndarray:
+        """Ids of the terms long enough and short enough to reach `cutoff` (difflib's real_quick_ratio)"""
+        if self._term_lengths is None:
+            # characters per term: UTF-8 bytes that don't continue a multi-byte sequence
+            starts = (np.asarray(self.term_blob) & 0xC0) != 0x80
+            counts = np.concatenate(([0], np.cumsum(starts, dtype=np.int64)))
+            self._term_lengths = counts[self.term_offsets[1:]] - counts[self.term_offsets[:-1]]
+        bound = 2.0 * np.minimum(self._term_lengths, length) / np.maximum(self._term_lengths + length, 1)
+        return np.flatnonzero(bound >= cutoff)
+
+    def _score(self, query: str, term_ids, cutoff: float) -> list:
+        """(term, code, ratio) of the terms whose SequenceMatcher ratio reaches `cutoff`"""
+        matcher = SequenceMatcher()
+        matcher.set_seq2(query)
+        scored = []
+        for term_id in term_ids:
+            term = self.term(term_id)
+            matcher.set_seq1(term)
+            # same cheap-to-expensive filter chain as difflib.get_close_matches
+            if (matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff
+                    and (score := matcher.ratio()) >= cutoff):
+                scored.append((term, self.code(term_id), score))
+        return scored
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+def get_default_index() -> TerminologyIndex:
+    """Shared index used by the prompt classes, built from DISEASE_CODE unless replaced"""
+    global _default_index
+    if _default_index is None:
+        with _default_lock:
+            if _default_index is None:
+                _default_index = TerminologyIndex.build(list(DISEASE_CODE.items()))
+    return _default_index
+
+
+def set_default_index(index: TerminologyIndex):
+    """Swap in a different vocabulary, e.g. one loaded with `TerminologyIndex.load`"""
+    global _default_index
+    with _default_lock:
+        _default_index = index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query a terminology index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index a vocabulary file")
+    build.add_argument("vocabulary")
+    build.add_argument("output_dir")
+    lookup = commands.add_parser("lookup", help="fuzzy-match a term against an index")
+    lookup.add_argument("index_dir")
+    lookup.add_argument("text")
+    lookup.add_argument("-k", type=int, default=5)
+    lookup.add_argument("--cutoff", type=float, default=0.6)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = TerminologyIndex.from_vocabulary_file(args.vocabulary)
+        index.save(args.output_dir)
+        print(f"Indexed {len(index)} terms into {args.output_dir}")
+    else:
+        index = TerminologyIndex.load(args.index_dir)
+        for term, code, score in index.lookup(args.text, k=args.k, cutoff=args.cutoff):
+            print(f"{score:.3f}\t{code}\t{term}")
+
+
+if __name__ == "__main__":
+    main()
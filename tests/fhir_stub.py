@@ -0,0 +1,64 @@
+"""A local stand-in for a FHIR server, scripted per request path"""
+import asyncio
+import json
+from collections import defaultdict
+
+from aiohttp import web
+
+
+class StubFHIRServer:
+    """aiohttp server on 127.0.0.1 that answers each path from a script
+
+    `script(path, *responses)` queues (status, body, headers, delay) tuples for
+    `path`, used in order; the last one keeps answering once the queue runs
+    out. Dict bodies are sent as JSON, and a callable body is called with the
+    aiohttp request to build it. Every request URL is kept in `hits` and its
+    headers in `request_headers`.
+    """
+    def __init__(self):
+        self.responses = defaultdict(list)
+        self.hits = []
+        self.request_headers = []
+        self._runner = None
+        self.base_url = None
+
+    def script(self, path: str, *responses):
+        self.responses[path].extend(responses)
+
+    def count(self, path: str) -> int:
+        return sum(1 for url in self.hits if url.split("?")[0].endswith(path))
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.hits.append(str(request.url))
+        self.request_headers.append(dict(request.headers))
+        queue = self.responses.get(request.path)
+        if not queue:
+            return web.json_response({"resourceType": "OperationOutcome"}, status=404)
+        status, body, headers, delay = queue.pop(0) if len(queue) > 1 else queue[0]
+        if delay:
+            await asyncio.sleep(delay)
+        if callable(body):
+            body = body(request)
+        if isinstance(body, dict):
+            body = json.dumps(body)
+        return web.Response(status=status, text=body or "", headers=headers or {},
+                            content_type="application/fhir+json")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("GET", "/{tail:.*}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+def reply(status: int = 200, body=None, headers: dict = None, delay: float = 0):
+    """One scripted response"""
+    return status, body, headers, delay
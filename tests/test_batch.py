@@ -0,0 +1,35 @@
+import asyncio
+
+from app.main import iter_body_lines
+from nlp_query.batch import chunked, iter_query_records
+
+
+class StreamingRequest:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def test_query_records_keep_line_numbers():
+    lines = ['"female patients"', "", '{"id": "a", "query": "asthma"}', "{oops", '{"text": " "}']
+    records = list(iter_query_records(lines))
+    assert [record[:2] for record in records] == [(1, "female patients"), ("a", "asthma"), (4, None), (5, None)]
+    assert records[2][2] and records[3][2]
+    assert list(iter_query_records(['"x"'], start=7)) == [(7, "x", None)]
+
+
+def test_chunked():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_body_lines_are_decoded_across_chunks():
+    body = '"café"\n\n"naïve"\r\n"last"'.encode("utf-8")
+    chunks = [body[i:i + 3] for i in range(0, len(body), 3)]
+
+    async def lines():
+        return [line async for line in iter_body_lines(StreamingRequest(chunks))]
+
+    assert asyncio.run(lines()) == ['"café"', "", '"naïve"\r', '"last"']
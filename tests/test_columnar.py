@@ -0,0 +1,41 @@
+import io
+
+import pyarrow.ipc as ipc
+import pytest
+
+from app import columnar
+from benchmarks.corpus import synthetic_bundle
+
+
+@pytest.mark.parametrize("accept, media_type, json_ok", [
+    (None, None, True),
+    ("application/json", None, True),
+    ("application/vnd.apache.parquet", columnar.PARQUET, False),
+    ("application/x-parquet;q=0.9, */*;q=0.1", columnar.PARQUET, True),
+    # JSON wins ties against a columnar type, a wildcard doesn't
+    ("application/vnd.apache.arrow.stream, application/json", None, True),
+    ("application/vnd.apache.arrow.stream, */*", columnar.ARROW_STREAM, True),
+    ("application/json;q=0.5, application/vnd.apache.arrow.stream", columnar.ARROW_STREAM, True),
+    # q=0 rules a type out
+    ("application/json, application/vnd.apache.parquet;q=0", None, True),
+    ("application/vnd.apache.parquet;q=0", None, False),
+    ("application/vnd.apache.parquet, application/json;q=0", columnar.PARQUET, False),
+    ("application/vnd.apache.parquet, */*;q=1, application/json;q=0", columnar.PARQUET, False),
+    # highest q wins between columnar types
+    ("application/x-parquet;q=0.4, application/vnd.apache.arrow.stream;q=0.8", columnar.ARROW_STREAM, False),
+    ("application/vnd.apache.arrow.stream;q=0.5, application/vnd.apache.parquet;q=0.5, text/html",
+     columnar.ARROW_STREAM, False),
+    ("application/vnd.apache.parquet; q=0.3, application/*;q=0.2", columnar.PARQUET, True),
+    ("application/vnd.apache.parquet;q=oops", columnar.PARQUET, False),
+])
+def test_negotiation(accept, media_type, json_ok):
+    assert columnar.negotiate(accept) == media_type
+    assert columnar.accepts_json(accept) is json_ok
+
+
+def test_arrow_stream_roundtrip():
+    table = columnar.patients_table(synthetic_bundle(50), {"_has:Condition:patient:code": "44054006"})
+    body = columnar.serialize(table, columnar.ARROW_STREAM)
+    read = ipc.open_stream(io.BytesIO(body)).read_all()
+    assert read.num_rows == 50
+    assert set(read.column("condition").to_pylist()) == {"44054006"}
@@ -0,0 +1,79 @@
+import pytest
+
+from app.utils import simplify_condition_data
+from benchmarks.stand_ins import stand_in_components
+from nlp_query.condition_prompt import ConditionPrompt
+from nlp_query.dispatcher import Dispatcher
+
+
+@pytest.fixture(scope="module")
+def dispatcher():
+    return Dispatcher(plan_cache_size=0, **stand_in_components())
+
+
+def _search(dispatcher, text):
+    return ConditionPrompt("search").process(dispatcher.apply_ner(text), "[base]")
+
+
+def test_diagnosed_before_a_year(dispatcher):
+    request = dispatcher.dispatch("diabetes cases diagnosed before 2015")
+    assert request["url"] == "[base]/Condition?code=44054006&onset-date=lt2015-01-01&_include=Condition:subject"
+    assert request["parameters"] == {"code": "44054006", "onset-date": "lt2015-01-01"}
+
+
+def test_year_range_is_two_onset_params(dispatcher):
+    request = _search(dispatcher, "asthma cases diagnosed between 2010 and 2015")
+    assert request["query_string"] == "code=195967001&onset-date=ge2010&onset-date=le2015&_include=Condition:subject"
+    assert request["parameters"]["onset-date"] == ["ge2010", "le2015"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("asthma cases in patients born before 1980", "code=195967001&subject:Patient.birthdate=lt1980-01-01"),
+    ("asthma cases in patients born before 1980 diagnosed after 2010",
+     "code=195967001&onset-date=gt2010-12-31&subject:Patient.birthdate=lt1980-01-01"),
+    ("diabetes cases in patients who died in 2020",
+     "code=44054006&subject:Patient.deceased=true&subject:Patient.deceased-date=2020"),
+])
+def test_birth_and_death_dates_are_not_onset(dispatcher, text, expected):
+    assert _search(dispatcher, text)["query_string"] == f"{expected}&_include=Condition:subject"
+
+
+def test_only_search_is_supported(dispatcher):
+    with pytest.raises(NotImplementedError):
+        ConditionPrompt("create").process(dispatcher.apply_ner("add an asthma case"))
+
+
+def _condition(id, code, subject, onset="2012-03-04"):
+    return {"resourceType": "Condition", "id": id, "subject": {"reference": subject}, "onsetDateTime": onset,
+            "code": {"coding": [{"system": "http://snomed.info/sct", "code": code, "display": f"display {code}"}]},
+            "clinicalStatus": {"coding": [{"code": "active"}]}}
+
+
+def _patient(id, family, gender="female"):
+    return {"resourceType": "Patient", "id": id, "gender": gender, "birthDate": "1970-01-01",
+            "name": [{"family": family, "given": ["Ann"]}], "address": [{"city": "Boston", "state": "MA"}]}
+
+
+def test_conditions_join_their_subjects():
+    bundle = {"resourceType": "Bundle", "entry": [
+        {"fullUrl": "[base]/Condition/c1", "resource": _condition("c1", "44054006", "Patient/p1")},
+        {"fullUrl": "urn:uuid:c2", "resource": _condition("c2", "195967001", "urn:uuid:0b7e")},
+        {"fullUrl": "[base]/Condition/c3", "resource": _condition("c3", "38341003", "Patient/p1")},
+        {"fullUrl": "[base]/Condition/c4", "resource": _condition("c4", "44054006", "Patient/p1")},
+        {"fullUrl": "[base]/Condition/c5", "resource": _condition("c5", "44054006", "Patient/missing")},
+        {"fullUrl": "[base]/Patient/p1", "resource": _patient("p1", "Smith"), "search": {"mode": "include"}},
+        {"fullUrl": "urn:uuid:0b7e", "resource": _patient("p2", "Jones", "male"), "search": {"mode": "include"}},
+    ]}
+    result = simplify_condition_data(bundle, {"code": "44054006"})
+    assert [patient["name"] for patient in result["patients"]] == ["Ann Smith", "Ann Jones"]
+    # a patient with several matched conditions keeps every distinct code
+    assert [patient["condition"] for patient in result["patients"]] == ["44054006,38341003", "195967001"]
+    conditions = result["conditions"]
+    assert [condition["patient"]["name"] if condition["patient"] else None for condition in conditions] == [
+        "Ann Smith", "Ann Jones", "Ann Smith", "Ann Smith", None]
+    assert conditions[0]["display"] == "display 44054006" and conditions[0]["onset"] == "2012-03-04"
+    assert conditions[0]["clinical_status"] == "active"
+    assert result["summary"]["total_patients"] == 2
+    assert result["summary"]["total_conditions"] == 5
+    assert result["summary"]["gender_distribution"] == {"female": 1, "male": 1}
+    assert result["query"] == {"code": "44054006"}
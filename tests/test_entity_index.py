@@ -0,0 +1,53 @@
+import random
+
+from nlp_query.entity_index import EntityIndex
+
+LABELS = ["PERSON", "DATE", "AGE_OVER", "LABEL_1", "LABEL_2", "GP_KEYWORD"]
+
+
+def _entities(rng, count):
+    """Offset-ordered entities, as the Dispatcher produces them, with some shared starts"""
+    entities, offset = [], 0
+    for _ in range(count):
+        offset += rng.choice([0, 1, 2, 5])
+        length = rng.randrange(1, 6)
+        entities.append({"text": "x" * length, "label": rng.choice(LABELS), "start": offset, "end": offset + length})
+    return entities
+
+
+def _scan_next(entities, labels, offset, inclusive=False):
+    """The first-match loop EntityIndex replaced"""
+    for ent in entities:
+        if ent["label"] in labels and (ent["start"] >= offset if inclusive else ent["start"] > offset):
+            return ent
+    return None
+
+
+def _scan_at(entities, label, key, offset):
+    for ent in entities:
+        if ent["label"] == label and ent[key] == offset:
+            return ent
+    return None
+
+
+def test_lookups_match_the_linear_scans():
+    rng = random.Random(7)
+    for _ in range(50):
+        entities = _entities(rng, rng.randrange(0, 40))
+        index = EntityIndex(entities)
+        end = entities[-1]["end"] + 2 if entities else 3
+        for labels in (("PERSON",), ("DATE", "AGE_OVER"), ("LABEL_1", "LABEL_2", "GP_KEYWORD")):
+            assert index.first(labels) is _scan_next(entities, labels, float("-inf"))
+            for offset in range(-1, end):
+                assert index.next_after(labels, offset) is _scan_next(entities, labels, offset)
+                assert index.next_after(labels, offset, inclusive=True) is \
+                    _scan_next(entities, labels, offset, inclusive=True)
+        for offset in range(end):
+            assert index.starting_at("LABEL_2", offset) is _scan_at(entities, "LABEL_2", "start", offset)
+            assert index.ending_at("LABEL_1", offset) is _scan_at(entities, "LABEL_1", "end", offset)
+
+
+def test_single_label_string():
+    entities = [{"label": "PERSON", "start": 4, "end": 8}]
+    assert EntityIndex(entities).next_after("PERSON", 0) is entities[0]
+    assert EntityIndex([]).first(("PERSON",)) is None
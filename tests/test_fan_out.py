@@ -0,0 +1,92 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from app.fan_out import FanOutTruncated, combine, fan_out_search, patient_id
+from app.replica import FHIRReplica, LocalReplicaClient
+
+BASE = "http://fhir.test/baseR4"
+CODES = ["44054006", "38341003", "195967001"]
+
+
+class CountingClient(LocalReplicaClient):
+    """Replica client that records the URLs it serves and the peak number of requests in flight"""
+    def __init__(self, replica):
+        super().__init__(replica)
+        self.urls = []
+        self.in_flight = self.peak = 0
+
+    async def _fetch(self, url, headers=None):
+        self.urls.append(url)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+            return await super()._fetch(url, headers)
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.fixture(scope="module")
+def replica(tmp_path_factory):
+    rng = random.Random(7)
+    entries = []
+    for i in range(600):
+        entries.append({"resourceType": "Patient", "id": f"p{i}", "gender": rng.choice(["male", "female"]),
+                        "birthDate": f"{rng.randint(1930, 2015)}-06-01"})
+        for code in rng.sample(CODES, rng.randint(0, 3)):
+            entries.append({"resourceType": "Condition", "id": f"c{len(entries)}", "subject": {"reference": f"Patient/p{i}"},
+                            "code": {"coding": [{"code": code}]}})
+    path = tmp_path_factory.mktemp("fan_out") / "data.ndjson"
+    path.write_text("\n".join(json.dumps(resource) for resource in entries))
+    store = FHIRReplica(str(path.with_suffix(".sqlite")))
+    store.import_paths([str(path)])
+    return store
+
+
+def _plan(operator, codes, patient_query="gender=female"):
+    return {"operator": operator,
+            "searches": [f"{BASE}/Condition?code={code}&_elements=subject" for code in codes],
+            "patients": f"{BASE}/Patient?{patient_query}"}
+
+
+def _chained_total(replica, operator, codes, patient_query="gender=female"):
+    if operator == "or":
+        has = f"_has:Condition:patient:code={','.join(codes)}"
+    else:
+        has = "&".join(f"_has:Condition:patient:code={code}" for code in codes)
+    return replica.search(f"{BASE}/Patient?{patient_query}&{has}&_summary=count")["total"]
+
+
+@pytest.mark.parametrize("operator", ["and", "or"])
+def test_matches_chained_search(replica, operator):
+    plan = _plan(operator, CODES[:2], "gender=female&_count=1000")
+    bundle = asyncio.run(fan_out_search(LocalReplicaClient(replica), plan, page_size=50, max_pages=100))
+    assert bundle["total"] == len(bundle["entry"]) == _chained_total(replica, operator, CODES[:2])
+    assert all(entry["resource"]["gender"] == "female" for entry in bundle["entry"])
+
+
+def test_first_page_only_with_bounded_concurrency(replica):
+    client = CountingClient(replica)
+    bundle = asyncio.run(fan_out_search(client, _plan("or", CODES), page_size=50, max_pages=100,
+                                        id_batch_size=5, concurrency=3))
+    assert len(bundle["entry"]) == 20  # one page, like the chained search without _count
+    assert "total" not in bundle  # not every ID was checked
+    patient_fetches = [url for url in client.urls if "/Patient?" in url]
+    assert len(patient_fetches) < _chained_total(replica, "or", CODES) / 5
+    assert client.peak <= 3 + len(CODES)
+
+
+def test_truncated_condition_search_raises(replica):
+    with pytest.raises(FanOutTruncated):
+        asyncio.run(fan_out_search(LocalReplicaClient(replica), _plan("and", CODES[:2]), page_size=10, max_pages=2))
+
+
+def test_combine_and_references():
+    assert combine([["a", "b", "c"], ["c", "a"]], "and") == ["a", "c"]
+    assert combine([["a", "b"], ["c", "a"]], "or") == ["a", "b", "c"]
+    assert combine([], "and") == []
+    assert patient_id("http://x/fhir/Patient/12/_history/3") == "12"
+    assert patient_id("Group/4") is None
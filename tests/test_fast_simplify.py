@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from app import fast_simplify
+from app.utils import simplify_patient_data
+from benchmarks.corpus import synthetic_bundle
+
+PARAMS = {"_has:Condition:patient:code": "44054006", "gender": "female"}
+
+
+def _patient(**fields):
+    return {"resource": {"resourceType": "Patient", **fields}}
+
+
+# Awkward resources mixed into the synthetic bundle, each repeated so they span several code paths
+ODD_ENTRIES = [
+    _patient(birthDate="500000000000000000000-01-01"),  # past int64
+    _patient(birthDate="-900000000000000000000"),  # the "-" split leaves no year
+    _patient(birthDate="19x0-01-01"),
+    _patient(birthDate=["1990"]),  # unhashable
+    _patient(birthDate=1990),
+    _patient(gender=1, address=[{"city": 1.0, "state": True}]),
+    _patient(gender=True, address=[{"city": True, "state": 1}]),
+    _patient(gender=None, address=[{"city": "", "state": None}]),
+    _patient(name=[{"given": [], "family": "Solo"}], address=[]),
+    {"resource": {"resourceType": "OperationOutcome"}},
+    {"resource": {}},
+]
+
+
+def _both(bundle):
+    body = json.dumps(bundle).encode("utf-8")
+    reference = simplify_patient_data(json.loads(body), PARAMS)
+    fast = fast_simplify.simplify_patient_data(fast_simplify.loads(body), PARAMS)
+    return reference, fast
+
+
+@pytest.mark.parametrize("size", [10, 300, 2000])
+def test_engines_agree_on_synthetic_bundles(size):
+    reference, fast = _both(synthetic_bundle(size, seed=size))
+    assert json.dumps(fast) == json.dumps(reference)  # key order included
+    assert fast_simplify.dumps(fast) == json.dumps(reference, ensure_ascii=False,
+                                                              separators=(",", ":")).encode("utf-8")
+
+
+def test_engines_agree_on_odd_resources():
+    bundle = synthetic_bundle(fast_simplify.MIN_VECTORIZED_ENTRIES)
+    bundle["entry"] += ODD_ENTRIES * 3
+    reference, fast = _both(bundle)
+    assert json.dumps(fast) == json.dumps(reference)
+    odd = fast["patients"][-27:-18]
+    assert [p["age_group"] for p in odd[:2]] == ["0-18", "unknown"]
+    assert [p["gender"] for p in odd[5:7]] == [1, True]
+    assert fast["summary"]["gender_distribution"][1] == 6  # counted together, like a Counter
+
+
+def test_non_finite_numbers_are_written_as_null():
+    bundle = fast_simplify.loads(b'{"entry": [{"resource": {"resourceType": "Patient", "gender": NaN}}]}')
+    payload = fast_simplify.simplify_patient_data(bundle, {})
+    if fast_simplify.orjson is None:
+        with pytest.raises(ValueError):
+            fast_simplify.dumps(payload)
+    else:
+        assert b'"patients":[{"name":"","gender":null' in fast_simplify.dumps(payload)
@@ -0,0 +1,174 @@
+import asyncio
+import time
+
+import pytest
+
+from app.fhir_cache import CacheEntry, FHIRResponseCache, MemoryCacheStore, SQLiteCacheStore, canonical_url
+from app.fhir_client import FHIRClient
+from fhir_stub import StubFHIRServer, reply
+
+BUNDLE = {"resourceType": "Bundle", "type": "searchset", "entry": []}
+
+
+def run(scenario, ttl=300, store=None):
+    """Run `scenario(server, client, cache)` with a cached FHIRClient against a fresh stub server"""
+    async def main():
+        server = await StubFHIRServer().start()
+        cache = FHIRResponseCache(store or MemoryCacheStore(), ttl=ttl)
+        client = FHIRClient(cache=cache, backoff_base=0.001)
+        try:
+            return await scenario(server, client, cache)
+        finally:
+            await client.close()
+            await server.stop()
+    return asyncio.run(main())
+
+
+def test_canonical_url():
+    assert canonical_url("HTTP://Fhir.Test/Patient/?b=2&a=1&a=0") == "http://fhir.test/Patient?a=0&a=1&b=2"
+
+
+def test_concurrent_requests_share_one_fetch():
+    async def scenario(server, client, cache):
+        server.script("/Patient", reply(200, BUNDLE, delay=0.2))
+        responses = await asyncio.gather(*(client.get(f"{server.base_url}/Patient?gender=male") for _ in range(5)))
+        assert [r.json() for r in responses] == [BUNDLE] * 5
+        assert server.count("/Patient") == 1
+        assert cache.stats["coalesced"] == 4
+    run(scenario)
+
+
+def test_reordered_parameters_hit():
+    async def scenario(server, client, cache):
+        server.script("/Patient", reply(200, BUNDLE))
+        await client.get(f"{server.base_url}/Patient?gender=male&birthdate=lt1960")
+        response = await client.get(f"{server.base_url}/Patient?birthdate=lt1960&gender=male")
+        assert response.json() == BUNDLE
+        assert server.count("/Patient") == 1 and cache.stats["hits"] == 1
+    run(scenario)
+
+
+@pytest.mark.parametrize("validator, conditional", [
+    ({"ETag": 'W/"3"'}, ("If-None-Match", 'W/"3"')),
+    ({"Last-Modified": "Wed, 21 Oct 2026 07:28:00 GMT"}, ("If-Modified-Since", "Wed, 21 Oct 2026 07:28:00 GMT")),
+])
+def test_expired_entries_are_revalidated(validator, conditional):
+    async def scenario(server, client, cache):
+        server.script("/Patient", reply(200, BUNDLE, headers=validator), reply(304))
+        await client.get(f"{server.base_url}/Patient")
+        await asyncio.sleep(0.1)
+        response = await client.get(f"{server.base_url}/Patient")
+        assert (response.status, response.json()) == (200, BUNDLE)
+        name, value = conditional
+        assert server.request_headers[1][name] == value
+        assert cache.stats["revalidated"] == 1
+        await client.get(f"{server.base_url}/Patient")  # the 304 renewed the lifetime
+        assert server.count("/Patient") == 2
+    run(scenario, ttl=0.05)
+
+
+def test_expired_entries_without_validators_are_refetched():
+    async def scenario(server, client, cache):
+        server.script("/Patient", reply(200, BUNDLE))
+        await client.get(f"{server.base_url}/Patient")
+        await client.get(f"{server.base_url}/Patient")
+        await asyncio.sleep(0.1)
+        await client.get(f"{server.base_url}/Patient")
+        assert server.count("/Patient") == 2
+        assert "If-None-Match" not in server.request_headers[1]
+        assert (cache.stats["hits"], cache.stats["misses"]) == (1, 2)
+    run(scenario, ttl=0.05)
+
+
+@pytest.mark.parametrize("cache_control, upstream_hits", [
+    ("no-store", 3),
+    ("max-age=0", 3),  # no validator, nothing to revalidate with
+    ("private, max-age=60", 1),  # outlives the 0.05 s default
+])
+def test_cache_control(cache_control, upstream_hits):
+    async def scenario(server, client, cache):
+        server.script("/Patient", reply(200, BUNDLE, headers={"Cache-Control": cache_control}))
+        for _ in range(3):
+            await client.get(f"{server.base_url}/Patient")
+            await asyncio.sleep(0.06)
+        assert server.count("/Patient") == upstream_hits
+    run(scenario, ttl=0.05)
+
+
+def test_max_age_zero_with_etag_always_revalidates():
+    async def scenario(server, client, cache):
+        server.script("/Patient", reply(200, BUNDLE, headers={"Cache-Control": "max-age=0", "ETag": '"1"'}),
+                      reply(304, headers={"Cache-Control": "max-age=0"}))
+        for _ in range(3):
+            assert (await client.get(f"{server.base_url}/Patient")).json() == BUNDLE
+        assert server.count("/Patient") == 3 and cache.stats["revalidated"] == 2
+    run(scenario)
+
+
+def test_errors_are_not_stored():
+    async def scenario(server, client, cache):
+        server.script("/Patient", reply(404, "gone"))
+        await client.get(f"{server.base_url}/Patient")
+        await client.get(f"{server.base_url}/Patient")
+        assert server.count("/Patient") == 2
+    run(scenario)
+
+
+def test_sqlite_store_behind_the_cache(tmp_path):
+    async def scenario(server, client, cache):
+        server.script("/Patient", reply(200, BUNDLE))
+        await client.get(f"{server.base_url}/Patient?a=1")
+        assert (await client.get(f"{server.base_url}/Patient?a=1")).json() == BUNDLE
+        assert server.count("/Patient") == 1
+    run(scenario, store=SQLiteCacheStore(str(tmp_path / "cache.sqlite")))
+
+
+STORES = {
+    "memory": lambda tmp_path, **bounds: MemoryCacheStore(**bounds),
+    "sqlite": lambda tmp_path, **bounds: SQLiteCacheStore(str(tmp_path / "cache.sqlite"), **bounds),
+}
+
+
+def _entry(size):
+    return CacheEntry(status=200, body=b"x" * size, headers={"ETag": '"1"'}, expires_at=time.time() + 60)
+
+
+@pytest.mark.parametrize("kind", STORES)
+def test_lru_eviction_by_entries(kind, tmp_path):
+    store = STORES[kind](tmp_path, max_entries=2)
+    store.set("a", _entry(1))
+    store.set("b", _entry(1))
+    assert store.get("a").etag == '"1"'  # now the most recently used
+    store.set("c", _entry(1))
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+
+
+@pytest.mark.parametrize("kind", STORES)
+def test_lru_eviction_by_bytes(kind, tmp_path):
+    store = STORES[kind](tmp_path, max_bytes=10)
+    store.set("a", _entry(4))
+    store.set("b", _entry(4))
+    store.set("a", _entry(3))  # replacing an entry frees its old size
+    store.set("c", _entry(3))
+    assert store.get("b") is not None  # 3 + 4 + 3 fits
+    store.set("d", _entry(5))
+    assert [store.get(key) is not None for key in "abcd"] == [False, True, False, True]
+    store.set("huge", _entry(11))
+    assert store.get("huge") is None and store.get("d") is not None
+
+
+def test_sqlite_totals_survive_reopening(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    store = SQLiteCacheStore(path, max_entries=3)
+    for key in "abc":
+        store.set(key, _entry(2))
+    store.set("b", _entry(5))
+    totals = "SELECT entries, bytes FROM fhir_cache_totals"
+    assert store._connect().execute(totals).fetchone() == (3, 9)
+    reopened = SQLiteCacheStore(path, max_entries=3)
+    reopened.set("d", _entry(1))
+    assert reopened.get("a") is None
+    assert reopened._connect().execute(totals).fetchone() == (3, 8)
+    reopened.clear()
+    assert reopened._connect().execute(totals).fetchone() == (0, 0)
@@ -0,0 +1,125 @@
+import asyncio
+import socket
+
+import aiohttp
+import pytest
+
+from app.fhir_client import FHIRClient, FHIRResponseError, add_query_params
+from fhir_stub import StubFHIRServer, reply
+
+BUNDLE = {"resourceType": "Bundle", "type": "searchset", "entry": []}
+
+
+def run(scenario, **client_options):
+    """Run `scenario(server, client, statuses)` against a fresh stub server"""
+    async def main():
+        server = await StubFHIRServer().start()
+        client = FHIRClient(**{"backoff_base": 0.001, "max_retries": 2, **client_options})
+        statuses = []
+        client.add_response_listener(lambda status, seconds, error: statuses.append(status or error))
+        try:
+            return await scenario(server, client, statuses)
+        finally:
+            await client.close()
+            await server.stop()
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_retries_throttled_and_failed_responses(status):
+    async def scenario(server, client, statuses):
+        server.script("/Patient", reply(status), reply(200, BUNDLE))
+        response = await client.get(f"{server.base_url}/Patient?gender=male")
+        assert response.status == 200 and response.json() == BUNDLE
+        assert statuses == [status, 200]
+    run(scenario)
+
+
+def test_last_failed_attempt_is_returned():
+    async def scenario(server, client, statuses):
+        server.script("/Patient", reply(503, "busy"))
+        response = await client.get(f"{server.base_url}/Patient")
+        assert (response.status, response.text) == (503, "busy")
+        assert server.count("/Patient") == 3  # max_retries + 1
+        with pytest.raises(FHIRResponseError) as error:
+            await client.get_json(f"{server.base_url}/Patient")
+        assert error.value.status == 503
+    run(scenario)
+
+
+def test_client_errors_are_not_retried():
+    async def scenario(server, client, statuses):
+        server.script("/Patient", reply(400, "bad"))
+        assert (await client.get(f"{server.base_url}/Patient?x=1")).status == 400
+        assert statuses == [400]
+    run(scenario)
+
+
+def test_retry_after_is_honoured():
+    async def scenario(server, client, statuses):
+        server.script("/Patient", reply(429, headers={"Retry-After": "0.2"}), reply(200, BUNDLE))
+        start = asyncio.get_running_loop().time()
+        assert (await client.get(f"{server.base_url}/Patient")).status == 200
+        assert asyncio.get_running_loop().time() - start >= 0.2
+    run(scenario, backoff_base=0)
+
+
+def test_backoff_delays():
+    client = FHIRClient(backoff_base=0.5, backoff_max=3)
+    assert client._retry_delay(0, "2") == 2
+    assert client._retry_delay(0, "120") == 3  # capped
+    assert 0 <= client._retry_delay(0, "Wed, 21 Oct 2026 07:28:00 GMT") <= 0.5  # HTTP-date: backoff
+    delays = [client._retry_delay(attempt) for attempt in (0, 1, 2, 10) for _ in range(50)]
+    assert all(0 <= delay <= 3 for delay in delays)
+    assert max(client._retry_delay(2) for _ in range(200)) > 0.5  # the window doubles per attempt
+
+
+def test_read_timeout_is_retried_then_raised():
+    async def scenario(server, client, statuses):
+        server.script("/Patient", reply(200, BUNDLE, delay=0.5))
+        with pytest.raises(asyncio.TimeoutError):
+            await client.get(f"{server.base_url}/Patient")
+        assert server.count("/Patient") == 2
+        assert len(statuses) == 2 and all(status.endswith("TimeoutError") for status in statuses)
+    run(scenario, read_timeout=0.1, max_retries=1)
+
+
+def test_slow_first_attempt_recovers():
+    async def scenario(server, client, statuses):
+        server.script("/Patient", reply(200, BUNDLE, delay=0.5), reply(200, BUNDLE))
+        assert (await client.get(f"{server.base_url}/Patient")).json() == BUNDLE
+        assert statuses[0].endswith("TimeoutError") and statuses[1:] == [200]
+    run(scenario, read_timeout=0.1)
+
+
+def test_connection_errors_are_retried_then_raised():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]  # nothing listens once the socket closes
+
+    async def scenario(server, client, statuses):
+        with pytest.raises(aiohttp.ClientConnectionError):
+            await client.get(f"http://127.0.0.1:{port}/Patient")
+        assert statuses == ["ClientConnectorError"] * 3
+    run(scenario, connect_timeout=1)
+
+
+def test_iter_pages_follows_next_links():
+    async def scenario(server, client, statuses):
+        pages = [{"resourceType": "Bundle", "entry": [{"resource": {"id": str(i)}}],
+                  "link": [{"relation": "next", "url": f"{server.base_url}/page{i + 1}"}] if i < 3 else []}
+                 for i in range(4)]
+        server.script("/Patient", reply(200, pages[0]))
+        for i in range(1, 4):
+            server.script(f"/page{i}", reply(200, pages[i]))
+        bundles = [bundle async for bundle in client.iter_pages(f"{server.base_url}/Patient")]
+        assert [b["entry"][0]["resource"]["id"] for b in bundles] == ["0", "1", "2", "3"]
+        limited = [bundle async for bundle in client.iter_pages(f"{server.base_url}/Patient", max_pages=2)]
+        assert len(limited) == 2
+    run(scenario)
+
+
+def test_add_query_params():
+    assert add_query_params("[base]/Patient?name=John%20Smith&_count=5", {"_count": 50}) == \
+        "[base]/Patient?name=John%20Smith&_count=50"
+    assert add_query_params("[base]/Patient", {"_id": "a,b"}) == "[base]/Patient?_id=a,b"
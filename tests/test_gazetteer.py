@@ -0,0 +1,70 @@
+import pytest
+import spacy
+
+from benchmarks.stand_ins import StandInDiseaseNER, stand_in_components
+from nlp_query.dispatcher import Dispatcher
+from nlp_query.gazetteer import ConditionGazetteer
+
+
+@pytest.fixture(scope="module")
+def nlp():
+    return spacy.blank("en")
+
+
+@pytest.fixture(scope="module")
+def gazetteer(nlp):
+    return ConditionGazetteer(nlp)
+
+
+def matches(gazetteer, nlp, text):
+    return [(hit["word"], text[hit["start"]:hit["end"]]) for hit in gazetteer(nlp(text))]
+
+
+def test_longest_match_wins(gazetteer, nlp):
+    assert matches(gazetteer, nlp, "patients with a hemorrhagic stroke") == [("stroke hemorrhagic", "hemorrhagic stroke")]
+    assert matches(gazetteer, nlp, "type 2 diabetes patients") == [("diabetes mellitus", "type 2 diabetes")]
+
+
+def test_synonym_maps_to_canonical_term(gazetteer, nlp):
+    assert matches(gazetteer, nlp, "Patients with High Blood Pressure and COPD") == [
+        ("hypertension", "High Blood Pressure"), ("chronic obstructive pulmonary disease", "COPD")]
+
+
+def test_hits_have_char_offsets_and_ner_shape(gazetteer, nlp):
+    text = "women with asthma"
+    assert gazetteer(nlp(text)) == [{"entity_group": "LABEL_1", "score": 1.0, "word": "asthma",
+                                     "start": 11, "end": 17}]
+
+
+@pytest.mark.parametrize("text", ["patients with flu-like symptoms", "a stroke of luck for the team",
+                                  "patients who are depressed about it", "tb of storage"])
+def test_everyday_words_are_not_conditions(gazetteer, nlp, text):
+    assert gazetteer(nlp(text)) == []
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("patients with the flu", "influenza"),
+    ("patients with pulmonary TB", "tuberculosis"),
+    ("clinically depressed adults", "depression"),
+    ("patients with stroke", "stroke"),
+])
+def test_contextualized_phrases_still_match(gazetteer, nlp, text, expected):
+    assert [word for word, _ in matches(gazetteer, nlp, text)] == [expected]
+
+
+class CountingNER(StandInDiseaseNER):
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    def __call__(self, texts, **kwargs):
+        self.texts.extend([texts] if isinstance(texts, str) else texts)
+        return super().__call__(texts, **kwargs)
+
+
+def test_ner_only_runs_without_a_gazetteer_hit():
+    ner = CountingNER()
+    dispatcher = Dispatcher(plan_cache_size=0, **{**stand_in_components(), "medical_ner": ner})
+    batch = dispatcher.apply_ner_batch(["Patients with heart attack", "a stroke of luck"])
+    assert ner.texts == ["a stroke of luck"]
+    assert {"text": "myocardial infarction", "label": "LABEL_1", "start": 14, "end": 26} in batch[0]
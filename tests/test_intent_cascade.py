@@ -0,0 +1,84 @@
+from collections import Counter
+
+import pytest
+
+from benchmarks.stand_ins import StandInZeroShotClassifier, stand_in_components
+from nlp_query.dispatcher import Dispatcher
+from nlp_query.intent_rules import RuleIntentScorer
+from nlp_query.patient_prompt import PatientPrompt
+
+
+class CountingClassifier(StandInZeroShotClassifier):
+    def __init__(self):
+        self.sequences = []
+
+    def __call__(self, sequences, candidate_labels, **kwargs):
+        self.sequences.extend([sequences] if isinstance(sequences, str) else sequences)
+        return super().__call__(sequences, candidate_labels, **kwargs)
+
+
+@pytest.fixture
+def classifier():
+    return CountingClassifier()
+
+
+@pytest.fixture
+def dispatcher(classifier):
+    return Dispatcher(plan_cache_size=0, **{**stand_in_components(), "classifier": classifier})
+
+
+@pytest.mark.parametrize("hits, expected", [
+    (Counter(), (None, 0.0)),
+    (Counter({"search": 0, "delete": 0}), (None, 0.0)),
+    (Counter({"search": 2}), ("search", 1.0)),
+    (Counter({"search": 3, "delete": 1}), ("search", 0.5)),
+    (Counter({"search": 1, "delete": 1}), ("search", 0.0)),
+])
+def test_margin(hits, expected):
+    assert RuleIntentScorer._margin(hits) == expected
+
+
+def test_score_combines_keywords_and_entity_labels():
+    scorer = RuleIntentScorer()
+    assert scorer.score("Show all patients") == ("patients information", "search", 1.0)
+    assert scorer.score("Show diabetes cases") == ("medical conditions", "search", 1.0)
+    # no request keyword: the resource is clear but the request isn't
+    assert scorer.score("Patients named Smith") == ("patients information", None, 0.0)
+    # ruler labels count as patient evidence
+    assert scorer.score("Show cases of women", [{"label": "GENDER_FEMALE"}])[0] == "patients information"
+    assert scorer.score("Show cases of women")[2] == 0.0
+
+
+def test_margin_threshold_decides_between_rules_and_model(dispatcher, classifier):
+    at_threshold = "Show, find and list patients, then delete"  # search 3, delete 1: margin 0.5
+    below_threshold = "Show and find patients, then delete"     # search 2, delete 1: margin 1/3
+    assert dispatcher.rule_scorer.score(at_threshold)[2] == dispatcher.conf_threshold == 0.5
+    assert dispatcher.rule_scorer.score(below_threshold)[2] < dispatcher.conf_threshold
+    results = dispatcher.classify_batch([at_threshold, below_threshold])
+    assert classifier.sequences == [below_threshold]
+    assert results[0] == (PatientPrompt, "search")
+    assert dispatcher.cascade_stats() == {"rules": 1, "model": 1, "total": 2, "skipped_ratio": 0.5}
+
+
+def test_rules_and_model_agree_on_the_warm_up_corpus(dispatcher, classifier):
+    queries = list(Dispatcher.WARM_UP_QUERIES)
+    cascaded = dispatcher.classify_batch(queries, dispatcher.apply_ner_batch(queries))
+    model_only = Dispatcher(plan_cache_size=0, cascade=False, **stand_in_components())
+    assert cascaded == model_only.classify_batch(queries)
+    assert model_only.cascade_stats()["model"] == len(queries)
+    # only the query without a request keyword needed the model in the cascade
+    assert classifier.sequences == ["Patients with last name Smith whose GP is Dr. John Brown"]
+
+
+def test_cascade_stats_count_each_path(dispatcher):
+    assert dispatcher.cascade_stats() == {"rules": 0, "model": 0, "total": 0, "skipped_ratio": 0.0}
+    dispatcher.classify_batch(["Show all patients", "Find diabetes cases", "Patients named Smith"])
+    dispatcher.classify("delete")
+    assert dispatcher.cascade_stats() == {"rules": 2, "model": 2, "total": 4, "skipped_ratio": 0.5}
+
+
+def test_cascade_off_sends_everything_to_the_model(classifier):
+    dispatcher = Dispatcher(plan_cache_size=0, cascade=False, **{**stand_in_components(), "classifier": classifier})
+    dispatcher.classify_batch(["Show all patients", "Find diabetes cases"])
+    assert classifier.sequences == ["Show all patients", "Find diabetes cases"]
+    assert dispatcher.cascade_stats()["rules"] == 0
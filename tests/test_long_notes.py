@@ -0,0 +1,27 @@
+import time
+
+import nlp_query.dispatcher as dispatcher_module
+from benchmarks.stand_ins import stand_in_components
+from nlp_query.dispatcher import Dispatcher
+
+
+def test_long_note_keeps_late_conditions():
+    filler = "The patient attended clinic today and was reviewed by the team. " * 80
+    note = f"Referral letter. Patients with asthma. {filler} Also known to have hypertension and diabetes."
+    assert len(note) > 4000
+    dispatcher = Dispatcher(plan_cache_size=0, **stand_in_components())
+    start = time.perf_counter()
+    payload = dispatcher.dispatch(note)
+    assert time.perf_counter() - start < 2
+    assert payload["fan_out"]["searches"] == [f"[base]/Condition?code={code}"
+                                              for code in ("195967001", "38341003", "44054006")]
+
+
+def test_disease_ner_runs_long_notes_in_windows(monkeypatch):
+    calls = []
+    monkeypatch.setattr(dispatcher_module, "pipeline", lambda task, **options: calls.append((task, options)))
+    dispatcher = Dispatcher(lazy=True, **{**stand_in_components(), "medical_ner": None})
+    dispatcher._load_medical_ner()
+    task, options = calls[0]
+    assert task == "ner"
+    assert options["aggregation_strategy"] == "simple" and options["stride"] == Dispatcher.MEDICAL_NER_STRIDE
@@ -0,0 +1,116 @@
+import re
+
+import pytest
+
+from app.metrics import Histogram, MetricsRegistry
+
+# one sample line of the Prometheus text format: name, optional {label="value",...}, value
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*'
+                    r'(\{[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*"(,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*")*\})?'
+                    r' (-?[0-9.e+-]+|\+Inf|NaN)$')
+
+
+def samples(metric) -> dict:
+    return {f"{name}{labels}": value for name, labels, value in metric.samples()}
+
+
+@pytest.mark.parametrize("value, bucket", [
+    (0, 0), (0.1, 0), (0.5, 1), (1, 1), (1.0001, 2), (2.5, 2), (2.6, 3), (100, 3),
+])
+def test_values_land_in_the_first_bucket_at_or_above_them(value, bucket):
+    histogram = Histogram("h", "doc", buckets=(0.1, 1, 2.5))
+    histogram.observe(value)
+    series = histogram.series[()]
+    assert series[:-1] == [1 if i == bucket else 0 for i in range(4)]
+    assert series[-1] == value
+
+
+def test_buckets_and_count_are_cumulative():
+    histogram = Histogram("latency", "doc", labels=("stage",), buckets=(1, 5, 0.5))
+    for value in (0.2, 0.5, 3, 7, 9):
+        histogram.observe(value, "classify")
+    histogram.observe(2, "ner")
+    assert histogram.buckets == (0.5, 1, 5)
+    assert samples(histogram) == {
+        'latency_bucket{stage="classify",le="0.5"}': 2,
+        'latency_bucket{stage="classify",le="1.0"}': 2,
+        'latency_bucket{stage="classify",le="5.0"}': 3,
+        'latency_bucket{stage="classify",le="+Inf"}': 5,
+        'latency_sum{stage="classify"}': 19.7,
+        'latency_count{stage="classify"}': 5,
+        'latency_bucket{stage="ner",le="0.5"}': 0,
+        'latency_bucket{stage="ner",le="1.0"}': 0,
+        'latency_bucket{stage="ner",le="5.0"}': 1,
+        'latency_bucket{stage="ner",le="+Inf"}': 1,
+        'latency_sum{stage="ner"}': 2,
+        'latency_count{stage="ner"}': 1,
+    }
+
+
+def test_timer_observes_once():
+    histogram = Histogram("h", "doc")
+    with histogram.time():
+        pass
+    assert samples(histogram)["h_count"] == 1
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    counter = registry.counter("errors_total", "doc", labels=("error",))
+    counter.inc('bad "quote"\\path\nnext')
+    line = registry.render().splitlines()[-1]
+    assert line == 'errors_total{error="bad \\"quote\\"\\\\path\\nnext"} 1'
+    assert SAMPLE.match(line)
+
+
+def test_collectors_are_read_at_scrape_time():
+    registry = MetricsRegistry()
+    stats = {"hits": 1, "misses": 2, "hit_ratio": 0.5, "enabled": True, "backend": "sqlite"}
+    registry.add_collector("cache_total", "Cache stats", "gauge", "kind", lambda: stats)
+    registry.add_collector("absent", "Not configured", "gauge", "kind", lambda: None)
+    stats["hits"] = 3
+    assert registry.render() == (
+        "# HELP cache_total Cache stats\n"
+        "# TYPE cache_total gauge\n"
+        'cache_total{kind="hit_ratio"} 0.5\n'
+        'cache_total{kind="hits"} 3\n'
+        'cache_total{kind="misses"} 2\n'
+    )
+
+
+def test_render_is_prometheus_text_format():
+    registry = MetricsRegistry()
+    requests = registry.counter("api_requests_total", "Handled requests", labels=("path", "status"))
+    latency = registry.histogram("api_latency_seconds", "Request latency", buckets=(0.1, 1))
+    unlabelled = registry.counter("restarts_total", "Restarts")
+    registry.add_collector("plan_cache", "Plan cache stats", "gauge", "stat", lambda: {"size": 4})
+    requests.inc("/query", "200")
+    requests.inc("/query", "200")
+    requests.inc("/healthz", "200", amount=1.5)
+    latency.observe(0.05)
+    unlabelled.inc()
+    text = registry.render()
+    assert text.endswith("\n")
+    families = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            current = line.split()[2]
+            families[current] = []
+        elif line.startswith("# TYPE "):
+            name, kind = line.split()[2:]
+            assert name == current and kind in ("counter", "histogram", "gauge")
+        else:
+            assert SAMPLE.match(line), line
+            # every sample belongs to the family announced just before it
+            assert re.match(rf"{current}(_bucket|_sum|_count)?[{{ ]", line)
+            families[current].append(line)
+    assert families == {
+        "api_requests_total": ['api_requests_total{path="/healthz",status="200"} 1.5',
+                               'api_requests_total{path="/query",status="200"} 2'],
+        "api_latency_seconds": ['api_latency_seconds_bucket{le="0.1"} 1', 'api_latency_seconds_bucket{le="1.0"} 1',
+                                'api_latency_seconds_bucket{le="+Inf"} 1', "api_latency_seconds_sum 0.05",
+                                "api_latency_seconds_count 1"],
+        "restarts_total": ["restarts_total 1"],
+        "plan_cache": ['plan_cache{stat="size"} 4'],
+    }
@@ -0,0 +1,113 @@
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+from nlp_query.model_server import (HEADER, OP_NER, STATUS_ERROR, ModelServer, ModelServerClient,
+                                    ModelServerError, decode, encode, recv_message)
+
+
+class FakeDispatcher:
+    """Just enough of a Dispatcher for the server: NER sleeps `delay` and counts its calls"""
+    ruler_patterns = []
+    gazetteer = False
+    artifact_hash = None
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def add_stage_listener(self, listener):
+        pass
+
+    def apply_ner_batch(self, prompts, batch_size=32):
+        self.calls += 1
+        time.sleep(self.delay)
+        return [[{"text": prompt, "label": "LABEL_1", "start": 0, "end": len(prompt)}] for prompt in prompts]
+
+
+@pytest.fixture
+def serve(tmp_path):
+    servers = []
+
+    def start(dispatcher):
+        server = ModelServer(dispatcher, str(tmp_path / "models.sock"))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_encode_decode_roundtrip():
+    value = {"prompts": ["a", "é"], "n": -3, "x": 1.5, "ok": True, "none": None, "nested": [[1, False]]}
+    assert decode(encode(value)) == value
+    with pytest.raises(ValueError):
+        decode(encode(value)[:-3])
+
+
+def test_call(serve):
+    server = serve(FakeDispatcher())
+    client = ModelServerClient(server.path, startup_timeout=5)
+    client.connect()
+    assert client.call(OP_NER, {"prompts": ["asthma"]})["result"] == [[["asthma", "LABEL_1", 0, 6]]]
+    client.close()
+
+
+def test_reconnects_when_the_connection_dropped_before_sending(serve):
+    dispatcher = FakeDispatcher()
+    server = serve(dispatcher)
+    client = ModelServerClient(server.path, startup_timeout=5)
+    client.connect()
+    client._sock.shutdown(socket.SHUT_WR)  # the next send fails
+    assert client.call(OP_NER, {"prompts": ["a"]})["result"]
+    assert dispatcher.calls == 1
+
+
+def test_timeout_is_not_retried(serve):
+    dispatcher = FakeDispatcher(delay=0.5)
+    server = serve(dispatcher)
+    client = ModelServerClient(server.path, timeout=0.1, startup_timeout=5)
+    client.connect()
+    with pytest.raises(ModelServerError):
+        client.call(OP_NER, {"prompts": ["a"]})
+    time.sleep(0.6)
+    assert dispatcher.calls == 1
+
+
+def test_reply_to_a_timed_out_client_ends_the_connection_quietly(serve):
+    dispatcher = FakeDispatcher(delay=0.3)
+    server = serve(dispatcher)
+    errors = []
+    server.handle_error = lambda request, client_address: errors.append(sys.exc_info()[1])
+    client = ModelServerClient(server.path, timeout=0.05, startup_timeout=5)
+    client.connect()
+    with pytest.raises(ModelServerError):
+        client.call(OP_NER, {"prompts": ["a"]})
+    time.sleep(0.5)  # the handler finishes NER and tries to send the reply to the closed socket
+    assert errors == []
+    client.timeout = 5
+    assert client.call(OP_NER, {"prompts": ["b"]})["result"]
+    assert dispatcher.calls == 2
+    client.close()
+
+
+@pytest.mark.parametrize("frame", [
+    HEADER.pack(OP_NER, 2**31),  # over MAX_MESSAGE_BYTES
+    HEADER.pack(OP_NER, 2) + b"?x",  # unknown tag
+    HEADER.pack(OP_NER, 3) + b"s\x00\x00",  # truncated length
+])
+def test_malformed_frame_gets_an_error_and_closes(serve, frame):
+    server = serve(FakeDispatcher())
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(5)
+        sock.connect(server.path)
+        sock.sendall(frame)
+        status, message = recv_message(sock)
+        assert status == STATUS_ERROR and message
+        assert sock.recv(1) == b""
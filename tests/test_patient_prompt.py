@@ -0,0 +1,63 @@
+from app.columnar import patients_table
+from app.utils import simplify_patient_data
+from nlp_query.patient_prompt import PatientPrompt
+
+
+def _entities(text, spans):
+    """Entities for `text`, one per (substring, label)"""
+    entities = []
+    for substring, label in spans:
+        start = text.index(substring)
+        entities.append({"text": substring, "label": label, "start": start, "end": start + len(substring)})
+    return entities
+
+
+def _search(text, spans):
+    return PatientPrompt("search").process(_entities(text, spans), "[base]")
+
+
+def test_several_conditions_are_intersected():
+    request = _search("patients with diabetes and hypertension",
+                      [("diabetes", "LABEL_1"), ("hypertension", "LABEL_1")])
+    assert request["url"] == ("[base]/Patient?_has:Condition:patient:code=44054006"
+                              "&_has:Condition:patient:code=38341003")
+    assert request["parameters"] == {"_has:Condition:patient:code": "44054006,38341003"}
+    assert request["fan_out"]["operator"] == "and"
+    assert request["fan_out"]["searches"] == ["[base]/Condition?code=44054006", "[base]/Condition?code=38341003"]
+
+
+def test_or_between_conditions_is_a_union():
+    request = _search("patients with asthma or hypertension",
+                      [("asthma", "LABEL_1"), ("or", "CONDITION_OR"), ("hypertension", "LABEL_1")])
+    assert request["url"] == "[base]/Patient?_has:Condition:patient:code=195967001,38341003"
+    assert request["fan_out"]["operator"] == "or"
+
+
+def test_single_condition_has_no_fan_out():
+    request = _search("patients with diabetes", [("diabetes", "LABEL_1")])
+    assert request["parameters"] == {"_has:Condition:patient:code": "44054006"}
+    assert "fan_out" not in request
+
+
+def test_condition_parameter_stays_a_string_in_every_output():
+    params = _search("patients with diabetes and hypertension",
+                     [("diabetes", "LABEL_1"), ("hypertension", "LABEL_1")])["parameters"]
+    bundle = {"entry": [{"resource": {"resourceType": "Patient", "gender": "male"}}]}
+    assert simplify_patient_data(bundle, params)["patients"][0]["condition"] == "44054006,38341003"
+    assert patients_table(bundle, params).column("condition").to_pylist() == ["44054006,38341003"]
+
+
+def test_family_name_trigger_is_normalized():
+    # the normalizer used to be registered as FAMILY_TRIGGER, so every last-name query raised a TypeError
+    for trigger in ("last name", "surname", "maiden name"):
+        text = f"patients with {trigger} Garcia"
+        request = _search(text, [(trigger, "FAMILY_NAME_TRIGGER"), ("Garcia", "PERSON")])
+        assert request["parameters"] == {"family": "Garcia"}
+
+
+def test_every_normalized_label_has_a_normalizer():
+    prompt = PatientPrompt("search")
+    text = "patients with trigger John Smith"
+    for label in prompt.entity_to_normalize:
+        entities = _entities(text, [("trigger", label), ("John Smith", "PERSON")])
+        prompt._normalize_field_value(label, entities[0], entities)  # the identity fallback would raise
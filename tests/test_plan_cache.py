@@ -0,0 +1,41 @@
+from datetime import date
+
+from nlp_query import plan_cache
+from nlp_query.plan_cache import PlanCache, normalize_prompt
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("Female patients  born after 1990 .") == "female patients born after 1990"
+    assert normalize_prompt("find John Smith?") == "find John Smith"
+
+
+def test_prompts_normalizing_alike_share_an_entry():
+    cache = PlanCache(max_size=2)
+    cache.put(cache.key("Female patients", "[base]"), {"url": "[base]/Patient?gender=female"})
+    assert cache.get(cache.key("female patients.", "[base]")) == {"url": "[base]/Patient?gender=female"}
+    assert cache.get(cache.key("female patients", "http://other")) is None
+
+
+def test_entries_are_copied_and_evicted():
+    cache = PlanCache(max_size=1)
+    cache.put("a", {"parameters": {"gender": "male"}})
+    cache.get("a")["parameters"]["gender"] = "female"
+    assert cache.get("a") == {"parameters": {"gender": "male"}}
+    cache.put("b", {})
+    assert cache.get("a") is None
+
+
+def test_new_year_invalidates_plans(monkeypatch):
+    cache = PlanCache()
+    key = cache.key("patients older than 65", "[base]")
+    cache.put(key, {"parameters": {"birthdate": "lt1961"}})
+
+    class NextYear(date):
+        @classmethod
+        def today(cls):
+            return date(date.today().year + 1, 1, 1)
+
+    monkeypatch.setattr(plan_cache, "date", NextYear)
+    new_key = cache.key("patients older than 65", "[base]")
+    assert new_key != key
+    assert cache.get(new_key) is None and cache.entries == {}
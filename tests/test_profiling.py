@@ -0,0 +1,44 @@
+import json
+import os
+import time
+
+from app.profiling import RequestProfile, prune_profiles, record_stage
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+    record_stage("spin", 0.001)
+
+
+def test_sample_collects_stacks_and_stages():
+    profile = RequestProfile(interval=0.001)
+    profile.sample(_busy, 0.05, stage="dispatch")
+    summary = profile.as_dict()
+    assert summary["samples"] > 0 and "_busy" in summary["collapsed"]
+    assert set(summary["stages_ms"]) == {"dispatch", "spin"}
+    record_stage("spin", 1.0)  # not a profiled thread
+    assert profile.as_dict()["stages_ms"]["spin"] == 1.0
+
+
+def test_save_names_files_by_start_time_and_id(tmp_path):
+    profile = RequestProfile()
+    base = profile.save(str(tmp_path))
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(profile.started_at))
+    assert os.path.basename(base) == f"{stamp}-{profile.id}"
+    assert json.loads(open(f"{base}.json").read())["id"] == profile.id
+    assert os.path.exists(f"{base}.collapsed")
+
+
+def test_only_the_newest_profiles_are_kept(tmp_path):
+    bases = []
+    for i in range(5):
+        profile = RequestProfile()
+        profile.started_at = 1_700_000_000 + i
+        bases.append(os.path.basename(profile.save(str(tmp_path), max_profiles=3)))
+    (tmp_path / "notes.txt").write_text("kept")
+    assert sorted(os.listdir(tmp_path)) == sorted([f"{b}{ext}" for b in bases[2:] for ext in (".collapsed", ".json")]
+                                                  + ["notes.txt"])
+    prune_profiles(str(tmp_path), 0)
+    assert os.listdir(tmp_path) == ["notes.txt"]
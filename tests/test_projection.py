@@ -0,0 +1,62 @@
+import copy
+
+from app import fast_simplify
+from app.columnar import patients_table
+from app.replica import project
+from app.utils import SIMPLIFIED_PATIENT_ELEMENTS, simplify_patient_data
+from benchmarks.corpus import synthetic_bundle
+
+PARAMS = {"_has:Condition:patient:code": "44054006", "gender": "female"}
+
+FULL_PATIENT = {
+    "resourceType": "Patient",
+    "id": "example",
+    "meta": {"versionId": "3", "lastUpdated": "2024-01-01T00:00:00Z", "profile": ["http://example.org/Patient"]},
+    "text": {"status": "generated", "div": "<div xmlns=\"http://www.w3.org/1999/xhtml\">Jane Doe</div>"},
+    "extension": [{"url": "http://hl7.org/fhir/us/core/StructureDefinition/us-core-birthsex", "valueCode": "F"}],
+    "identifier": [{"system": "urn:oid:1.2.36.146.595.217.0.1", "value": "12345"}],
+    "active": True,
+    "name": [{"use": "official", "family": "Doe", "given": ["Jane", "Q"], "prefix": ["Ms."]},
+             {"use": "maiden", "family": "Roe", "given": ["Jane"]}],
+    "telecom": [{"system": "phone", "value": "555-0100", "use": "home"}],
+    "gender": "female",
+    "birthDate": "1974-12-25",
+    "deceasedBoolean": False,
+    "address": [{"use": "home", "line": ["534 Erewhon St"], "city": "PleasantVille", "state": "Vic",
+                 "postalCode": "3999"},
+                {"use": "work", "city": "Melbourne", "state": "Vic"}],
+    "maritalStatus": {"coding": [{"code": "M"}]},
+    "contact": [{"relationship": [{"coding": [{"code": "N"}]}], "name": {"family": "Doe"}}],
+    "communication": [{"language": {"coding": [{"code": "en"}]}, "preferred": True}],
+    "generalPractitioner": [{"reference": "Practitioner/1"}],
+    "managingOrganization": {"reference": "Organization/1"},
+}
+
+
+def _bundle(resources):
+    return {"resourceType": "Bundle", "type": "searchset",
+            "entry": [{"fullUrl": f"Patient/{resource['id']}", "resource": resource} for resource in resources]}
+
+
+def _projected(bundle):
+    projected = copy.deepcopy(bundle)
+    for entry in projected["entry"]:
+        entry["resource"] = project(entry["resource"], SIMPLIFIED_PATIENT_ELEMENTS)
+    return projected
+
+
+def test_projected_patient_simplifies_identically():
+    full = _bundle([FULL_PATIENT])
+    projected = _projected(full)
+    assert set(projected["entry"][0]["resource"]) == {"resourceType", "id", "meta", *SIMPLIFIED_PATIENT_ELEMENTS}
+    assert simplify_patient_data(projected, PARAMS) == simplify_patient_data(full, PARAMS)
+    assert simplify_patient_data(full, PARAMS)["patients"][0]["name"] == "Jane Doe"
+
+
+def test_projection_keeps_every_field_any_simplifier_reads():
+    full = synthetic_bundle(300)
+    full["entry"].append({"resource": FULL_PATIENT})
+    projected = _projected(full)
+    assert simplify_patient_data(projected, PARAMS) == simplify_patient_data(full, PARAMS)
+    assert fast_simplify.simplify_patient_data(projected, PARAMS) == fast_simplify.simplify_patient_data(full, PARAMS)
+    assert patients_table(projected, PARAMS).equals(patients_table(full, PARAMS))
@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+from app.replica import FHIRReplica
+
+BASE = "http://fhir.test/baseR4"
+
+
+def _patient(pid, **fields):
+    return {"resourceType": "Patient", "id": pid, **fields}
+
+
+def _condition(cid, pid, code, onset):
+    return {"resourceType": "Condition", "id": cid, "subject": {"reference": f"urn:uuid:{pid}"},
+            "code": {"coding": [{"system": "http://snomed.info/sct", "code": code}]}, "onsetDateTime": onset}
+
+
+@pytest.fixture
+def replica(tmp_path):
+    patients = [
+        _patient("p1", gender="female", birthDate="1950-04-02", name=[{"given": ["Maria"], "family": "Garcia"}],
+                 address=[{"city": "Boston", "state": "MA"}],
+                 generalPractitioner=[{"reference": "Practitioner/dr1", "display": "Dr. John Smith"}]),
+        _patient("p2", gender="male", birthDate="1990-07-15", name=[{"given": ["John"], "family": "Smith"}],
+                 address=[{"city": "Austin", "state": "TX"}], managingOrganization={"reference": "Organization/o1"}),
+        _patient("p3", gender="female", birthDate="1995-01-01", deceasedDateTime="2019-05-01T00:00:00Z",
+                 telecom=[{"system": "phone", "value": "5551234567"}], identifier=[{"value": "MRN4821X"}]),
+    ]
+    conditions = [
+        _condition("c1", "p1", "44054006", "2012-03-01"),
+        _condition("c2", "p1", "38341003", "2016-03-01"),
+        _condition("c3", "p2", "44054006", "2020-03-01"),
+        _condition("c4", "p3", "38341003", "2010-03-01"),
+    ]
+    bundle = tmp_path / "synthea.json"
+    bundle.write_text(json.dumps({"resourceType": "Bundle", "type": "transaction",
+                                  "entry": [{"fullUrl": f"urn:uuid:{r['id']}", "resource": r}
+                                            for r in patients + conditions]}))
+    ndjson = tmp_path / "extra.ndjson"
+    ndjson.write_text(json.dumps({"resourceType": "Observation", "id": "o1"}) + "\n")
+    store = FHIRReplica(str(tmp_path / "replica.sqlite"))
+    counts = store.import_paths([str(bundle), str(ndjson)])
+    assert counts == {"Patient": 3, "Condition": 4, "skipped": 1}
+    return store
+
+
+def _ids(replica, query):
+    bundle = replica.search(f"{BASE}/{query}")
+    return sorted(entry["resource"]["id"] for entry in bundle["entry"] if entry["search"]["mode"] == "match")
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("Patient?gender=female", ["p1", "p3"]),
+    ("Patient?birthdate=lt1966-01-01", ["p1"]),
+    ("Patient?birthdate=gt1990-12-31", ["p3"]),
+    ("Patient?birthdate=1990", ["p2"]),
+    ("Patient?birthdate=ge1990&birthdate=le1994", ["p2"]),
+    ("Patient?address=boston", ["p1"]),
+    ("Patient?address-state=TX", ["p2"]),
+    ("Patient?name=Mar", ["p1"]),
+    ("Patient?name=John%20Smith", ["p2"]),
+    ("Patient?deceased=true&deceased-date=2019", ["p3"]),
+    ("Patient?identifier=MRN4821X", ["p3"]),
+    ("Patient?phone=5551234567", ["p3"]),
+    ("Patient?address:missing=true", ["p3"]),
+    ("Patient?general-practitioner=Smith", ["p1"]),
+    ("Patient?general-practitioner=dr1", ["p1"]),
+    ("Patient?general-practitioner=Nobody", []),
+    ("Patient?organization=Organization/o1", ["p2"]),
+    ("Patient?_has:Condition:patient:code=44054006", ["p1", "p2"]),
+    ("Patient?_has:Condition:patient:code=44054006&_has:Condition:patient:code=38341003", ["p1"]),
+    ("Patient?_has:Condition:patient:code=44054006,38341003", ["p1", "p2", "p3"]),
+    ("Condition?code=44054006&onset-date=lt2015-01-01", ["c1"]),
+    ("Condition?code=38341003&subject:Patient.gender=female", ["c2", "c4"]),
+])
+def test_search_matches(replica, query, expected):
+    assert _ids(replica, query) == expected
+
+
+def test_include_and_paging(replica):
+    bundle = replica.search(f"{BASE}/Condition?code=44054006,38341003&_include=Condition:subject&_count=2")
+    assert bundle["total"] == 4
+    modes = [entry["search"]["mode"] for entry in bundle["entry"]]
+    assert modes == ["match", "match", "include"]  # c1 and c2 share their subject
+    next_url = next(link["url"] for link in bundle["link"] if link["relation"] == "next")
+    second = replica.search(next_url)
+    assert [e["resource"]["id"] for e in second["entry"] if e["search"]["mode"] == "match"] == ["c3", "c4"]
+    assert not any(link["relation"] == "next" for link in second["link"])
+
+
+def test_summary_count_and_elements(replica):
+    assert replica.search(f"{BASE}/Patient?gender=female&_summary=count") == {
+        "resourceType": "Bundle", "type": "searchset", "total": 2,
+        "link": [{"relation": "self", "url": f"{BASE}/Patient?gender=female&_summary=count"}]}
+    resource = replica.search(f"{BASE}/Patient?_id=p1&_elements=gender")["entry"][0]["resource"]
+    assert resource == {"resourceType": "Patient", "id": "p1", "gender": "female"}
+
+
+def test_unsupported_filter_is_rejected(replica):
+    status, body = replica.respond(f"{BASE}/Patient?link=Patient/p9&_summary=count")
+    assert status == 400
+    assert "link" in json.loads(body)["issue"][0]["diagnostics"]
+
+
+def test_shaping_parameters_are_reported(replica):
+    bundle = replica.search(f"{BASE}/Patient?gender=male&_sort=birthdate")
+    outcome = bundle["entry"][-1]
+    assert outcome["search"]["mode"] == "outcome"
+    assert _ids(replica, "Patient?gender=male&_sort=birthdate") == ["p2"]
+
+
+def test_errors(replica):
+    assert replica.respond(f"{BASE}/Patient?birthdate=lt19x")[0] == 400
+    assert replica.respond(f"{BASE}/Observation?code=1")[0] == 404
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.scheduler import MicroBatcher
+from benchmarks.stand_ins import stand_in_components
+from nlp_query.dispatcher import Dispatcher
+from nlp_query.patient_prompt import PatientPrompt
+
+
+class FakeDispatcher:
+    """Echoes each prompt, records the batches, and can be held or made to fail"""
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+        self.release = threading.Event()
+        self.release.set()
+
+    def dispatch_batch(self, prompts, base_url):
+        self.release.wait(5)
+        self.batches.append(list(prompts))
+        if self.fail_on in prompts:
+            raise ValueError(f"model failed on {self.fail_on}")
+        return [{"url": f"{base_url}/{prompt}"} for prompt in prompts]
+
+
+def run(scenario, dispatcher, **options):
+    async def main():
+        batcher = MicroBatcher(dispatcher, "[base]", **options)
+        await batcher.start()
+        try:
+            return await scenario(batcher)
+        finally:
+            dispatcher.release.set()
+            await batcher.stop()
+    return asyncio.run(main())
+
+
+def test_batches_fill_up_to_max_size():
+    dispatcher = FakeDispatcher()
+
+    async def scenario(batcher):
+        results = await asyncio.gather(*(batcher.submit(f"p{i}") for i in range(7)))
+        assert results == [{"url": f"[base]/p{i}"} for i in range(7)]  # each caller gets its own payload
+    run(scenario, dispatcher, max_batch_size=3, max_wait_ms=200)
+    assert [len(batch) for batch in dispatcher.batches] == [3, 3, 1]
+
+
+def test_window_closes_a_partial_batch():
+    dispatcher = FakeDispatcher()
+
+    async def scenario(batcher):
+        start = time.perf_counter()
+        assert await batcher.submit("a") == {"url": "[base]/a"}
+        assert 0.04 < time.perf_counter() - start < 0.5  # waited for the window, not for a full batch
+        assert await batcher.submit("b") == {"url": "[base]/b"}
+    run(scenario, dispatcher, max_batch_size=8, max_wait_ms=50)
+    assert dispatcher.batches == [["a"], ["b"]]
+
+
+def test_a_failing_batch_reaches_only_its_callers():
+    dispatcher = FakeDispatcher(fail_on="bad")
+
+    async def scenario(batcher):
+        results = await asyncio.gather(batcher.submit("bad"), batcher.submit("x"), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert await batcher.submit("good") == {"url": "[base]/good"}  # the loop keeps going
+    run(scenario, dispatcher, max_batch_size=2, max_wait_ms=200)
+
+
+def test_stop_fails_waiting_prompts():
+    dispatcher = FakeDispatcher()
+    dispatcher.release.clear()  # hold the first batch on the inference thread
+
+    async def scenario(batcher):
+        running = asyncio.ensure_future(batcher.submit("first"))
+        await asyncio.sleep(0.05)
+        queued = asyncio.ensure_future(batcher.submit("second"))
+        await asyncio.sleep(0.05)
+        await batcher.stop()
+        for future in (running, queued):
+            with pytest.raises(RuntimeError, match="stopped"):
+                await future
+        with pytest.raises(RuntimeError, match="not running"):
+            await batcher.submit("late")
+    run(scenario, dispatcher, max_batch_size=1, max_wait_ms=0)
+
+
+def test_a_cancelled_caller_does_not_affect_the_batch():
+    dispatcher = FakeDispatcher()
+    dispatcher.release.clear()
+
+    async def scenario(batcher):
+        gone = asyncio.ensure_future(batcher.submit("gone"))
+        stays = asyncio.ensure_future(batcher.submit("stays"))
+        await asyncio.sleep(0.05)
+        gone.cancel()
+        dispatcher.release.set()
+        assert await stays == {"url": "[base]/stays"}
+    run(scenario, dispatcher, max_batch_size=2, max_wait_ms=200)
+
+
+def test_dispatcher_returns_a_failing_prompt_as_its_own_error(monkeypatch):
+    process = PatientPrompt.process
+
+    def fragile(self, entities, base_url="[base]"):
+        if any(ent["text"].lower() == "female" for ent in entities):
+            raise KeyError("boom")
+        return process(self, entities, base_url)
+
+    monkeypatch.setattr(PatientPrompt, "process", fragile)
+    dispatcher = Dispatcher(**stand_in_components())
+    prompts = ["female patients", "patients with diabetes", "female patients"]
+    results = dispatcher.dispatch_batch(prompts, "[base]")
+    assert results[0]["exception"] == results[2]["exception"] == "KeyError"
+    assert results[1]["url"].startswith("[base]/Patient?_has:Condition:patient:code=44054006")
+    assert len(dispatcher.plan_cache.entries) == 1  # the failure isn't cached
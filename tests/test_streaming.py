@@ -0,0 +1,141 @@
+import asyncio
+import json
+
+import pytest
+
+from app.fhir_client import FHIRClient, FHIRResponseError
+from app.streaming import stream_patient_pages
+from app.utils import iter_bundle_resources, simplify_patient_data
+from fhir_stub import StubFHIRServer, reply
+
+
+def patient(id, gender="female", city="Boston"):
+    return {"resourceType": "Patient", "id": id, "gender": gender, "birthDate": "1980-05-01",
+            "name": [{"family": f"Family{id}", "given": ["Ann"]}], "address": [{"city": city, "state": "MA"}]}
+
+
+def page(base_url, patients, next_path=None):
+    bundle = {"resourceType": "Bundle", "type": "searchset",
+              "entry": [{"resource": resource, "search": {"mode": "match"}} for resource in patients]}
+    if next_path:
+        bundle["link"] = [{"relation": "self", "url": "ignored"},
+                          {"relation": "next", "url": f"{base_url}{next_path}"}]
+    return bundle
+
+
+def run(scenario):
+    """Run `scenario(server, client)` against a fresh stub server"""
+    async def main():
+        server = await StubFHIRServer().start()
+        client = FHIRClient(max_retries=0, backoff_base=0.001)
+        try:
+            return await scenario(server, client)
+        finally:
+            await client.close()
+            await server.stop()
+    return asyncio.run(main())
+
+
+async def records(stream) -> list:
+    lines = [line async for line in stream]
+    assert all(line.endswith(b"\n") and line.count(b"\n") == 1 for line in lines)
+    return [json.loads(line) for line in lines]
+
+
+def test_follows_next_links_and_writes_ndjson():
+    async def scenario(server, client):
+        base = server.base_url
+        server.script("/Patient", reply(200, page(base, [patient("1"), patient("2", "male")], "/page/2")))
+        server.script("/page/2", reply(200, page(base, [patient("3", city="Austin")])))
+        stream = await stream_patient_pages(client, f"{base}/Patient?gender=female", {"gender": "female"},
+                                            page_size=2)
+        output = await records(stream)
+        assert server.hits[0].endswith("/Patient?gender=female&_count=2")
+        assert [record["type"] for record in output] == [
+            "query", "patient", "patient", "summary", "patient", "summary", "summary"]
+        assert output[0] == {"type": "query", "data": {"gender": "female"}}
+        assert [record["data"]["name"] for record in output if record["type"] == "patient"] == [
+            "Ann Family1", "Ann Family2", "Ann Family3"]
+        assert output[3]["page"] == 1 and output[3]["data"]["total_patients"] == 2
+        assert output[5]["page"] == 2 and output[5]["data"]["total_patients"] == 3
+        final = output[-1]
+        assert final["final"] is True and final["pages"] == 2
+        assert final["data"]["gender_distribution"] == {"female": 2, "male": 1}
+        assert final["data"]["locations"]["cities"] == {"Boston": 2, "Austin": 1}
+    run(scenario)
+
+
+def test_next_page_is_requested_while_the_current_one_is_consumed():
+    async def scenario(server, client):
+        base = server.base_url
+        server.script("/Patient", reply(200, page(base, [patient("1")], "/page/2")))
+        server.script("/page/2", reply(200, page(base, [patient("2")]), delay=0.3))
+        stream = await stream_patient_pages(client, f"{base}/Patient", {}, page_size=1)
+        output = [json.loads(await stream.__anext__()) for _ in range(3)]  # query, patient, page 1 summary
+        assert output[-1]["type"] == "summary" and output[-1]["page"] == 1
+        await asyncio.sleep(0.1)
+        # page 2 is already in flight although the consumer hasn't asked for it yet
+        assert server.count("/page/2") == 1
+        rest = await records(stream)
+        assert rest[-1]["pages"] == 2
+    run(scenario)
+
+
+def test_max_pages_stops_following_links():
+    async def scenario(server, client):
+        base = server.base_url
+        server.script("/Patient", reply(200, page(base, [patient("1")], "/page/2")))
+        server.script("/page/2", reply(200, page(base, [patient("2")], "/page/3")))
+        server.script("/page/3", reply(200, page(base, [patient("3")])))
+        stream = await stream_patient_pages(client, f"{base}/Patient", {}, page_size=1, max_pages=2)
+        output = await records(stream)
+        assert server.count("/page/3") == 0
+        assert output[-1] == {"type": "summary", "final": True, "pages": 2, "data": output[-2]["data"]}
+        assert output[-1]["data"]["total_patients"] == 2
+    run(scenario)
+
+
+def test_first_page_error_is_raised_before_streaming():
+    async def scenario(server, client):
+        server.script("/Patient", reply(500, "down"))
+        with pytest.raises(FHIRResponseError):
+            await stream_patient_pages(client, f"{server.base_url}/Patient", {}, page_size=1)
+    run(scenario)
+
+
+def test_later_page_error_is_reported_in_band():
+    async def scenario(server, client):
+        base = server.base_url
+        server.script("/Patient", reply(200, page(base, [patient("1")], "/page/2")))
+        server.script("/page/2", reply(500, "down"))
+        output = await records(await stream_patient_pages(client, f"{base}/Patient", {}, page_size=1))
+        assert [record["type"] for record in output] == ["query", "patient", "summary", "error", "summary"]
+        assert output[3]["page"] == 2 and "500" in output[3]["detail"]
+        assert output[-1]["final"] is True and output[-1]["pages"] == 1
+    run(scenario)
+
+
+def test_only_patient_entries_are_simplified():
+    bundle = {"resourceType": "Bundle", "entry": [
+        {"resource": patient("1")},
+        {"resource": {"resourceType": "OperationOutcome", "issue": [{"severity": "warning"}]},
+         "search": {"mode": "outcome"}},
+        {"resource": {"resourceType": "Condition", "id": "c1"}, "search": {"mode": "include"}},
+        {"resource": {}},
+        {"resource": {"id": "2", "gender": "male"}},  # no resourceType: taken as the requested type
+    ]}
+    assert [resource.get("id") for resource in iter_bundle_resources(bundle, "Patient")] == ["1", "2"]
+    # without a type only the empty entry is skipped
+    assert [resource.get("resourceType", "-") for resource in iter_bundle_resources(bundle)] == [
+        "Patient", "OperationOutcome", "Condition", "-"]
+    assert simplify_patient_data(bundle, {})["summary"]["total_patients"] == 2
+
+
+def test_stream_skips_non_patient_entries():
+    async def scenario(server, client):
+        bundle = page(server.base_url, [patient("1")])
+        bundle["entry"].append({"resource": {"resourceType": "OperationOutcome"}, "search": {"mode": "outcome"}})
+        server.script("/Patient", reply(200, bundle))
+        output = await records(await stream_patient_pages(client, f"{server.base_url}/Patient", {}, page_size=5))
+        assert [record["type"] for record in output] == ["query", "patient", "summary", "summary"]
+    run(scenario)
@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime
+
+from app.fhir_client import FHIRClient
+from app.summary import age_group_filters, count_patient_summary
+from app.utils import calculate_age, categorize_age
+from fhir_stub import StubFHIRServer, reply
+
+COHORT = "_has:Condition:patient:code=44054006"
+
+
+def test_age_groups_are_birth_year_ranges():
+    assert age_group_filters(2024) == {
+        "0-18": [("birthdate", "ge2006-01-01")],
+        "19-35": [("birthdate", "ge1989-01-01"), ("birthdate", "le2005-12-31")],
+        "36-50": [("birthdate", "ge1974-01-01"), ("birthdate", "le1988-12-31")],
+        "51-65": [("birthdate", "ge1959-01-01"), ("birthdate", "le1973-12-31")],
+        "66+": [("birthdate", "le1958-12-31")],
+        "unknown": [("birthdate:missing", "true")],
+    }
+
+
+def test_age_group_bounds_match_categorize_age():
+    for label, params in age_group_filters().items():
+        if label == "unknown":
+            continue
+        bounds = {value[:2]: int(value[2:6]) for _, value in params}
+        for birth_year in bounds.values():
+            assert categorize_age(calculate_age(f"{birth_year}-06-15")) == label
+        if "ge" in bounds:
+            assert categorize_age(calculate_age(f"{bounds['ge'] - 1}-06-15")) != label
+        if "le" in bounds:
+            assert categorize_age(calculate_age(f"{bounds['le'] + 1}-06-15")) != label
+
+
+def test_counts_come_from_summary_count_searches():
+    year = datetime.now().year
+    # total per search, keyed on the parameter it adds to the cohort filter (two-sided age
+    # buckets on their lower bound); the cohort count itself adds none
+    totals = {None: 20, "gender=male": 8, "gender=female": 7, "gender=other": 0, "gender=unknown": 1,
+              "gender:missing=true": 4, "birthdate:missing=true": 2,
+              f"birthdate=ge{year - 18}-01-01": 5, f"birthdate=ge{year - 35}-01-01": 0,
+              f"birthdate=ge{year - 50}-01-01": 6, f"birthdate=ge{year - 65}-01-01": 3,
+              f"birthdate=le{year - 66}-12-31": 4}
+
+    def count(request):
+        params = request.query_string.split("&")
+        assert params[0] == COHORT and params[-1] == "_summary=count"
+        extra = params[1] if len(params) > 2 else None
+        return {"resourceType": "Bundle", "type": "searchset", "total": totals[extra]}
+
+    async def main():
+        server = await StubFHIRServer().start()
+        server.script("/Patient", reply(200, count))
+        client = FHIRClient(max_retries=0)
+        try:
+            fhir_request = {"url": f"{server.base_url}/Patient?{COHORT}&_elements=name,gender&_count=20",
+                            "parameters": {"_has:Condition:patient:code": "44054006"}}
+            return await count_patient_summary(client, fhir_request), server.hits
+        finally:
+            await client.close()
+            await server.stop()
+
+    result, hits = asyncio.run(main())
+    # the cohort, five gender searches and six age searches, without the response-shaping params
+    assert len(hits) == 12
+    assert not any("_elements" in hit or "_count=" in hit for hit in hits)
+    assert result["query"] == {"_has:Condition:patient:code": "44054006"}
+    assert result["patients"] == []
+    summary = result["summary"]
+    assert summary["total_patients"] == 20
+    # gender:missing is reported as "unknown" like simplify_patient does, and zero counts are dropped
+    assert summary["gender_distribution"] == {"male": 8, "female": 7, "unknown": 5}
+    assert summary["age_distribution"] == {"0-18": 5, "36-50": 6, "51-65": 3, "66+": 4, "unknown": 2}
+    assert summary["locations"] == {"cities": {}, "states": {}}
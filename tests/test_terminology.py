@@ -0,0 +1,54 @@
+import random
+import string
+from difflib import get_close_matches
+
+from nlp_query.patterns.disease_codes import DISEASE_CODE
+from nlp_query.terminology import TerminologyIndex, get_default_index, load_vocabulary
+
+
+def _variants(seed=0):
+    """Every disease term, typo'd copies, prefixes and single words, plus short random strings"""
+    rng = random.Random(seed)
+    inputs = set()
+    for term in DISEASE_CODE:
+        inputs.update(term[:n] for n in range(1, len(term) + 1))
+        inputs.update(term.split())
+        for _ in range(10):
+            chars, i = list(term), rng.randrange(len(term))
+            chars[i:i + 1] = rng.choice([[], [rng.choice(string.ascii_lowercase)], [chars[i], chars[i]]])
+            inputs.add("".join(chars))
+    inputs.update("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randrange(1, 6)))
+                  for _ in range(300))
+    return sorted(text for text in inputs if text.strip() == text)
+
+
+def test_default_index_matches_get_close_matches():
+    index = get_default_index()
+    for text in _variants():
+        expected = get_close_matches(text, list(DISEASE_CODE), n=1, cutoff=0.6)
+        got = index.lookup(text, k=1, cutoff=0.6)
+        assert [term for term, _, _ in got] == expected, text
+
+
+def test_ties_break_like_difflib():
+    index = TerminologyIndex.build([("hepatitis b", "b"), ("hepatitis c", "c")])
+    assert [code for _, code, _ in index.lookup("hepatitis", k=2)] == ["c", "b"]
+
+
+def test_short_query_without_shared_trigrams_is_scanned():
+    index = TerminologyIndex.build([("stroke", "1"), ("osteoporosis", "2")])
+    assert index.lookup("oste", k=1) == [("stroke", "1", 0.6)]
+    assert index.lookup("oste", k=1, max_scan=0) == []
+
+
+def test_save_load_and_vocabulary_files(tmp_path):
+    vocabulary = tmp_path / "vocabulary.tsv"
+    vocabulary.write_text("# code\tterm\n44054006\tDiabetes mellitus\n44054006\tdiabète\n38341003\thypertension\n",
+                          encoding="utf-8")
+    assert load_vocabulary(str(vocabulary))[1] == ("diabète", "44054006")
+    TerminologyIndex.from_vocabulary_file(str(vocabulary)).save(str(tmp_path / "index"))
+    index = TerminologyIndex.load(str(tmp_path / "index"))
+    assert len(index) == 3
+    assert index.lookup("diabete", k=1)[0][:2] == ("diabète", "44054006")
+    assert index.lookup("Hypertensoin", k=1)[0][1] == "38341003"
+    assert index.lookup("xyz") == []